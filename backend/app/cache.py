@@ -0,0 +1,94 @@
+"""讀取密集的統計端點快取
+
+- TTL 到期前直接回傳快取值
+- 同一個 key 同時有多個請求時只執行一次查詢（single-flight），其餘等待同一結果
+- 寫入端呼叫 ``invalidate(namespace)`` 立即讓該命名空間的快取失效；失效前已
+  發出的查詢結果不會再寫回快取，避免舊資料覆蓋
+- ``add_listener`` 註冊的 callback 在每次失效時被呼叫（例如推播 stats_delta）
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+from app.config import settings
+
+# 快取命名空間，key 的第一個元素
+TEST_RECORD_STATS = "test_record_stats"
+SENSOR_RUN_STATS = "sensor_run_stats"
+
+
+class TTLCache:
+    """以 tuple 為 key、第一個元素為命名空間的 async TTL 快取"""
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl = ttl_seconds
+        self._entries: Dict[Tuple[Hashable, ...], Tuple[float, Any]] = {}
+        self._inflight: Dict[Tuple[Hashable, ...], asyncio.Future] = {}
+        self._generations: Dict[Hashable, int] = {}
+        self._listeners: List[Callable[[Hashable], None]] = []
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    async def get_or_load(self, key: Tuple[Hashable, ...], loader: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        pending = self._inflight.get(key)
+        if pending:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        namespace = key[0]
+        generation = self._generations.get(namespace, 0)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await loader()
+        except BaseException as e:
+            # 讓等待中的請求一併得到錯誤，而不是永遠等待
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError("cache load cancelled"))
+            future.exception()
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+        future.set_result(value)
+        if self.ttl > 0 and self._generations.get(namespace, 0) == generation:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+        return value
+
+    def add_listener(self, callback: Callable[[Hashable], None]):
+        """註冊失效通知；callback 以命名空間呼叫，須為同步且不可丟出例外"""
+        self._listeners.append(callback)
+
+    def invalidate(self, *namespaces: Hashable):
+        """清除指定命名空間的快取與進行中的查詢"""
+        for namespace in namespaces:
+            for callback in self._listeners:
+                callback(namespace)
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+            for key in [k for k in self._entries if k[0] == namespace]:
+                del self._entries[key]
+            for key in [k for k in self._inflight if k[0] == namespace]:
+                del self._inflight[key]
+        self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ttl_seconds": self.ttl,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+        }
+
+
+stats_cache = TTLCache(settings.STATS_CACHE_TTL_SECONDS)
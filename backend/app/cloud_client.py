@@ -0,0 +1,87 @@
+"""
+雲端 API 共用 HTTP client
+
+整個應用程式共用一個連線池（於 main.py lifespan 建立與關閉），
+各次上傳與各分段重用 keep-alive / HTTP/2 連線，不必每次重新 TCP + TLS 握手。
+"""
+
+import logging
+from typing import Optional
+
+import httpx
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _accept_encoding() -> str:
+    """回應壓縮協商：只宣告 httpx 能解壓的格式"""
+    encodings = ["gzip", "deflate"]
+    try:
+        import brotli  # noqa: F401
+        encodings.append("br")
+    except ImportError:
+        pass
+    return ", ".join(encodings)
+
+
+class CloudClient:
+    """延遲建立的 httpx.AsyncClient 包裝"""
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self.http2 = False
+
+    def _create(self) -> httpx.AsyncClient:
+        self.http2 = settings.CLOUD_HTTP2 and _http2_available()
+        if settings.CLOUD_HTTP2 and not self.http2:
+            logger.warning("CLOUD_HTTP2 is enabled but 'h2' is not installed; using HTTP/1.1")
+        return httpx.AsyncClient(
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=settings.CLOUD_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.CLOUD_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.CLOUD_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            timeout=httpx.Timeout(
+                settings.CLOUD_UPLOAD_TIMEOUT_SECONDS,
+                connect=settings.CLOUD_CONNECT_TIMEOUT_SECONDS,
+            ),
+            headers=self._default_headers(),
+        )
+
+    @staticmethod
+    def _default_headers() -> dict:
+        headers = {"Accept-Encoding": _accept_encoding()}
+        if settings.CLOUD_API_KEY:
+            headers["Authorization"] = f"Bearer {settings.CLOUD_API_KEY}"
+        return headers
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """取得共用 client；lifespan 外（例如命令列工具）第一次使用時建立"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._create()
+        return self._client
+
+    async def start(self):
+        self.client
+        logger.info(f"Cloud client ready (http2={self.http2}, "
+                    f"max_connections={settings.CLOUD_MAX_CONNECTIONS})")
+
+    async def stop(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+cloud_client = CloudClient()
@@ -0,0 +1,417 @@
+"""
+雲端上傳管線
+
+待上傳變更依 outbox id 分段讀出，每段依 ``CLOUD_UPLOAD_FORMAT`` 編碼壓縮後送出，
+同時最多 ``CLOUD_UPLOAD_CONCURRENCY`` 段在傳輸中。收到雲端確認後才推進
+高水位游標並以範圍更新標記記錄，因此長時間斷線累積的資料會逐段消化，
+中途失敗也只需重傳尚未確認的部分。
+"""
+
+import asyncio
+import bisect
+import logging
+import random
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from app.cloud_client import cloud_client
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.leader import leader
+from app.services import CloudUploadService
+from app.upload_signal import upload_signal
+from app.wire_formats import WireFormat, get_wire_format
+
+logger = logging.getLogger(__name__)
+
+_upload_lock = asyncio.Lock()
+
+# 游標之後、上次執行已確認的 outbox 範圍 (start, end]（前面有失敗段擋住游標）。
+# 依 start 排序且互不重疊；下次執行略過這些變更，只重送未確認的部分。
+# 重啟後清空，最差情況為重送一次。
+_acknowledged_ahead: List[Tuple[int, int]] = []
+
+
+def _merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """排序並合併重疊或相接的 (start, end] 範圍"""
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _is_acknowledged_ahead(outbox_id: int) -> bool:
+    """outbox_id 是否落在已確認的範圍內；範圍已合併，二分搜尋即可"""
+    index = bisect.bisect_left(_acknowledged_ahead, (outbox_id,)) - 1
+    return index >= 0 and _acknowledged_ahead[index][0] < outbox_id <= _acknowledged_ahead[index][1]
+
+
+class ChunkUploadError(Exception):
+    """雲端未確認某一段上傳"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class CircuitOpenError(ChunkUploadError):
+    """斷路器開啟中，暫停上傳"""
+
+    def __init__(self):
+        super().__init__("circuit breaker open", retryable=False)
+
+
+class CircuitBreaker:
+    """連續失敗達門檻後暫停上傳 reset_seconds 秒，之後只放行一個試探請求
+
+    試探成功即恢復；試探失敗則重新計時。
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.times_opened = 0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def end_probe(self):
+        """試探請求結束但未判定成敗時，讓下一個請求可以再試探"""
+        self._probing = False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self._probing or (self.opened_at is None and self.consecutive_failures >= self.failure_threshold):
+            logger.warning(f"Cloud upload circuit opened after {self.consecutive_failures} "
+                           f"consecutive failures; pausing {self.reset_seconds}s")
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+            self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+        }
+
+
+breaker = CircuitBreaker(settings.CLOUD_BREAKER_FAILURE_THRESHOLD, settings.CLOUD_BREAKER_RESET_SECONDS)
+
+
+def backoff_delay(attempt: int) -> float:
+    """第 attempt 次失敗後的等待秒數：指數退避 + full jitter"""
+    ceiling = min(settings.CLOUD_RETRY_MAX_DELAY_SECONDS,
+                  settings.CLOUD_RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1))
+    return random.uniform(0, ceiling)
+
+
+class UploadSummary:
+    """單次上傳執行結果"""
+
+    def __init__(self):
+        self.uploaded = 0
+        self.chunks = 0
+        self.failed_chunks = 0
+        self.errors: List[str] = []
+        # 每段的 batch_id / 筆數 / 嘗試次數 / 延遲，寫入上傳日誌
+        self.batches: List[Dict[str, Any]] = []
+
+    @property
+    def status(self) -> str:
+        if not self.errors:
+            return "SUCCESS"
+        return "PARTIAL" if self.uploaded else "FAILED"
+
+    @property
+    def error_message(self) -> Optional[str]:
+        return "; ".join(self.errors) if self.errors else None
+
+
+async def post_chunk(client: httpx.AsyncClient, body: bytes, batch_id: str, wire_format: WireFormat):
+    """送出一段已編碼的記錄；雲端回應 200 以外皆視為未確認"""
+    try:
+        response = await client.post(
+            settings.CLOUD_API_URL,
+            content=body,
+            headers={
+                **wire_format.headers,
+                # 雲端可依此對重送的同一段去重
+                "X-Batch-Id": batch_id,
+            },
+        )
+    except httpx.TransportError as e:
+        raise ChunkUploadError(f"{type(e).__name__}: {e}") from e
+    if response.status_code != 200:
+        # 4xx（逾時 / 限流除外）代表請求本身有問題，重試也不會成功
+        retryable = response.status_code >= 500 or response.status_code in (408, 429)
+        raise ChunkUploadError(f"HTTP {response.status_code}: {response.text[:500]}", retryable)
+
+
+class _Chunk:
+    """一段 outbox 範圍 (start_id, end_id] 與其中要送出的記錄"""
+
+    def __init__(self, start_id: int, end_id: int, rows: List[Any]):
+        self.start_id = start_id
+        self.end_id = end_id
+        self.rows = rows
+        self.acknowledged = False
+        self.attempts = 0
+        self.latency_ms: Optional[float] = None
+
+    @property
+    def batch_id(self) -> str:
+        return f"{self.start_id + 1}-{self.end_id}"
+
+
+def _select_records(rows: List[Any]) -> List[Any]:
+    """挑出本段要送的記錄
+
+    略過已刪除的記錄、上次執行已確認的變更；同一筆記錄多次變更只送一次。
+    """
+    records = {}
+    for row in rows:
+        if row.id is None:
+            continue
+        if _is_acknowledged_ahead(row.outbox_id):
+            continue
+        records[row.id] = row
+    return list(records.values())
+
+
+async def send_with_retry(client: httpx.AsyncClient, chunk: _Chunk):
+    """送出一段，暫時性失敗以指數退避重試；body 只編碼一次"""
+    wire_format = get_wire_format(settings.CLOUD_UPLOAD_FORMAT)
+    body = await asyncio.to_thread(wire_format.encode, chunk.rows)
+    while True:
+        probing = breaker.state == "half_open"
+        if not breaker.allow():
+            raise CircuitOpenError()
+        chunk.attempts += 1
+        started = time.perf_counter()
+        try:
+            await post_chunk(client, body, chunk.batch_id, wire_format)
+        except ChunkUploadError as e:
+            chunk.latency_ms = (time.perf_counter() - started) * 1000
+            if not e.retryable:
+                raise
+            breaker.record_failure()
+            if chunk.attempts >= settings.CLOUD_RETRY_MAX_ATTEMPTS:
+                raise
+            delay = backoff_delay(chunk.attempts)
+            logger.warning(f"Batch {chunk.batch_id} attempt {chunk.attempts} failed ({e}); "
+                           f"retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+        finally:
+            if probing:
+                # 4xx、取消等結果不經過 record_*，仍要結束試探，否則斷路器不會再放行
+                breaker.end_probe()
+        chunk.latency_ms = (time.perf_counter() - started) * 1000
+        breaker.record_success()
+        return
+
+
+async def upload_pending_records(
+    chunk_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+) -> UploadSummary:
+    """分段上傳 outbox 中的待上傳變更
+
+    每段暫時性失敗時以指數退避 + jitter 重試（CLOUD_RETRY_*），連續失敗達門檻
+    由斷路器暫停上傳（CLOUD_BREAKER_*）。各段可能不依序完成，游標只推進到「從游標起連續都已確認」的位置；
+    失敗段之後已確認的段記在記憶體中，下次執行不再重送。
+    任一段重試用盡後不再送出新段（雲端多半已無法服務），已在傳輸中的段仍會完成。
+    """
+    # 排程補傳與 streaming 同步共用游標，同一時間只允許一個上傳流程
+    async with _upload_lock:
+        return await _upload_pending_records(chunk_size, concurrency)
+
+
+async def _upload_pending_records(chunk_size: Optional[int], concurrency: Optional[int]) -> UploadSummary:
+    chunk_size = chunk_size or settings.CLOUD_UPLOAD_CHUNK_SIZE
+    semaphore = asyncio.Semaphore(concurrency or settings.CLOUD_UPLOAD_CONCURRENCY)
+    summary = UploadSummary()
+    in_flight = set()
+    pending_chunks: List[_Chunk] = []
+    watermark_lock = asyncio.Lock()
+
+    async def advance_watermark():
+        async with watermark_lock:
+            if not pending_chunks or not pending_chunks[0].acknowledged:
+                return
+            count = 1
+            while count < len(pending_chunks) and pending_chunks[count].acknowledged:
+                count += 1
+            previous_id, last_id = pending_chunks[0].start_id, pending_chunks[count - 1].end_id
+            async with AsyncSessionLocal() as db:
+                await CloudUploadService.acknowledge(db, previous_id, last_id)
+            # commit 成功後才移除；寫入失敗時這些段仍留在 pending_chunks，結束時記入已確認範圍
+            del pending_chunks[:count]
+            _acknowledged_ahead[:] = [r for r in _acknowledged_ahead if r[1] > last_id]
+
+    async def send(client: httpx.AsyncClient, chunk: _Chunk):
+        error = None
+        try:
+            if chunk.rows:
+                await send_with_retry(client, chunk)
+            chunk.acknowledged = True
+            summary.uploaded += len(chunk.rows)
+            await advance_watermark()
+        except Exception as e:
+            error = str(e)
+            summary.failed_chunks += 1
+            summary.errors.append(f"batch {chunk.batch_id}: {e}")
+            logger.error(f"Batch {chunk.batch_id} upload failed after {chunk.attempts} attempt(s): {e}")
+        finally:
+            semaphore.release()
+            if chunk.attempts:
+                summary.batches.append({
+                    "batch_id": chunk.batch_id,
+                    "records_count": len(chunk.rows),
+                    "status": "SUCCESS" if chunk.acknowledged else "FAILED",
+                    "attempts": chunk.attempts,
+                    "latency_ms": round(chunk.latency_ms, 2) if chunk.latency_ms is not None else None,
+                    "error_message": error,
+                    "upload_time": datetime.now(),
+                })
+
+    if breaker.state == "open":
+        summary.errors.append("circuit breaker open")
+        return summary
+
+    client = cloud_client.client
+    async with AsyncSessionLocal() as db:
+        last_id = await CloudUploadService.get_cursor(db)
+    while True:
+        # 先取得傳輸名額再讀下一段，記憶體中最多只有 concurrency 段資料
+        await semaphore.acquire()
+        if summary.errors:
+            semaphore.release()
+            break
+        async with AsyncSessionLocal() as db:
+            rows = await CloudUploadService.get_pending_chunk(
+                db, last_id, chunk_size, settings.CLOUD_OUTBOX_SETTLE_SECONDS
+            )
+        if not rows:
+            semaphore.release()
+            break
+        chunk = _Chunk(last_id, rows[-1].outbox_id, _select_records(rows))
+        last_id = chunk.end_id
+        pending_chunks.append(chunk)
+        summary.chunks += 1
+        task = asyncio.create_task(send(client, chunk))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+    if in_flight:
+        await asyncio.gather(*in_flight)
+
+    # 被失敗段擋在游標之後、但已確認的段，下次執行略過
+    _acknowledged_ahead[:] = _merge_ranges(
+        _acknowledged_ahead + [(c.start_id, c.end_id) for c in pending_chunks if c.acknowledged]
+    )
+    return summary
+
+
+class CloudSyncStreamer:
+    """Streaming 同步模式：累積 CLOUD_SYNC_BATCH_SIZE 筆或 CLOUD_SYNC_FLUSH_MS 後上傳一批
+
+    排程的定時上傳仍保留，作為失敗或遺漏時的補傳。多 worker 時只有 leader 上傳。
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.flushed_records = 0
+        self.failed_flushes = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Cloud sync streaming: batch {settings.CLOUD_SYNC_BATCH_SIZE} records "
+                    f"or {settings.CLOUD_SYNC_FLUSH_MS} ms")
+
+    async def _run(self):
+        settle_seconds = settings.CLOUD_OUTBOX_SETTLE_SECONDS
+        flush_seconds = settings.CLOUD_SYNC_FLUSH_MS / 1000
+        while True:
+            # 其他 worker 的寫入不會通知本程序，至少每個 flush 週期檢查一次 outbox
+            upload_signal.retry_after(flush_seconds)
+            await upload_signal.wait_for_batch(settings.CLOUD_SYNC_BATCH_SIZE, flush_seconds)
+            if not leader.is_leader:
+                continue
+            flush_started = time.monotonic()
+            summary = await self.flush()
+            # 結算窗內的變更本次讀不到，窗過後再送一次；失敗時交由定時補傳
+            if summary and not summary.errors and upload_signal.last_change_at > flush_started - settle_seconds:
+                upload_signal.retry_after(settle_seconds)
+
+    async def flush(self) -> Optional[UploadSummary]:
+        try:
+            summary = await upload_pending_records()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed_flushes += 1
+            logger.error(f"Cloud sync flush error: {e}")
+            return None
+
+        self.flushes += 1
+        self.flushed_records += summary.uploaded
+        # 只記錄有重試或失敗的批次，避免每個微批次都寫一筆上傳日誌
+        retried = [batch for batch in summary.batches if batch["attempts"] > 1 or batch["status"] != "SUCCESS"]
+        if retried:
+            async with AsyncSessionLocal() as db:
+                await CloudUploadService.create_batch_logs(db, retried)
+        if summary.errors:
+            self.failed_flushes += 1
+        elif summary.uploaded:
+            logger.info(f"Cloud sync flushed {summary.uploaded} records")
+        return summary
+
+    async def stop(self):
+        if not self._task:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info("Cloud sync streaming stopped")
+
+
+cloud_sync = CloudSyncStreamer()
@@ -1,8 +1,15 @@
-from sqlalchemy import create_engine, inspect, text
+import logging
+import unicodedata
+from sqlalchemy import create_engine, func, inspect, literal_column, select, text
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.config import settings
+from app.sensor_verdict import STAGE_BITS, SensorVerdict, verdict_sql
 
+# 同步 engine 只用於啟動時的 init_db / migration
 engine = create_engine(
     settings.DATABASE_URL,
     pool_pre_ping=True,
@@ -11,16 +18,85 @@ engine = create_engine(
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+
+def async_database_url(url: str) -> str:
+    """將同步 driver 的 URL 換成對應的 async driver"""
+    scheme, separator, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + separator + rest
+
+
+# API 請求一律走 async engine，慢查詢不會阻塞 event loop 與 WebSocket 廣播
+async_engine = create_async_engine(
+    settings.ASYNC_DATABASE_URL or async_database_url(settings.DATABASE_URL),
+    pool_pre_ping=True,
+    pool_recycle=3600,
+)
+
+# commit 後不 expire，避免回應序列化時觸發 async 環境不允許的 lazy load
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession,
+                                       autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 
-def get_db():
+async def get_db():
     """Database session dependency"""
-    db = SessionLocal()
-    try:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+def upsert_statement(db, table, rows, index_elements, update):
+    """建立多筆 native upsert 語句。
+
+    MySQL 使用 ``INSERT ... ON DUPLICATE KEY UPDATE``；SQLite（開發 / 測試用）
+    使用 ``ON CONFLICT DO UPDATE``。``update`` 接收「本次欲寫入的值」
+    （MySQL 的 ``inserted`` / SQLite 的 ``excluded``），回傳要更新的欄位 dict。
+    """
+    if db.bind.dialect.name == "mysql":
+        stmt = mysql_insert(table).values(rows)
+        return stmt.on_duplicate_key_update(update(stmt.inserted))
+    stmt = sqlite_insert(table).values(rows)
+    return stmt.on_conflict_do_update(index_elements=index_elements, set_=update(stmt.excluded))
+
+
+def db_now(db, offset_seconds: float = 0):
+    """資料庫時鐘的「現在 + offset_seconds」
+
+    用於與 server_default=now() 的欄位比較，或跨 worker 共用的期限，不受各主機時鐘差影響。
+    """
+    if db.bind.dialect.name == "mysql":
+        return literal_column(f"NOW() + INTERVAL {int(offset_seconds * 1_000_000)} MICROSECOND")
+    # SQLite 的 CURRENT_TIMESTAMP 為 UTC，datetime('now') 同樣是 UTC
+    return func.datetime("now", f"{offset_seconds:+} seconds")
+
+
+def seconds_ago(db, seconds: float):
+    """資料庫時鐘的「現在 - seconds」"""
+    return db_now(db, -seconds)
+
+
+def _fold(value: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", value)
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def collation_key(db, *values: str) -> tuple:
+    """依資料庫的字串比對規則正規化 key，用來對應 SELECT 回傳的列與請求中的值
+
+    MySQL 預設 collation（utf8mb4_0900_ai_ci / utf8mb4_unicode_ci）不分大小寫與重音，
+    唯一索引把 'SN1'、'sn1' 視為同一個值，SELECT 回傳的是資料庫中存的寫法；
+    SQLite（開發 / 測試用）預設為二進位比對。
+    """
+    if db.bind.dialect.name == "mysql":
+        return tuple(_fold(value) for value in values)
+    return values
 
 
 def init_db():
@@ -35,30 +111,227 @@ def init_db():
                 conn.execute(text('ALTER TABLE test_records ADD COLUMN humidity DOUBLE NULL'))
             if 'pressure' not in cols:
                 conn.execute(text('ALTER TABLE test_records ADD COLUMN pressure DOUBLE NULL'))
+            log_cols = [c['name'] for c in insp.get_columns('cloud_upload_logs')]
+            if 'batch_id' not in log_cols:
+                conn.execute(text('ALTER TABLE cloud_upload_logs ADD COLUMN batch_id VARCHAR(50) NULL'))
+            if 'attempts' not in log_cols:
+                conn.execute(text('ALTER TABLE cloud_upload_logs ADD COLUMN attempts INTEGER NULL'))
+            if 'latency_ms' not in log_cols:
+                conn.execute(text('ALTER TABLE cloud_upload_logs ADD COLUMN latency_ms DOUBLE NULL'))
             conn.commit()
     except Exception:
         # Best-effort; skip if any issue
         pass
 
+    # create_all 不會替既有資料表補上新增的索引，逐表檢查後建立
+    try:
+        insp = inspect(engine)
+        migrate_measurement_key_collation()
+        measurement_indexes = {index['name'] for index in insp.get_indexes('test_measurements')}
+        if 'uq_test_measurements_record_key' not in measurement_indexes:
+            dedupe_rows('test_measurements', 'record_id', 'key')
+        item_indexes = {index['name'] for index in insp.get_indexes('sensor_test_items')}
+        if 'uq_sensor_test_items_run_stage' not in item_indexes:
+            dedupe_rows('sensor_test_items', 'run_id', 'stage')
+        for table in Base.metadata.sorted_tables:
+            existing_indexes = {index['name'] for index in insp.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(bind=engine)
+    except Exception:
+        pass
+
     # 相容舊版 Sensor session：早期會因未偵測到 sht41 而將已通過的
-    # session 留在 PENDING。以實際已儲存的測項終態重新計算。
+    # session 留在 PENDING。以判定 bitmask 重新計算，與寫入路徑使用同一套規則。
+    sensor_results_changed = False
     try:
+        run_cols = [c['name'] for c in inspect(engine).get_columns('sensor_test_runs')]
         with engine.begin() as conn:
-            conn.execute(text("""
-                UPDATE sensor_test_runs AS run
-                SET test_result = CASE
-                    WHEN EXISTS (
-                        SELECT 1 FROM sensor_test_items AS item
-                        WHERE item.run_id = run.id AND item.status = 'fail'
-                    ) THEN 'FAIL'
-                    WHEN EXISTS (
-                        SELECT 1 FROM sensor_test_items AS item
-                        WHERE item.run_id = run.id AND item.status = 'pass'
-                    ) THEN 'PASS'
-                    ELSE 'PENDING'
-                END
-                WHERE run.run_mode = 'session'
+            for column in ('passed_mask', 'failed_mask'):
+                if column not in run_cols:
+                    conn.execute(text(f'ALTER TABLE sensor_test_runs ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0'))
+        backfill_sensor_verdicts()
+        verdict = verdict_sql()
+        with engine.begin() as conn:
+            result = conn.execute(text(f"""
+                UPDATE sensor_test_runs
+                SET test_result = {verdict}
+                WHERE run_mode = 'session' AND test_result <> {verdict}
             """))
+            sensor_results_changed = result.rowcount > 0
     except Exception:
         # Sensor tables 尚未建立或 DB dialect 不支援時，不阻斷啟動。
         pass
+
+    rebuild_rollups(sensor_runs=sensor_results_changed)
+    backfill_measurements()
+    seed_upload_outbox()
+
+
+def _hour_bucket_sql(dialect_name: str, column: str) -> str:
+    """取整點的 SQL 運算式；SQLite 格式需與 SQLAlchemy DateTime 儲存格式一致"""
+    if dialect_name == "mysql":
+        return f"DATE_ADD(DATE({column}), INTERVAL HOUR({column}) HOUR)"
+    return f"strftime('%Y-%m-%d %H:00:00.000000', {column})"
+
+
+def rebuild_rollups(sensor_runs: bool = False):
+    """由原始資料重建每小時彙總表
+
+    彙總表為空（首次升級）時一律建立；``sensor_runs=True`` 表示 Sensor session
+    結果在啟動時被重新計算過，需重建 Sensor 彙總以保持一致。
+    """
+    try:
+        with engine.begin() as conn:
+            dialect_name = conn.dialect.name
+
+            if not conn.execute(text("SELECT 1 FROM test_record_hourly_stats LIMIT 1")).first():
+                bucket = _hour_bucket_sql(dialect_name, "test_time")
+                conn.execute(text(f"""
+                    INSERT INTO test_record_hourly_stats
+                        (bucket_hour, device_id, test_station, product_name, test_result, record_count)
+                    SELECT {bucket}, device_id, test_station, product_name, test_result, COUNT(*)
+                    FROM test_records
+                    GROUP BY {bucket}, device_id, test_station, product_name, test_result
+                """))
+
+            if sensor_runs or not conn.execute(text("SELECT 1 FROM sensor_run_hourly_stats LIMIT 1")).first():
+                bucket = _hour_bucket_sql(dialect_name, "started_at")
+                conn.execute(text("DELETE FROM sensor_run_hourly_stats"))
+                conn.execute(text(f"""
+                    INSERT INTO sensor_run_hourly_stats (bucket_hour, test_result, run_count)
+                    SELECT {bucket}, test_result, COUNT(*)
+                    FROM sensor_test_runs
+                    WHERE run_mode = 'session'
+                    GROUP BY {bucket}, test_result
+                """))
+    except Exception:
+        logging.getLogger(__name__).exception("Failed to rebuild statistics rollups")
+
+
+def backfill_sensor_verdicts(batch_size: int = 2000):
+    """由既有測項計算尚無 bitmask 的 session（升級前的資料）
+
+    只處理兩個結果 bitmask 皆為 0 但已有測項的 session；中途失敗時下次啟動會接續補齊。
+    """
+    verdicts = {}
+    with engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT item.run_id, item.stage, item.status
+            FROM sensor_test_items AS item
+            JOIN sensor_test_runs AS run ON run.id = item.run_id
+            WHERE run.run_mode = 'session' AND run.passed_mask = 0 AND run.failed_mask = 0
+            ORDER BY item.run_id, item.id
+        """))
+        for run_id, stage, status in rows:
+            if stage in STAGE_BITS:
+                verdicts.setdefault(run_id, SensorVerdict()).apply(stage, status)
+
+    params = [dict(verdict.values(), run_id=run_id) for run_id, verdict in verdicts.items()]
+    with engine.begin() as conn:
+        for start in range(0, len(params), batch_size):
+            conn.execute(text("""
+                UPDATE sensor_test_runs
+                SET passed_mask = :passed_mask, failed_mask = :failed_mask
+                WHERE id = :run_id
+            """), params[start:start + batch_size])
+    if params:
+        logging.getLogger(__name__).info(f"Backfilled verdict bitmasks for {len(params)} sensor sessions")
+
+
+def migrate_measurement_key_collation():
+    """MySQL：既有 test_measurements.key 改為 utf8mb4_bin，大小寫或重音不同的 key 不再互相衝突"""
+    if engine.dialect.name != "mysql":
+        return
+    with engine.begin() as conn:
+        collation = conn.execute(text("""
+            SELECT COLLATION_NAME FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'test_measurements' AND COLUMN_NAME = 'key'
+        """)).scalar()
+        if collation and collation != "utf8mb4_bin":
+            conn.execute(text(
+                "ALTER TABLE test_measurements MODIFY `key` VARCHAR(100) "
+                "CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL COMMENT 'test_data 的 key，巢狀以點號串接'"
+            ))
+            logging.getLogger(__name__).info(f"Changed test_measurements.key collation from {collation} to utf8mb4_bin")
+
+
+def dedupe_rows(table_name: str, *columns: str):
+    """建立唯一索引前，移除索引欄位值重複的列（保留 id 最大者）"""
+    table = Base.metadata.tables[table_name]
+    # 包一層子查詢：MySQL 不允許 DELETE 的子查詢直接讀取同一張表
+    keep = (
+        select(func.max(table.c.id).label("id"))
+        .group_by(*(table.c[column] for column in columns))
+        .subquery()
+    )
+    try:
+        with engine.begin() as conn:
+            result = conn.execute(table.delete().where(table.c.id.not_in(select(keep.c.id))))
+        if result.rowcount:
+            logging.getLogger(__name__).info(f"Removed {result.rowcount} duplicate rows from {table_name}")
+    except Exception:
+        logging.getLogger(__name__).exception(f"Failed to remove duplicate rows from {table_name}")
+
+
+def backfill_measurements(batch_size: int = 2000):
+    """升級後首次啟動：為既有測試記錄的 test_data 建立量測值列"""
+    from app.measurements import parse_measurements
+
+    records = Base.metadata.tables["test_records"]
+    measurements = Base.metadata.tables["test_measurements"]
+    try:
+        with engine.connect() as conn:
+            if conn.execute(measurements.select().limit(1)).first():
+                return
+            last_id = 0
+            while True:
+                rows = conn.execute(
+                    records.select().with_only_columns(records.c.id, records.c.test_data)
+                    .where(records.c.id > last_id, records.c.test_data.isnot(None))
+                    .order_by(records.c.id).limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                values = [
+                    {"record_id": row.id, **measurement}
+                    for row in rows
+                    for measurement in parse_measurements(row.test_data)
+                ]
+                if values:
+                    # 與寫入路徑的 replace_measurements 同時進行時，已由寫入路徑建立的列略過
+                    ignore = "IGNORE" if conn.dialect.name == "mysql" else "OR IGNORE"
+                    conn.execute(measurements.insert().prefix_with(ignore), values)
+                conn.commit()
+                last_id = rows[-1].id
+    except Exception:
+        logging.getLogger(__name__).exception("Failed to backfill test measurements")
+
+
+def seed_upload_outbox():
+    """建立雲端上傳游標；首次升級時把尚未上傳的記錄放入 outbox"""
+    from app.models import CLOUD_UPLOAD_CURSOR
+
+    cursor_exists = text("SELECT 1 FROM cloud_upload_cursors WHERE name = :name")
+    try:
+        with engine.begin() as conn:
+            if conn.execute(cursor_exists, {"name": CLOUD_UPLOAD_CURSOR}).first():
+                # outbox 已清空時游標歸零：MySQL 5.7 重啟後 AUTO_INCREMENT 會從 MAX(id)+1 重新起算
+                if not conn.execute(text("SELECT 1 FROM test_record_outbox LIMIT 1")).first():
+                    conn.execute(
+                        text("UPDATE cloud_upload_cursors SET last_id = 0 WHERE name = :name"),
+                        {"name": CLOUD_UPLOAD_CURSOR},
+                    )
+                return
+            conn.execute(text("""
+                INSERT INTO test_record_outbox (record_id)
+                SELECT id FROM test_records
+                WHERE uploaded_to_cloud = 0
+                ORDER BY id
+            """))
+            conn.execute(
+                text("INSERT INTO cloud_upload_cursors (name, last_id) VALUES (:name, 0)"),
+                {"name": CLOUD_UPLOAD_CURSOR},
+            )
+    except Exception:
+        logging.getLogger(__name__).exception("Failed to seed cloud upload outbox")
@@ -0,0 +1,200 @@
+"""
+WebSocket 廣播的 pub/sub 後端
+
+``manager.broadcast`` 發佈到 event bus，各 API process 訂閱後再分派給自己的 WebSocket 連線，
+因此 C watcher 的事件不論 POST 到哪一個 worker，所有瀏覽器都會收到。
+
+由 ``EVENT_BUS_URL`` 選擇：
+  - 空字串：單一 process 內直接傳遞（預設）
+  - redis://...：Redis pub/sub（需安裝選用套件 ``redis``），任何相容 Redis 協定的 broker 皆可
+
+本模組只依賴 config，讓 routers 與 services 都能使用而不形成循環 import。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+from datetime import date, datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.config import settings
+
+try:
+    import orjson
+except ImportError:  # 選用套件，未安裝時改用標準 json
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+def _json_default(value: Any):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode_message(message: dict) -> str:
+    """將訊息編碼為 JSON 字串；datetime 直接輸出為 ISO 8601"""
+    if orjson is not None:
+        return orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False, default=_json_default)
+
+
+class LocalEventBus:
+    """單一 process 內的 event bus：publish 直接交給已訂閱的 handler"""
+
+    backend = "local"
+
+    def __init__(self):
+        # 本 process 的識別；handler 可依訊息的 origin 判斷是否為其他 process 發佈
+        self.origin = f"{socket.gethostname()}:{os.getpid()}"
+        self._handlers: List[Handler] = []
+        self.published = 0
+        self.delivered = 0
+        self.handler_errors = 0
+
+    def subscribe(self, handler: Handler):
+        """註冊 handler；每則發佈的訊息（含其他 process 發佈的）都會呼叫一次"""
+        self._handlers.append(handler)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, message: dict):
+        self.published += 1
+        await self._deliver(message)
+
+    async def _deliver(self, message: dict):
+        self.delivered += 1
+        for handler in self._handlers:
+            try:
+                await handler(message)
+            except Exception as e:
+                self.handler_errors += 1
+                logger.exception(f"Event bus handler {getattr(handler, '__qualname__', handler)} failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "published": self.published,
+            "delivered": self.delivered,
+            "handler_errors": self.handler_errors,
+        }
+
+
+class RedisEventBus(LocalEventBus):
+    """Redis pub/sub：每個 process 都訂閱同一個 channel，包含發佈者自己
+
+    發佈時在訊息加上 origin，讓 handler 分辨來自其他 process 的事件。
+    發佈失敗時改為只在本機傳遞，至少連在本 process 的客戶端仍會收到；
+    訂閱中斷時以指數退避重新連線，期間其他 process 發佈的訊息會遺失。
+    """
+
+    backend = "redis"
+
+    def __init__(self, url: str, channel: str):
+        super().__init__()
+        self.url = url
+        self.channel = channel
+        self._redis = None
+        self._listener: Optional[asyncio.Task] = None
+        self.publish_errors = 0
+        self.reconnects = 0
+        self.subscribed = False
+
+    async def start(self):
+        if self._listener is not None:
+            return
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("EVENT_BUS_URL uses redis:// but the 'redis' package is not installed")
+        self._redis = redis.from_url(self.url)
+        self._listener = asyncio.create_task(self._listen())
+        logger.info(f"Event bus subscribed to '{self.channel}' on {self.url}")
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+        self.subscribed = False
+
+    async def publish(self, message: dict):
+        if self._redis is None:
+            # lifespan 之外（例如命令列工具）尚未連線，只在本機傳遞
+            await super().publish(message)
+            return
+        try:
+            await self._redis.publish(self.channel, encode_message(dict(message, origin=self.origin)))
+            self.published += 1
+        except Exception as e:
+            self.publish_errors += 1
+            logger.warning(f"Event bus publish failed, delivering locally only: {e}")
+            await self._deliver(message)
+
+    async def _listen(self):
+        delay = 1.0
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                self.subscribed = True
+                delay = 1.0
+                async for item in pubsub.listen():
+                    if item.get("type") != "message":
+                        continue
+                    try:
+                        message = json.loads(item["data"])
+                    except ValueError as e:
+                        logger.warning(f"Event bus dropped malformed message: {e}")
+                        continue
+                    await self._deliver(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.subscribed = False
+                self.reconnects += 1
+                logger.warning(f"Event bus subscription lost, reconnecting in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update({
+            "channel": self.channel,
+            "subscribed": self.subscribed,
+            "publish_errors": self.publish_errors,
+            "reconnects": self.reconnects,
+        })
+        return stats
+
+
+def create_event_bus(url: str, channel: str) -> LocalEventBus:
+    """依 EVENT_BUS_URL 建立 event bus；不支援的 scheme 丟出 ValueError"""
+    if not url:
+        return LocalEventBus()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisEventBus(url, channel)
+    raise ValueError(f"Unsupported EVENT_BUS_URL '{url}', expected redis://, rediss:// or unix://")
+
+
+event_bus = create_event_bus(settings.EVENT_BUS_URL, settings.EVENT_BUS_CHANNEL)
@@ -0,0 +1,425 @@
+"""測試記錄 write-behind 寫入佇列
+
+尖峰時段（例如換班時所有測試站同時上傳）API 只需把驗證過的記錄寫進
+journal 與記憶體佇列就回 202，由背景 flusher 依筆數或時間分批呼叫
+``TestRecordService.bulk_upsert`` 做 group commit。
+
+journal 為 NDJSON，寫入佇列前先 append。每批 commit 後 append 一行 checkpoint
+（journal 開頭已寫入資料庫的記錄數），重放時略過這些記錄；累積的已寫入記錄達
+佇列上限時改寫 journal，只留下尚未寫入的記錄，journal 不會隨負載無限成長。
+多 worker 部署時每個 process 各自寫 ``<WRITE_BEHIND_JOURNAL_PATH 主檔名>.<pid>.ndjson``
+並持有檔案的獨占鎖。啟動時除了自己的 journal，也接手已無 process 持有鎖的其他
+journal（異常結束的 worker 留下的），併入自己的 journal 後刪除原檔；
+bulk upsert 以 (device_id, serial_number) 為鍵，重放已寫入過的記錄不會產生重複資料。
+
+連線中斷、鎖等待逾時等暫時性錯誤以指數退避重試；資料本身造成的錯誤（欄位過長、
+唯一鍵衝突等）重試也不會成功，改為逐筆寫入找出該筆記錄，寫入 dead-letter 檔
+（``<主檔名>.dead-letter.ndjson``）後略過，不會卡住整個佇列。
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, TextIO, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows 開發環境沒有 flock，只支援單一 process
+    fcntl = None
+
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.services import TestRecordService
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueueFull(Exception):
+    """佇列已滿，呼叫端應回 503 讓測試站稍後重送"""
+
+
+def journal_path_for(base_path: str, pid: int) -> str:
+    """各 process 的 journal 路徑：ingest_journal.ndjson → ingest_journal.<pid>.ndjson"""
+    root, ext = os.path.splitext(base_path)
+    return f"{root}.{pid}{ext}"
+
+
+def _try_lock(f: TextIO) -> bool:
+    """非阻塞取得獨占鎖；持有者結束時由作業系統釋放"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def dead_letter_path_for(base_path: str) -> str:
+    """無法寫入的記錄：ingest_journal.ndjson → ingest_journal.dead-letter.ndjson"""
+    root, ext = os.path.splitext(base_path)
+    return f"{root}.dead-letter{ext}"
+
+
+CHECKPOINT_KEY = "__checkpoint__"
+
+
+def _read_journal(f: TextIO) -> Tuple[List[Dict[str, Any]], int]:
+    """讀取 journal 的所有記錄，與最後一個 checkpoint（開頭已寫入資料庫的筆數）"""
+    records = []
+    checkpoint = 0
+    f.seek(0)
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            # 寫到一半當機留下的殘行
+            logger.warning("Skipping truncated journal line: %s", line[:80])
+            continue
+        if isinstance(entry, dict) and CHECKPOINT_KEY in entry:
+            checkpoint = entry[CHECKPOINT_KEY]
+        else:
+            records.append(entry)
+    return records, checkpoint
+
+
+def _pending_records(f: TextIO) -> List[Dict[str, Any]]:
+    """journal 中尚未寫入資料庫的記錄"""
+    records, checkpoint = _read_journal(f)
+    return records[checkpoint:]
+
+
+def _is_transient(error: Exception) -> bool:
+    """連線、鎖等待、死結等暫時性錯誤；其餘（DataError、IntegrityError 等）重試也不會成功"""
+    if isinstance(error, DBAPIError):
+        return error.connection_invalidated or isinstance(error, (OperationalError, InterfaceError))
+    return isinstance(error, (OSError, asyncio.TimeoutError))
+
+
+class WriteBehindQueue:
+    """有界的記憶體佇列 + 磁碟 journal + 背景 group commit"""
+
+    def __init__(self, journal_path: str, max_size: int, batch_size: int,
+                 flush_interval_ms: int, fsync: bool = False):
+        self.journal_path = journal_path
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.fsync = fsync
+
+        self.path: Optional[str] = None
+        self.dead_letter_path = dead_letter_path_for(journal_path)
+        self._queue: Optional[asyncio.Queue] = None
+        self._journal: Optional[TextIO] = None
+        self._task: Optional[asyncio.Task] = None
+        # 已自佇列取出、尚未 commit 的記錄；關機取消 flusher 時據此補寫
+        self._batch: List[Dict[str, Any]] = []
+        # journal 中的記錄數，與開頭已寫入資料庫（或已 dead-letter）的筆數；佇列依 journal 順序寫入
+        self._journal_records = 0
+        self._journal_committed = 0
+
+        self.enqueued_total = 0
+        self.flushed_total = 0
+        self.flushed_batches = 0
+        self.failed_flushes = 0
+        self.dead_lettered = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._flush_ms_total = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self):
+        """重放 journal（含其他已結束 worker 留下的）並啟動背景 flusher"""
+        self._queue = asyncio.Queue()
+        os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+
+        self.path = journal_path_for(self.journal_path, os.getpid())
+        self._journal = open(self.path, "a+", encoding="utf-8")
+        if not _try_lock(self._journal):
+            self._journal.close()
+            self._journal = None
+            raise RuntimeError(f"Write-behind journal {self.path} is locked by another process")
+
+        # 同 pid 的舊 journal（容器重啟後 pid 重複）直接沿用
+        replayed = _pending_records(self._journal)
+        adopted = self._adopt_orphan_journals()
+        for _, records in adopted:
+            replayed.extend(records)
+        if replayed:
+            logger.info("Replaying %d record(s) from write-behind journal(s)", len(replayed))
+
+        # 只保留完整的記錄重寫 journal，避免新資料接在殘行後面；
+        # 寫入並 fsync 後才刪除接手的 journal，中途當機最差情況為重放兩次
+        self._journal.truncate(0)
+        for record in replayed:
+            self._journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._queue.put_nowait(record)
+        self._journal.flush()
+        self._journal_records = len(replayed)
+        self._journal_committed = 0
+        if adopted:
+            os.fsync(self._journal.fileno())
+        for orphan, _ in adopted:
+            os.remove(orphan.name)
+            orphan.close()
+
+        self._task = asyncio.create_task(self._run())
+        logger.info("Write-behind queue started: journal=%s, batch=%d, flush=%dms, max=%d",
+                    self.path, self.batch_size, int(self.flush_interval * 1000), self.max_size)
+
+    def _adopt_orphan_journals(self) -> List[Tuple[TextIO, List[Dict[str, Any]]]]:
+        """取得已無人持有的 journal（鎖定中的檔案屬於仍在執行的 worker，略過）
+
+        回傳仍持有鎖的檔案與其記錄，由呼叫端併入自己的 journal 後刪除。
+        也包含改為每個 process 一個 journal 之前的共用 journal。
+        """
+        root, ext = os.path.splitext(self.journal_path)
+        pattern = re.compile(re.escape(root) + r"\.\d+" + re.escape(ext) + "$")
+        candidates = [path for path in glob.glob(f"{glob.escape(root)}.*{ext}") if pattern.match(path)]
+        if os.path.exists(self.journal_path):
+            candidates.append(self.journal_path)
+
+        adopted = []
+        for path in sorted(candidates):
+            if os.path.abspath(path) == os.path.abspath(self.path):
+                continue
+            try:
+                orphan = open(path, "r", encoding="utf-8")
+            except FileNotFoundError:
+                continue  # 其他 worker 剛接手並刪除
+            # 取得鎖之前可能已被其他 worker 接手並刪除，確認路徑仍指向同一個檔案
+            if not _try_lock(orphan) or not self._same_file(path, orphan):
+                orphan.close()
+                continue
+            adopted.append((orphan, _pending_records(orphan)))
+        return adopted
+
+    @staticmethod
+    def _same_file(path: str, f: TextIO) -> bool:
+        try:
+            return os.stat(path).st_ino == os.fstat(f.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+    def submit(self, record: Dict[str, Any]) -> int:
+        """寫入 journal 並排入佇列，回傳目前佇列深度"""
+        if self._queue.qsize() >= self.max_size:
+            raise IngestQueueFull(f"write-behind queue is full ({self.max_size})")
+
+        self._journal.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+        self._journal_records += 1
+        self._queue.put_nowait(record)
+        self.enqueued_total += 1
+        return self._queue.qsize()
+
+    async def _collect_batch(self):
+        """等到第一筆後，收集到 batch_size 筆或 flush_interval 到期為止"""
+        self._batch.append(await self._queue.get())
+        deadline = time.monotonic() + self.flush_interval
+        while len(self._batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            # 不用 wait_for：Python 3.11 的 wait_for 在取得資料的同時被取消會吞掉取消，
+            # stop() 會一直等不到 flusher 結束
+            getter = asyncio.ensure_future(self._queue.get())
+            try:
+                await asyncio.wait({getter}, timeout=timeout)
+            finally:
+                if getter.done() and not getter.cancelled():
+                    # 被取消時已取出的記錄也留在 _batch，由 stop() 補寫
+                    self._batch.append(getter.result())
+                else:
+                    getter.cancel()
+            if not getter.done() or getter.cancelled():
+                break
+
+    async def _run(self):
+        while True:
+            await self._collect_batch()
+            await self._write_batch(self._batch)
+            self._batch = []
+
+    async def _write_batch(self, batch: List[Dict[str, Any]], retry: bool = True):
+        """寫入一批並推進 journal checkpoint
+
+        整批因資料本身的錯誤失敗時逐筆重寫，無法寫入的記錄移到 dead-letter 檔。
+        retry 為 False 時（關機）暫時性錯誤不重試，直接拋出，記錄留在 journal。
+        """
+        flush = self._flush_with_retry if retry else self._flush
+        try:
+            await flush(batch)
+        except Exception as e:
+            if _is_transient(e):
+                raise
+            if len(batch) == 1:
+                self._dead_letter(batch[0], e)
+            else:
+                logger.warning("Write-behind flush of %d record(s) failed (%s); retrying one by one",
+                               len(batch), e)
+                for record in batch:
+                    try:
+                        await flush([record])
+                    except Exception as record_error:
+                        if _is_transient(record_error):
+                            raise
+                        self._dead_letter(record, record_error)
+        self._mark_committed(len(batch))
+
+    async def _flush_with_retry(self, batch: List[Dict[str, Any]]):
+        """DB 暫時不可用時持續重試（間隔最長 30 秒）；記錄仍在 journal 中，不會遺失
+
+        資料本身造成的錯誤不重試，直接拋出。
+        """
+        delay = 0.5
+        while True:
+            try:
+                await self._flush(batch)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed_flushes += 1
+                if not _is_transient(e):
+                    raise
+                logger.error("Write-behind flush of %d record(s) failed: %s", len(batch), e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        started = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            result = await TestRecordService.bulk_upsert(db, batch)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        if result["rejected"]:
+            logger.warning("Write-behind flush rejected %d record(s): %s", result["rejected"],
+                           [r for r in result["results"] if r["status"] == "rejected"][:5])
+
+        self.flushed_total += len(batch)
+        self.flushed_batches += 1
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self._flush_ms_total += elapsed_ms
+
+    def _dead_letter(self, record: Dict[str, Any], error: Exception):
+        """無法寫入的記錄移到 dead-letter 檔，由人工處理"""
+        self.dead_lettered += 1
+        logger.error("Write-behind record %s/%s cannot be written and was moved to %s: %s",
+                     record.get("device_id"), record.get("serial_number"), self.dead_letter_path, error)
+        entry = {"failed_at": datetime.now().isoformat(), "error": str(error)[:1000], "record": record}
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _mark_committed(self, count: int):
+        """journal 開頭 count 筆已處理完畢：全部處理完時截斷，累積過多時改寫，否則記下 checkpoint"""
+        self._journal_committed += count
+        if self._journal_committed >= self._journal_records:
+            self._journal.truncate(0)
+            self._journal.seek(0)
+            self._journal_records = self._journal_committed = 0
+        elif self._journal_committed >= self.max_size:
+            self._compact_journal()
+        else:
+            self._journal.write(json.dumps({CHECKPOINT_KEY: self._journal_committed}) + "\n")
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+
+    def _compact_journal(self):
+        """改寫 journal，只留下尚未寫入資料庫的記錄
+
+        先寫入並 fsync 暫存檔（已持有鎖）再 rename 取代，過程中當機時舊 journal 仍完整。
+        """
+        records, _ = _read_journal(self._journal)
+        pending = records[self._journal_committed:]
+        temp_path = f"{self.path}.tmp"
+        compacted = open(temp_path, "a+", encoding="utf-8")
+        _try_lock(compacted)
+        compacted.truncate(0)
+        for record in pending:
+            compacted.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        compacted.flush()
+        os.fsync(compacted.fileno())
+        os.replace(temp_path, self.path)
+        self._journal.close()
+        self._journal = compacted
+        self._journal_records = len(pending)
+        self._journal_committed = 0
+
+    async def stop(self):
+        """停止 flusher，並把佇列中剩餘的記錄全部寫入資料庫"""
+        if not self._task:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        # 被取消的批次若已部分寫入，重新 upsert 一次結果相同
+        remaining = self._batch
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+        self._batch = []
+        drained = True
+        for start in range(0, len(remaining), self.batch_size):
+            try:
+                await self._write_batch(remaining[start:start + self.batch_size], retry=False)
+            except Exception as e:
+                logger.error("Failed to drain write-behind queue on shutdown: %s "
+                             "(records kept in journal)", e)
+                drained = False
+                break
+        if drained:
+            # 已全部 commit，刪除本 process 的 journal，避免每次重啟留下空檔
+            os.remove(self.path)
+        self._journal.close()
+        self._journal = None
+        logger.info("Write-behind queue stopped")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.running,
+            "journal": self.path,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "in_flight": len(self._batch),
+            "max_size": self.max_size,
+            "enqueued_total": self.enqueued_total,
+            "flushed_total": self.flushed_total,
+            "flushed_batches": self.flushed_batches,
+            "failed_flushes": self.failed_flushes,
+            "dead_lettered": self.dead_lettered,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "avg_flush_ms": round(self._flush_ms_total / self.flushed_batches, 2)
+            if self.flushed_batches else 0,
+            "max_flush_ms": round(self.max_flush_ms, 2),
+        }
+
+
+ingest_queue = WriteBehindQueue(
+    journal_path=settings.WRITE_BEHIND_JOURNAL_PATH,
+    max_size=settings.WRITE_BEHIND_QUEUE_SIZE,
+    batch_size=settings.WRITE_BEHIND_BATCH_SIZE,
+    flush_interval_ms=settings.WRITE_BEHIND_FLUSH_MS,
+    fsync=settings.WRITE_BEHIND_FSYNC,
+)
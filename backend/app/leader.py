@@ -0,0 +1,127 @@
+"""
+排程 leader 選舉
+
+以 ``scheduler_leases`` 資料表的一列作為 lease：每個 worker 定期嘗試取得或續約，
+只有持有未過期 lease 的 worker 執行排程工作（定時上傳、streaming 同步）。
+leader 停止續約（程序結束或當機）後，lease 到期即由其他 worker 接手。
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from sqlalchemy import insert, or_, update
+from sqlalchemy.exc import IntegrityError
+
+from app.config import settings
+from app.database import AsyncSessionLocal, db_now
+from app.models import SchedulerLease
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElection:
+    """DB lease 式 leader 選舉"""
+
+    def __init__(self, name: str, ttl_seconds: float, renew_seconds: float):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.renew_seconds = renew_seconds
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._leader = False
+        # 以本機單調時鐘估計 lease 到期；續約失敗（例如 DB 斷線）時到期即自動卸任
+        self._valid_until = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._leader and time.monotonic() < self._valid_until
+
+    async def try_acquire(self) -> bool:
+        """取得或續約 lease；lease 由其他 worker 持有且未過期時回傳 False"""
+        started = time.monotonic()
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(SchedulerLease)
+                .where(
+                    SchedulerLease.name == self.name,
+                    or_(SchedulerLease.holder == self.holder, SchedulerLease.expires_at < db_now(db)),
+                )
+                .values(holder=self.holder, expires_at=db_now(db, self.ttl_seconds))
+            )
+            acquired = result.rowcount > 0
+            if not acquired:
+                # 第一次使用：建立 lease 列；已存在（其他 worker 持有）時主鍵衝突
+                try:
+                    await db.execute(insert(SchedulerLease).values(
+                        name=self.name, holder=self.holder, expires_at=db_now(db, self.ttl_seconds)
+                    ))
+                    acquired = True
+                except IntegrityError:
+                    await db.rollback()
+            await db.commit()
+
+        if acquired:
+            # 自送出請求時起算，保守估計 lease 仍有效的期間
+            self._valid_until = started + self.ttl_seconds
+            if not self._leader:
+                logger.info(f"Acquired scheduler lease '{self.name}' as {self.holder}")
+        elif self._leader:
+            logger.warning(f"Lost scheduler lease '{self.name}'")
+        self._leader = acquired
+        return acquired
+
+    async def release(self):
+        """主動釋放 lease，讓其他 worker 立即接手"""
+        if not self._leader:
+            return
+        self._leader = False
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(SchedulerLease)
+                .where(SchedulerLease.name == self.name, SchedulerLease.holder == self.holder)
+                .values(expires_at=db_now(db, -1))
+            )
+            await db.commit()
+        logger.info(f"Released scheduler lease '{self.name}'")
+
+    async def _run(self):
+        while True:
+            try:
+                await self.try_acquire()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Scheduler lease renewal failed: {e}")
+            await asyncio.sleep(self.renew_seconds)
+
+    async def start(self):
+        try:
+            await self.try_acquire()
+        except Exception as e:
+            logger.error(f"Scheduler lease acquisition failed: {e}")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self._task:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await self.release()
+        except Exception as e:
+            logger.error(f"Scheduler lease release failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"name": self.name, "holder": self.holder, "is_leader": self.is_leader}
+
+
+leader = LeaderElection("scheduler", settings.SCHEDULER_LEASE_TTL_SECONDS, settings.SCHEDULER_LEASE_RENEW_SECONDS)
@@ -1,11 +1,19 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+from app.cloud_client import cloud_client
+from app.cloud_upload import cloud_sync
 from app.config import settings
-from app.database import init_db
+from app.database import init_db, async_engine
+from app.event_bus import event_bus
+from app.ingest_queue import ingest_queue
+from app.leader import leader
+from app.pagination import NEXT_CURSOR_HEADER
 from app.routers import test_records, websocket
+from app.wire_formats import get_wire_format
 from app.routers import pcba_events, sensor_events
 from app.scheduler import start_scheduler, stop_scheduler
+from app.stats_push import stats_push
 
 
 @asynccontextmanager
@@ -14,11 +22,30 @@ async def lifespan(app: FastAPI):
     # 啟動時執行
     print("Starting up...")
     init_db()  # 初始化資料庫
-    start_scheduler()  # 啟動排程器
+    await event_bus.start()  # 多 process 時訂閱廣播 channel
+    await stats_push.start()  # 跨日時推播歸零的 today_total
+    if settings.WRITE_BEHIND_ENABLED:
+        await ingest_queue.start()  # 重放 journal 並啟動背景寫入
+    if settings.CLOUD_UPLOAD_ENABLED:
+        get_wire_format(settings.CLOUD_UPLOAD_FORMAT)  # 格式設定錯誤或缺少選用套件時立即失敗
+        await cloud_client.start()  # 建立共用的雲端連線池
+        await leader.start()  # 多 worker 時選出唯一執行排程工作的 leader
+    start_scheduler()  # 啟動排程器（定時上傳 / 補傳）
+    if settings.CLOUD_UPLOAD_ENABLED and settings.CLOUD_SYNC_MODE == "streaming":
+        await cloud_sync.start()  # 寫入後微批次上傳雲端
     yield
     # 關閉時執行
     print("Shutting down...")
+    # 先把佇列中剩餘記錄寫入資料庫，其統計變動才能在推播與 WebSocket 停止前送出
+    await ingest_queue.stop()
     stop_scheduler()  # 停止排程器
+    await cloud_sync.stop()
+    await cloud_client.stop()  # 關閉雲端連線池
+    await leader.stop()  # 釋放 lease，讓其他 worker 立即接手
+    await stats_push.stop()  # 送出尚未推播的 stats_delta 後停止
+    await websocket.manager.shutdown()  # 送出已排入的廣播後關閉 WebSocket 連線
+    await event_bus.stop()
+    await async_engine.dispose()  # 關閉 async 連線池
 
 
 app = FastAPI(
@@ -36,6 +63,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 # 註冊路由
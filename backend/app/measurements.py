@@ -0,0 +1,70 @@
+"""test_data JSON → 量測值列
+
+test_data 以 JSON 字串儲存，寫入時展開為 (key, 值) 列存進 test_measurements，
+讓「voltage_ok 為 false」或「test_duration_ms > 2500」這類條件可在資料庫內
+以索引查詢，不必逐筆解析 JSON。巢狀物件以點號串接 key，例如 ``wifi.rssi``。
+"""
+import json
+import math
+from typing import Any, Dict, List, Optional
+
+MAX_KEY_LENGTH = 100
+MAX_TEXT_LENGTH = 255
+
+
+def _flatten(value: Any, prefix: str, rows: Dict[str, Dict[str, Any]]):
+    if isinstance(value, dict):
+        for key, child in value.items():
+            _flatten(child, f"{prefix}.{key}" if prefix else str(key), rows)
+        return
+    # utf8mb4_bin 比較時忽略結尾空白，"a" 與 "a " 在唯一索引上視為同一個 key
+    prefix = prefix.rstrip(" ")
+    if not prefix or len(prefix) > MAX_KEY_LENGTH:
+        return
+
+    row = {"key": prefix, "num_value": None, "bool_value": None, "text_value": None}
+    # bool 是 int 的子類別，必須先判斷
+    if isinstance(value, bool):
+        row["bool_value"] = value
+    elif isinstance(value, (int, float)):
+        try:
+            number = float(value)
+        except OverflowError:
+            return
+        # json.loads 接受 NaN / Infinity：MySQL 無法儲存，SQLite 的 avg / min / max 也會失真
+        if not math.isfinite(number):
+            return
+        row["num_value"] = number
+    elif isinstance(value, str):
+        row["text_value"] = value[:MAX_TEXT_LENGTH]
+    else:
+        # null 與陣列不建立索引列
+        return
+    # (record_id, key) 為唯一索引；{"a.b": 1, "a": {"b": 2}} 這類重複的 key 以後者為準
+    rows.pop(prefix, None)
+    rows[prefix] = row
+
+
+def parse_measurements(test_data: Optional[str]) -> List[Dict[str, Any]]:
+    """解析 test_data；非 JSON 物件時回傳空列表"""
+    if not test_data:
+        return []
+    try:
+        data = json.loads(test_data)
+    except (TypeError, ValueError):
+        return []
+    rows: Dict[str, Dict[str, Any]] = {}
+    if isinstance(data, dict):
+        _flatten(data, "", rows)
+    return list(rows.values())
+
+
+def parse_filter_value(raw: str) -> Any:
+    """查詢參數字串轉為 bool / float / str，決定比對哪個欄位"""
+    lowered = raw.strip().lower()
+    if lowered in ("true", "false"):
+        return lowered == "true"
+    try:
+        return float(raw)
+    except ValueError:
+        return raw
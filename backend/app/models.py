@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text, Boolean, UniqueConstraint, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, Text, Boolean, UniqueConstraint, ForeignKey, Index
+from sqlalchemy.dialects import mysql
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
@@ -32,14 +33,96 @@ class TestRecord(Base):
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), comment="更新時間")
     
     # 複合唯一約束：device_id + serial_number 必須唯一
+    # 複合索引：對應列表篩選條件 + (test_time, id) keyset 分頁
     __table_args__ = (
         UniqueConstraint('device_id', 'serial_number', name='uq_device_serial'),
+        Index('ix_test_records_time_id', 'test_time', 'id'),
+        Index('ix_test_records_device_time_id', 'device_id', 'test_time', 'id'),
+        Index('ix_test_records_result_time_id', 'test_result', 'test_time', 'id'),
     )
     
     def __repr__(self):
         return f"<TestRecord {self.serial_number} - {self.test_result}>"
 
 
+class TestMeasurement(Base):
+    """test_data 解析後的量測值，每個 key 一列，依值的型別存入對應欄位"""
+    __tablename__ = "test_measurements"
+
+    id = Column(Integer, primary_key=True)
+    record_id = Column(Integer, ForeignKey("test_records.id", ondelete="CASCADE"), nullable=False, index=True)
+    # MySQL 預設 collation 不分大小寫與重音，"Voltage" 與 "voltage" 會在唯一索引上衝突；改用二進位比對
+    key = Column(
+        String(100).with_variant(mysql.VARCHAR(100, charset="utf8mb4", collation="utf8mb4_bin"), "mysql"),
+        nullable=False, comment="test_data 的 key，巢狀以點號串接",
+    )
+    num_value = Column(Float, comment="數值")
+    bool_value = Column(Boolean, comment="布林值")
+    text_value = Column(String(255), comment="字串值")
+
+    __table_args__ = (
+        Index('uq_test_measurements_record_key', 'record_id', 'key', unique=True),
+        Index('ix_test_measurements_key_num', 'key', 'num_value'),
+        Index('ix_test_measurements_key_bool', 'key', 'bool_value'),
+        Index('ix_test_measurements_key_text', 'key', 'text_value'),
+    )
+
+
+class TestRecordHourlyStat(Base):
+    """測試記錄每小時彙總（依設備 / 站別 / 產品 / 結果），隨寫入增量維護"""
+    __tablename__ = "test_record_hourly_stats"
+
+    bucket_hour = Column(DateTime, primary_key=True, comment="整點時間 (依 test_time)")
+    device_id = Column(String(100), primary_key=True)
+    test_station = Column(String(100), primary_key=True)
+    product_name = Column(String(200), primary_key=True)
+    test_result = Column(String(20), primary_key=True)
+    record_count = Column(Integer, nullable=False, default=0)
+
+
+class SensorRunHourlyStat(Base):
+    """Sensor session 每小時彙總（依結果），隨 session 狀態變化增量維護"""
+    __tablename__ = "sensor_run_hourly_stats"
+
+    bucket_hour = Column(DateTime, primary_key=True, comment="整點時間 (依 started_at)")
+    test_result = Column(String(20), primary_key=True)
+    run_count = Column(Integer, nullable=False, default=0)
+
+
+# 雲端上傳的 outbox 游標名稱
+CLOUD_UPLOAD_CURSOR = "test_records"
+
+
+class TestRecordOutbox(Base):
+    """待上傳雲端的測試記錄變更，新增 / 更新時寫入，雲端確認後依範圍清除"""
+    __tablename__ = "test_record_outbox"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    record_id = Column(Integer, nullable=False, comment="test_records.id")
+    created_at = Column(DateTime, server_default=func.now(), comment="寫入時間")
+
+    # 清空後 id 不可重用，否則新變更會落在游標之前而漏傳
+    __table_args__ = {"sqlite_autoincrement": True}
+
+
+class CloudUploadCursor(Base):
+    """雲端上傳高水位：last_id 以前（含）的 outbox 皆已確認上傳"""
+    __tablename__ = "cloud_upload_cursors"
+
+    name = Column(String(50), primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0, comment="已確認的最大 outbox id")
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), comment="更新時間")
+
+
+class SchedulerLease(Base):
+    """排程 leader lease：多個 worker 中只有持有未過期 lease 者執行排程工作"""
+    __tablename__ = "scheduler_leases"
+
+    name = Column(String(50), primary_key=True)
+    holder = Column(String(200), nullable=False, comment="持有者 (host:pid:隨機碼)")
+    expires_at = Column(DateTime, nullable=False, comment="lease 到期時間 (資料庫時鐘)")
+
+
 class CloudUploadLog(Base):
     """雲端上傳日誌"""
     __tablename__ = "cloud_upload_logs"
@@ -49,6 +132,9 @@ class CloudUploadLog(Base):
     records_count = Column(Integer, comment="上傳記錄數")
     status = Column(String(20), comment="狀態: SUCCESS/FAILED")
     error_message = Column(Text, comment="錯誤訊息")
+    batch_id = Column(String(50), comment="上傳段的 outbox id 範圍")
+    attempts = Column(Integer, comment="嘗試次數")
+    latency_ms = Column(Float, comment="最後一次請求延遲 (ms)")
     
     def __repr__(self):
         return f"<CloudUploadLog {self.upload_time} - {self.status}>"
@@ -66,8 +152,18 @@ class SensorTestRun(Base):
     test_result = Column(String(20), nullable=False, comment="PASS/FAIL")
     started_at = Column(DateTime, nullable=False)
     completed_at = Column(DateTime, nullable=False)
+    # session 判定用的 bitmask，bit 順序見 app/sensor_verdict.py
+    passed_mask = Column(Integer, nullable=False, default=0, server_default="0", comment="已通過的測項")
+    failed_mask = Column(Integer, nullable=False, default=0, server_default="0", comment="已失敗的測項")
     created_at = Column(DateTime, server_default=func.now())
 
+    # 複合索引：對應列表篩選條件 + (started_at, id) keyset 分頁
+    __table_args__ = (
+        Index('ix_sensor_test_runs_started_id', 'started_at', 'id'),
+        Index('ix_sensor_test_runs_serial_started_id', 'serial_wle', 'started_at', 'id'),
+        Index('ix_sensor_test_runs_result_started_id', 'test_result', 'started_at', 'id'),
+    )
+
     items = relationship(
         "SensorTestItem", back_populates="run", cascade="all, delete-orphan",
         order_by="SensorTestItem.sequence",
@@ -92,3 +188,8 @@ class SensorTestItem(Base):
     tested_at = Column(DateTime, nullable=False)
 
     run = relationship("SensorTestRun", back_populates="items")
+
+    # 每個 session 每個測項一列，重測時 upsert 覆蓋
+    __table_args__ = (
+        Index('uq_sensor_test_items_run_stage', 'run_id', 'stage', unique=True),
+    )
@@ -0,0 +1,41 @@
+"""列表 API 的 keyset (cursor) 分頁
+
+cursor 是 (時間戳記, id) 經 base64 編碼後的不透明字串，客戶端只需把上一頁
+回應 header ``X-Next-Cursor`` 的值原封不動帶回 ``cursor`` 參數即可。
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Tuple
+
+from sqlalchemy import and_, or_
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    """將最後一筆的 (timestamp, id) 編碼為 cursor"""
+    raw = json.dumps([timestamp.isoformat(), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """解析 cursor；格式錯誤時丟出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {cursor}") from e
+
+
+def keyset_before(query, timestamp_column, id_column, cursor: str):
+    """套用「排在 cursor 之後」的條件，排序為 (timestamp, id) 由新到舊
+
+    展開成 OR 形式而非 row-value 比較，MySQL 才能對複合索引做 range scan。
+    """
+    timestamp, row_id = decode_cursor(cursor)
+    return query.where(or_(
+        timestamp_column < timestamp,
+        and_(timestamp_column == timestamp, id_column < row_id),
+    ))
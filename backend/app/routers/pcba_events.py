@@ -2,7 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel, Field
 from datetime import datetime
 from typing import Optional, Dict, Any
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 from app.models import TestRecord
 from app.routers.websocket import manager
@@ -28,7 +28,7 @@ class PcbaEvent(BaseModel):
 async def receive_pcba_event(
     event: PcbaEvent,
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """接收來自本機 C 程式的 PCBA 事件，並透過 WebSocket 廣播給前端。
 
@@ -197,7 +197,7 @@ async def uid_found(request: UidSearchRequest):
 
 
 @router.post("/start-test")
-async def start_test(request: StartTestRequest, db: Session = Depends(get_db)):
+async def start_test(request: StartTestRequest, db: AsyncSession = Depends(get_db)):
     """啟動 PCBA 測試流程：將 UID 寫入共享檔案，通知 Mac 上的 C 程式開始測試。
     
     流程：
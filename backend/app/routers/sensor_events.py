@@ -1,13 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session, selectinload
-from sqlalchemy import case, func
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy import select, update
 from pydantic import BaseModel, Field
 from datetime import datetime
 from typing import Optional, Dict, Any, Literal, List
 from app.routers.websocket import manager
-from app.database import get_db
+from app.cache import SENSOR_RUN_STATS, stats_cache
+from app.database import get_db, upsert_statement
+from app.event_bus import event_bus
+from app.exporting import (
+    EXPORT_MEDIA_TYPES, csv_chunk, export_headers, ndjson_chunk, stream_partitions,
+)
+from app.pagination import NEXT_CURSOR_HEADER, encode_cursor, keyset_before
 from app.models import SensorTestRun, SensorTestItem
 from app.schemas import SensorTestRunResponse
+from app.services import StatsRollupService
+from app.sensor_sessions import ActiveSensorSession, sensor_sessions
+from app.sensor_verdict import SENSOR_RESULT_STAGES, STAGE_SEQUENCE, SensorVerdict, stage_update
 import json
 import logging
 import os
@@ -19,10 +30,6 @@ latest_sensor_serials: Optional[Dict[str, str]] = None
 active_sensor_run_ids: Dict[str, int] = {}
 pending_read_started_at: Optional[datetime] = None
 
-SENSOR_RESULT_STAGES = [
-    "getSensorIC", "sht41", "ens210", "lps22df", "bme690",
-    "testButton", "testGreenLED", "testOrangeLED", "testBuzzer", "testSPI",
-]
 
 # 和 pcba_events.py 類似的結構，但針對 Sensor
 SHARED_FILE_PATH = "../shared/sensor_test.txt"
@@ -121,7 +128,7 @@ async def read_sensor_serial():
 
 
 @router.post("/serial-found")
-async def sensor_serial_found(request: SerialFoundRequest, db: Session = Depends(get_db)):
+async def sensor_serial_found(request: SerialFoundRequest, db: AsyncSession = Depends(get_db)):
     """
     sensor_watcher 回報從裝置讀到的 WLE / WBA 序號，廣播給前端自動填入。
     """
@@ -147,9 +154,14 @@ async def sensor_serial_found(request: SerialFoundRequest, db: Session = Depends
         completed_at=started_at,
     )
     db.add(db_run)
-    db.commit()
-    db.refresh(db_run)
+    await StatsRollupService.apply_sensor_run_transition(db, started_at, None, db_run.test_result)
+    await db.commit()
+    stats_cache.invalidate(SENSOR_RUN_STATS)
+    await db.refresh(db_run)
     active_sensor_run_ids[serial_wle] = db_run.id
+    # 新的 session 取代同一 WLE 的舊 session
+    sensor_sessions.evict(serial_wle)
+    sensor_sessions.put(ActiveSensorSession(db_run.id, serial_wle, db_run.started_at, db_run.test_result))
     latest_sensor_serials = {
         "serial_wle": serial_wle,
         "serial_wba": serial_wba,
@@ -175,6 +187,34 @@ async def sensor_serial_found(request: SerialFoundRequest, db: Session = Depends
         raise HTTPException(status_code=500, detail="Failed to broadcast serials")
 
 
+async def _sync_sensor_session(message: dict):
+    """event bus handler：serial-found 可能由其他 API process 處理，
+    依廣播同步本 process 的 session 狀態，避免後續事件更新到舊的 run。"""
+    global latest_sensor_serials
+    data = message.get("data") or {}
+    if message.get("origin") not in (None, event_bus.origin) and data.get("serial"):
+        # 其他 process 寫入了同一 session，本機快取已過期
+        if message.get("type") in ("sensor_event", "sensor_test_updated"):
+            sensor_sessions.evict(data["serial"])
+    if message.get("type") != "sensor_serial_found":
+        return
+    serial_wle = data.get("serial_wle")
+    run_id = data.get("run_id")
+    if not serial_wle or not run_id:
+        return
+    if active_sensor_run_ids.get(serial_wle) != run_id:
+        active_sensor_run_ids[serial_wle] = run_id
+        sensor_sessions.evict(serial_wle)
+    latest_sensor_serials = {
+        "serial_wle": serial_wle,
+        "serial_wba": data.get("serial_wba") or "",
+        "run_id": run_id,
+    }
+
+
+event_bus.subscribe(_sync_sensor_session)
+
+
 @router.get("/serial-found/latest")
 async def latest_sensor_serial():
     return latest_sensor_serials or {
@@ -217,7 +257,7 @@ async def start_sensor_test(request: StartTestRequest):
 
 
 @router.post("/events")
-async def receive_sensor_event(event: SensorEvent, db: Session = Depends(get_db)):
+async def receive_sensor_event(event: SensorEvent, db: AsyncSession = Depends(get_db)):
     """
     接收來自 C 程式的 Sensor 事件，並透過 WebSocket 廣播給前端。
     """
@@ -240,10 +280,10 @@ async def receive_sensor_event(event: SensorEvent, db: Session = Depends(get_db)
 
         saved_run = None
         if stage in SENSOR_RESULT_STAGES and status in ("pass", "fail"):
-            saved_run = _save_sensor_session_item(serial, stage, status,
+            saved_run = await _save_sensor_session_item(serial, stage, status,
                                                   event.detail or {}, now, db)
         elif stage == "testComplete":
-            saved_run = _finalize_sensor_session(serial, event.detail or {}, now, db)
+            saved_run = await _finalize_sensor_session(serial, event.detail or {}, now, db)
 
         # 建立 WebSocket 訊息
         message = {
@@ -280,156 +320,288 @@ async def receive_sensor_event(event: SensorEvent, db: Session = Depends(get_db)
 
     except Exception as e:
         logger.exception(f"[Sensor:/events] Failed to process event: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Failed to process event")
 
 
-def _finalize_sensor_session(serial: str, detail: Dict[str, Any], completed_at: datetime,
-                             db: Session) -> Optional[SensorTestRun]:
+async def _load_active_sensor_run(serial: str, db: AsyncSession) -> Optional[SensorTestRun]:
     run_id = active_sensor_run_ids.get(serial)
-    db_run = db.query(SensorTestRun).options(selectinload(SensorTestRun.items)).filter(
-        SensorTestRun.id == run_id
-    ).first() if run_id else None
+    query = select(SensorTestRun)
+    db_run = (await db.execute(
+        query.where(SensorTestRun.id == run_id)
+    )).scalars().first() if run_id else None
     if not db_run:
-        db_run = db.query(SensorTestRun).options(selectinload(SensorTestRun.items)).filter(
-            SensorTestRun.serial_wle == serial,
-            SensorTestRun.run_mode == "session",
-        ).order_by(SensorTestRun.started_at.desc()).first()
-    if not db_run:
-        return None
-
-    expected_stages = detail.get("expected_stages")
-    statuses = {existing.stage: existing.status for existing in db_run.items}
-
-    if any(value == "fail" for value in statuses.values()):
-        db_run.test_result = "FAIL"
-    elif expected_stages and all(statuses.get(s) == "pass" for s in expected_stages):
-        db_run.test_result = "PASS"
-    else:
-        if statuses.get("getSensorIC") == "pass" and all(status == "pass" for status in statuses.values()):
-            db_run.test_result = "PASS"
-        else:
-            db_run.test_result = "PENDING"
-
-    db_run.completed_at = completed_at
-    db.commit()
-    db.refresh(db_run)
+        # Backend 重啟後恢復該 WLE 最新的 session。
+        db_run = (await db.execute(
+            query.where(
+                SensorTestRun.serial_wle == serial,
+                SensorTestRun.run_mode == "session",
+            ).order_by(SensorTestRun.started_at.desc()).limit(1)
+        )).scalars().first()
     return db_run
 
 
-def _save_sensor_session_item(serial: str, stage: str, status: str,
-                              detail: Dict[str, Any], tested_at: datetime,
-                              db: Session) -> Optional[SensorTestRun]:
-    run_id = active_sensor_run_ids.get(serial)
-    db_run = db.query(SensorTestRun).options(selectinload(SensorTestRun.items)).filter(
-        SensorTestRun.id == run_id
-    ).first() if run_id else None
-    if not db_run:
-        # Backend 重啟後恢復該 WLE 最新的 session。
-        db_run = db.query(SensorTestRun).options(selectinload(SensorTestRun.items)).filter(
-            SensorTestRun.serial_wle == serial,
-            SensorTestRun.run_mode == "session",
-        ).order_by(SensorTestRun.started_at.desc()).first()
+async def _get_active_session(serial: str, db: AsyncSession) -> Optional[ActiveSensorSession]:
+    """先查 write-through 快取，未命中才從資料庫載入 run"""
+    session = sensor_sessions.get(serial)
+    if session is not None:
+        return session
+    db_run = await _load_active_sensor_run(serial, db)
     if not db_run:
+        return None
+    session = ActiveSensorSession.from_run(db_run)
+    sensor_sessions.put(session)
+    return session
+
+
+async def _lock_run_verdict(run_id: int, db: AsyncSession):
+    """在本 transaction 中鎖定 run，讀出已 commit 的 bitmask 與 test_result"""
+    runs = SensorTestRun.__table__
+    row = (await db.execute(
+        select(runs.c.test_result, runs.c.passed_mask, runs.c.failed_mask)
+        .where(runs.c.id == run_id).with_for_update()
+    )).first()
+    if row is None:
+        return None, None
+    return row.test_result, SensorVerdict(row.passed_mask or 0, row.failed_mask or 0)
+
+
+async def _finalize_sensor_session(serial: str, detail: Dict[str, Any], completed_at: datetime,
+                                   db: AsyncSession) -> Optional[ActiveSensorSession]:
+    session = await _get_active_session(serial, db)
+    if not session:
+        return None
+    # session 結束，不論成功與否都移出快取；之後的單項測試再從資料庫載入
+    sensor_sessions.evict(serial)
+
+    # 以資料庫中的 bitmask 判定，其他請求或 process 寫入的測項也會算入
+    previous_result, verdict = await _lock_run_verdict(session.id, db)
+    if verdict is None:
+        return None
+    test_result = verdict.final_result(detail.get("expected_stages"))
+    await db.execute(
+        update(SensorTestRun.__table__)
+        .where(SensorTestRun.__table__.c.id == session.id)
+        .values(test_result=test_result, completed_at=completed_at)
+    )
+    await StatsRollupService.apply_sensor_run_transition(
+        db, session.started_at, previous_result, test_result
+    )
+    await db.commit()
+    session.verdict = verdict
+    session.test_result = test_result
+    if previous_result != test_result:
+        stats_cache.invalidate(SENSOR_RUN_STATS)
+    return session
+
+
+async def _save_sensor_session_item(serial: str, stage: str, status: str,
+                                    detail: Dict[str, Any], tested_at: datetime,
+                                    db: AsyncSession) -> Optional[ActiveSensorSession]:
+    session = await _get_active_session(serial, db)
+    if not session:
         logger.warning("No sensor session for event serial=%s stage=%s", serial, stage)
         return None
 
-    item = next((existing for existing in db_run.items if existing.stage == stage), None)
-    if not item:
-        item = SensorTestItem(run_id=db_run.id, stage=stage,
-                              sequence=SENSOR_RESULT_STAGES.index(stage) + 1)
-        db_run.items.append(item)
-    item.sensor_name = detail.get("sensor")
-    item.status = status
-    item.temperature_c = detail.get("temperature")
-    item.humidity_percent = detail.get("humidity")
-    item.pressure_hpa = detail.get("pressure")
-    item.gas_resistance_ohm = detail.get("gas_resistance")
-    item.detail_json = json.dumps(detail, ensure_ascii=False)
-    item.tested_at = tested_at
-    db_run.completed_at = datetime.now()
-
-    statuses = {existing.stage: existing.status for existing in db_run.items}
-    if any(value == "fail" for value in statuses.values()):
-        db_run.test_result = "FAIL"
-    elif statuses and all(value == "pass" for value in statuses.values()):
-        db_run.test_result = "PASS"
-    else:
-        # 依據 getSensorIC 實際探測結果動態判定所需項目
-        get_ic_item = next((existing for existing in db_run.items if existing.stage == "getSensorIC"), None)
-        if get_ic_item and get_ic_item.detail_json:
-            try:
-                ic_detail = json.loads(get_ic_item.detail_json)
-                required = ["getSensorIC", "testButton", "testGreenLED", "testOrangeLED", "testBuzzer", "testSPI"]
-                for sensor_name in ["sht41", "ens210", "lps22df", "bme690"]:
-                    if ic_detail.get(sensor_name) is True:
-                        required.append(sensor_name)
-                if all(statuses.get(name) == "pass" for name in required):
-                    db_run.test_result = "PASS"
-                else:
-                    db_run.test_result = "PENDING"
-            except Exception:
-                db_run.test_result = "PENDING"
-        else:
-            db_run.test_result = "PENDING"
-    db.commit()
-    db.refresh(db_run)
-    return db_run
+    items = SensorTestItem.__table__
+    runs = SensorTestRun.__table__
+    values = {
+        "sensor_name": detail.get("sensor"),
+        "status": status,
+        "temperature_c": detail.get("temperature"),
+        "humidity_percent": detail.get("humidity"),
+        "pressure_hpa": detail.get("pressure"),
+        "gas_resistance_ohm": detail.get("gas_resistance"),
+        "detail_json": json.dumps(detail, ensure_ascii=False),
+        "tested_at": tested_at,
+    }
+    change = stage_update(stage, status)
+    try:
+        # 先鎖定 run（各 worker 以相同順序取得鎖），讀出已 commit 的 bitmask 與 test_result；
+        # 之後的寫入都在鎖內，由此算出的判定即為寫入後資料庫中的值
+        previous_result, verdict = await _lock_run_verdict(session.id, db)
+        if verdict is None:
+            raise RuntimeError(f"Sensor run {session.id} disappeared during update")
+        verdict.apply(stage, status)
+        test_result = verdict.result
+        # (run_id, stage) 唯一索引：其他 worker 快取過期時同樣覆蓋既有測項，不會寫出重複列
+        await db.execute(upsert_statement(
+            db, items,
+            [{"run_id": session.id, "stage": stage, "sequence": STAGE_SEQUENCE[stage], **values}],
+            index_elements=["run_id", "stage"],
+            update=lambda new: {column: new[column] for column in values},
+        ))
+        # bitmask 仍在 SQL 內做位元運算，不以記憶體中的值覆寫
+        await db.execute(
+            update(runs).where(runs.c.id == session.id).values(
+                passed_mask=runs.c.passed_mask.op("&")(change["keep"]).op("|")(change["passed"]),
+                failed_mask=runs.c.failed_mask.op("&")(change["keep"]).op("|")(change["failed"]),
+                test_result=test_result,
+                completed_at=datetime.now(),
+            )
+        )
+        if test_result != previous_result:
+            await StatsRollupService.apply_sensor_run_transition(
+                db, session.started_at, previous_result, test_result
+            )
+        await db.commit()
+    except Exception:
+        # 快取可能與資料庫不一致，下一個事件重新載入
+        sensor_sessions.evict(serial)
+        raise
+
+    # 快取只採用實際寫入資料庫的結果
+    session.verdict = verdict
+    session.test_result = test_result
+    if previous_result != test_result:
+        stats_cache.invalidate(SENSOR_RUN_STATS)
+    return session
+
+
+def _filter_sensor_runs(query, serial_wle: Optional[str], test_result: Optional[str],
+                        start_date: Optional[datetime], end_date: Optional[datetime]):
+    if serial_wle:
+        query = query.where(SensorTestRun.serial_wle == serial_wle)
+    if test_result:
+        query = query.where(SensorTestRun.test_result == test_result)
+    if start_date:
+        query = query.where(SensorTestRun.started_at >= start_date)
+    if end_date:
+        query = query.where(SensorTestRun.started_at <= end_date)
+    return query
+
+
+SENSOR_RUN_EXPORT_COLUMNS = [
+    "id", "serial_wle", "serial_wba", "run_mode", "requested_stage",
+    "test_result", "started_at", "completed_at", "created_at",
+]
+SENSOR_ITEM_EXPORT_COLUMNS = [
+    "sequence", "stage", "sensor_name", "status", "temperature_c", "humidity_percent",
+    "pressure_hpa", "gas_resistance_ohm", "detail_json", "tested_at",
+]
+
+
+async def _stream_sensor_runs(query, export_format: str):
+    """CSV 每個測項一列（附 run 欄位）；NDJSON 每個 run 一行並內嵌 items。
+
+    run 與 items 以 LEFT JOIN 依 (started_at, id, sequence) 排序串流，
+    同一 run 的 rows 必然相鄰，因此只需暫存目前這一個 run。
+    """
+    if export_format == "csv":
+        yield csv_chunk([
+            ["run_id"] + SENSOR_RUN_EXPORT_COLUMNS[1:] + ["item_" + name for name in SENSOR_ITEM_EXPORT_COLUMNS]
+        ])
+
+    current = None
+    async for rows in stream_partitions(query):
+        if export_format == "csv":
+            yield csv_chunk(rows)
+            continue
+
+        finished = []
+        for row in rows:
+            values = row._mapping
+            if current is None or current["id"] != values["id"]:
+                if current is not None:
+                    finished.append(current)
+                current = {name: values[name] for name in SENSOR_RUN_EXPORT_COLUMNS}
+                current["items"] = []
+            if values["item_sequence"] is not None:
+                current["items"].append({
+                    name: (values["item_" + name].isoformat() if name == "tested_at" else values["item_" + name])
+                    for name in SENSOR_ITEM_EXPORT_COLUMNS
+                })
+        if finished:
+            yield ndjson_chunk(finished)
+
+    if current is not None:
+        yield ndjson_chunk([current])
+
+
+@router.get("/test-runs/export")
+async def export_sensor_test_runs(
+    export_format: Literal["csv", "ndjson"] = Query("csv", alias="format"),
+    serial_wle: Optional[str] = None,
+    test_result: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+):
+    """串流匯出 Sensor 測試 session 與逐項結果，篩選條件與列表相同、無筆數上限"""
+    run_columns = [getattr(SensorTestRun, name) for name in SENSOR_RUN_EXPORT_COLUMNS]
+    item_columns = [getattr(SensorTestItem, name).label("item_" + name) for name in SENSOR_ITEM_EXPORT_COLUMNS]
+    query = _filter_sensor_runs(
+        select(*run_columns, *item_columns).outerjoin(
+            SensorTestItem, SensorTestItem.run_id == SensorTestRun.id
+        ),
+        serial_wle, test_result, start_date, end_date,
+    ).order_by(SensorTestRun.started_at, SensorTestRun.id, SensorTestItem.sequence)
+    return StreamingResponse(
+        _stream_sensor_runs(query, export_format),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers=export_headers("sensor_test_runs", export_format),
+    )
 
 
 @router.get("/test-runs", response_model=List[SensorTestRunResponse])
-def get_sensor_test_runs(
+async def get_sensor_test_runs(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=500),
     serial_wle: Optional[str] = None,
     test_result: Optional[str] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="上一頁回應的 X-Next-Cursor"),
+    db: AsyncSession = Depends(get_db),
 ):
-    query = db.query(SensorTestRun).options(selectinload(SensorTestRun.items))
-    if serial_wle:
-        query = query.filter(SensorTestRun.serial_wle == serial_wle)
-    if test_result:
-        query = query.filter(SensorTestRun.test_result == test_result)
-    if start_date:
-        query = query.filter(SensorTestRun.started_at >= start_date)
-    if end_date:
-        query = query.filter(SensorTestRun.started_at <= end_date)
-    return query.order_by(SensorTestRun.started_at.desc()).offset(skip).limit(limit).all()
+    query = _filter_sensor_runs(
+        select(SensorTestRun).options(selectinload(SensorTestRun.items)),
+        serial_wle, test_result, start_date, end_date,
+    )
+    query = query.order_by(SensorTestRun.started_at.desc(), SensorTestRun.id.desc())
+    if cursor:
+        try:
+            query = keyset_before(query, SensorTestRun.started_at, SensorTestRun.id, cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        query = query.offset(skip)
+    runs = (await db.execute(query.limit(limit))).scalars().all()
+    if len(runs) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(runs[-1].started_at, runs[-1].id)
+    return runs
 
 
 @router.get("/test-runs/stats")
-def get_sensor_test_run_stats(db: Session = Depends(get_db)):
-    """Dashboard statistics based on read-serial Sensor sessions."""
-    today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    totals = db.query(
-        func.count(SensorTestRun.id).label("total"),
-        func.sum(case((SensorTestRun.test_result == "PASS", 1), else_=0)).label("passed"),
-        func.sum(case((SensorTestRun.test_result == "FAIL", 1), else_=0)).label("failed"),
-        func.sum(case((SensorTestRun.test_result == "PENDING", 1), else_=0)).label("pending"),
-        func.sum(case((SensorTestRun.started_at >= today_start, 1), else_=0)).label("today_total"),
-    ).filter(SensorTestRun.run_mode == "session").one()
-
-    passed = int(totals.passed or 0)
-    failed = int(totals.failed or 0)
-    pending = int(totals.pending or 0)
-    completed = passed + failed
-    return {
-        "total": int(totals.total or 0),
-        "passed": passed,
-        "failed": failed,
-        "pending": pending,
-        "today_total": int(totals.today_total or 0),
-        "pass_rate": round((passed / completed) * 100, 1) if completed else 0,
-    }
+async def get_sensor_test_run_stats(db: AsyncSession = Depends(get_db)):
+    """Dashboard statistics based on read-serial Sensor sessions (served from hourly rollups)."""
+    return await stats_cache.get_or_load(
+        (SENSOR_RUN_STATS, "totals"),
+        lambda: StatsRollupService.get_sensor_run_stats(db),
+    )
+
+
+@router.get("/test-runs/stats/trend")
+async def get_sensor_test_run_trend(
+    hours: int = Query(24, ge=1, le=24 * 31),
+    db: AsyncSession = Depends(get_db),
+):
+    """Hourly Sensor session counts for the last N hours."""
+    return await stats_cache.get_or_load(
+        (SENSOR_RUN_STATS, "trend", hours),
+        lambda: StatsRollupService.get_sensor_run_trend(db, hours),
+    )
 
 
 @router.delete("/test-runs/{run_id}", status_code=204)
-def delete_sensor_test_run(run_id: int, db: Session = Depends(get_db)):
-    run = db.query(SensorTestRun).filter(SensorTestRun.id == run_id).first()
+async def delete_sensor_test_run(run_id: int, db: AsyncSession = Depends(get_db)):
+    run = await db.get(SensorTestRun, run_id)
     if not run:
         raise HTTPException(status_code=404, detail="Sensor test run not found")
-    db.delete(run)
-    db.commit()
+    await db.delete(run)
+    sensor_sessions.evict_run(run_id)
+    if run.run_mode == "session":
+        await StatsRollupService.apply_sensor_run_transition(db, run.started_at, run.test_result, None)
+    await db.commit()
+    stats_cache.invalidate(SENSOR_RUN_STATS)
     return None
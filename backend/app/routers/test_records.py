@@ -1,67 +1,209 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Literal, Optional
 from datetime import datetime
+from app.cache import TEST_RECORD_STATS, stats_cache
 from app.database import get_db
-from app.schemas import TestRecordCreate, TestRecordResponse, TestRecordUpdate
-from app.services import TestRecordService
+from app.exporting import EXPORT_MEDIA_TYPES, export_headers
+from app.ingest_queue import IngestQueueFull, ingest_queue
+from app.pagination import NEXT_CURSOR_HEADER, encode_cursor
+from app.schemas import (
+    TestRecordCreate, TestRecordResponse, TestRecordUpdate,
+    TestRecordBulkCreate, TestRecordBulkResponse,
+)
+from app.services import TestRecordService, StatsRollupService, MeasurementService
 
 router = APIRouter(prefix="/api/test-records", tags=["Test Records"])
 
 
-@router.post("/", response_model=TestRecordResponse, status_code=201)
-def create_test_record(
+@router.post("/", response_model=TestRecordResponse, status_code=201,
+             responses={202: {"description": "write-behind 模式：已排入寫入佇列"}})
+async def create_test_record(
     record: TestRecordCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """建立測試記錄"""
+    """建立測試記錄
+
+    啟用 write-behind 時不等待資料庫 commit，排入佇列後直接回 202。
+    """
+    if ingest_queue.running:
+        try:
+            depth = ingest_queue.submit(record.model_dump(mode="json"))
+        except IngestQueueFull as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+        return JSONResponse(status_code=202, content={
+            "status": "queued",
+            "device_id": record.device_id,
+            "serial_number": record.serial_number,
+            "queue_depth": depth,
+        })
+    try:
+        return await TestRecordService.create_test_record(db, record)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/bulk", response_model=TestRecordBulkResponse)
+async def bulk_upsert_test_records(
+    payload: TestRecordBulkCreate,
+    db: AsyncSession = Depends(get_db)
+):
+    """批次建立或更新測試記錄（測試站斷線後補傳 backlog 用）"""
     try:
-        return TestRecordService.create_test_record(db, record)
+        return await TestRecordService.bulk_upsert(db, payload.records)
     except Exception as e:
+        await db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.get("/", response_model=List[TestRecordResponse])
-def get_test_records(
+async def get_test_records(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=500),
     device_id: Optional[str] = None,
     test_result: Optional[str] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="上一頁回應的 X-Next-Cursor"),
+    db: AsyncSession = Depends(get_db)
+):
+    """取得測試記錄列表
+
+    回滿一頁時於 X-Next-Cursor header 提供下一頁的 cursor。
+    """
+    try:
+        records = await TestRecordService.get_test_records(
+            db, skip, limit, device_id, test_result, start_date, end_date, cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(records) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(records[-1].test_time, records[-1].id)
+    return records
+
+
+@router.get("/stats")
+async def get_test_record_stats(
+    device_id: Optional[str] = None,
+    test_station: Optional[str] = None,
+    product_name: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """測試記錄統計（由每小時彙總表計算，短暫快取並於寫入時失效）"""
+    return await stats_cache.get_or_load(
+        (TEST_RECORD_STATS, "totals", device_id, test_station, product_name),
+        lambda: StatsRollupService.get_test_record_stats(db, device_id, test_station, product_name),
+    )
+
+
+@router.get("/stats/trend")
+async def get_test_record_trend(
+    hours: int = Query(24, ge=1, le=24 * 31),
+    device_id: Optional[str] = None,
+    test_station: Optional[str] = None,
+    product_name: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """最近 N 小時每小時的測試筆數與良率"""
+    return await stats_cache.get_or_load(
+        (TEST_RECORD_STATS, "trend", hours, device_id, test_station, product_name),
+        lambda: StatsRollupService.get_test_record_trend(db, hours, device_id, test_station, product_name),
+    )
+
+
+@router.get("/measurements/search", response_model=List[TestRecordResponse])
+async def search_by_measurement(
+    response: Response,
+    key: str = Query(..., description="test_data 的 key，巢狀以點號串接，例如 voltage_ok"),
+    op: Literal["eq", "ne", "gt", "gte", "lt", "lte"] = "eq",
+    value: str = Query(..., description="true/false、數值或字串"),
+    limit: int = Query(100, ge=1, le=500),
+    device_id: Optional[str] = None,
+    test_result: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    cursor: Optional[str] = Query(None, description="上一頁回應的 X-Next-Cursor"),
+    db: AsyncSession = Depends(get_db)
+):
+    """依 test_data 量測值查詢測試記錄，例如 key=test_duration_ms&op=gt&value=2500"""
+    try:
+        records = await MeasurementService.search_records(
+            db, key, op, value, limit, device_id, test_result, start_date, end_date, cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(records) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(records[-1].test_time, records[-1].id)
+    return records
+
+
+@router.get("/measurements/aggregate")
+async def aggregate_measurement(
+    key: str = Query(..., description="test_data 的 key"),
+    group_by: Optional[Literal["device_id", "test_station", "product_name", "test_result"]] = None,
+    device_id: Optional[str] = None,
+    test_result: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """量測值統計（count / min / max / avg，布林值為 true / false 筆數）"""
+    return await MeasurementService.aggregate(
+        db, key, group_by, device_id, test_result, start_date, end_date
+    )
+
+
+@router.get("/ingest-queue")
+async def get_ingest_queue_stats():
+    """write-behind 佇列深度與 flush 延遲"""
+    return ingest_queue.stats()
+
+
+@router.get("/export")
+async def export_test_records(
+    export_format: Literal["csv", "ndjson"] = Query("csv", alias="format"),
+    device_id: Optional[str] = None,
+    test_result: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
 ):
-    """取得測試記錄列表"""
-    return TestRecordService.get_test_records(
-        db, skip, limit, device_id, test_result, start_date, end_date
+    """串流匯出測試記錄（CSV / NDJSON），篩選條件與列表相同、無筆數上限"""
+    return StreamingResponse(
+        TestRecordService.export_test_records(
+            export_format, device_id, test_result, start_date, end_date
+        ),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers=export_headers("test_records", export_format),
     )
 
 
 @router.get("/{record_id}", response_model=TestRecordResponse)
-def get_test_record(record_id: int, db: Session = Depends(get_db)):
+async def get_test_record(record_id: int, db: AsyncSession = Depends(get_db)):
     """取得單筆測試記錄"""
-    record = TestRecordService.get_test_record(db, record_id)
+    record = await TestRecordService.get_test_record(db, record_id)
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
     return record
 
 
 @router.put("/{record_id}", response_model=TestRecordResponse)
-def update_test_record(
+async def update_test_record(
     record_id: int,
     record_update: TestRecordUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """更新測試記錄"""
-    record = TestRecordService.update_test_record(db, record_id, record_update)
+    record = await TestRecordService.update_test_record(db, record_id, record_update)
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
     return record
 
 
 @router.delete("/{record_id}", status_code=204)
-def delete_test_record(record_id: int, db: Session = Depends(get_db)):
+async def delete_test_record(record_id: int, db: AsyncSession = Depends(get_db)):
     """刪除測試記錄"""
-    if not TestRecordService.delete_test_record(db, record_id):
+    if not await TestRecordService.delete_test_record(db, record_id):
         raise HTTPException(status_code=404, detail="Record not found")
     return None
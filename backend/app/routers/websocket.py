@@ -1,58 +1,594 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import List
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set
+import asyncio
 import json
+import os
+import time
 from datetime import datetime
+from app.config import settings
+from app.event_bus import encode_message, event_bus
 
 router = APIRouter()
 
+BACKPRESSURE_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+# 廣播前合併：這些類型的中間狀態（testing / pending / progress）在視窗內只送最新一則
+COALESCE_TYPES = ("pcba_event", "sensor_event")
+TERMINAL_STATUSES = ("pass", "fail")
+
+# 訂閱維度（subscribe 訊息的欄位名稱）
+SUBSCRIPTION_FIELDS = ("types", "serials", "stations")
+_SERIAL_FIELDS = ("serial", "serial_wle", "serial_wba", "serial_number")
+_STATION_FIELDS = ("test_station", "station")
+
+
+def coalesce_key(message: dict) -> Optional[tuple]:
+    """同一序號、同一測項的訊息可互相取代；沒有序號的訊息不合併"""
+    data = message.get("data")
+    if not isinstance(data, dict):
+        return None
+    serial = data.get("serial") or data.get("serial_wle")
+    if not serial:
+        return None
+    return (message.get("type"), serial, data.get("stage"))
+
+
+def message_topics(message: dict) -> Dict[str, List[str]]:
+    """取出訊息在各訂閱維度上的值，供 ConnectionManager 查索引"""
+    data = message.get("data")
+    if not isinstance(data, dict):
+        data = {}
+    return {
+        "types": [message["type"]] if message.get("type") else [],
+        "serials": [data[field] for field in _SERIAL_FIELDS if data.get(field)],
+        "stations": [data[field] for field in _STATION_FIELDS if data.get(field)],
+    }
+
+
+class ClientConnection:
+    """單一 WebSocket 連線：有界的送出佇列與專屬 writer task
+
+    慢速或半斷線的客戶端只會塞滿自己的佇列，不影響其他連線；
+    佇列滿時依 policy 處理：
+      - drop_oldest：丟棄最舊的訊息
+      - coalesce：同序號 / 測項的待送訊息改為最新一則並移到佇列尾端（保持 seq 遞增），
+        仍滿時丟棄最舊的
+      - disconnect：直接中斷該連線，由前端重新連線
+    """
+
+    def __init__(self, websocket: WebSocket, manager: "ConnectionManager",
+                 max_queue: int, policy: str, send_timeout: float):
+        self.websocket = websocket
+        self.manager = manager
+        self.max_queue = max_queue
+        self.policy = policy
+        self.send_timeout = send_timeout
+        # 每個元素為 [coalesce key, 已編碼的 frame]
+        self._queue: Deque[list] = deque()
+        self._by_key: Dict[tuple, list] = {}
+        self._wakeup = asyncio.Event()
+        self.connected_at = datetime.now()
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.closed = False
+        # 各維度已訂閱的值；全部為空表示未訂閱，接收所有訊息
+        self.subscriptions: Dict[str, Set[str]] = {field: set() for field in SUBSCRIPTION_FIELDS}
+        # 連線時的最新序號；之後的廣播都會即時送出，補送只需到此為止
+        self.live_since = manager.seq
+        self._task = asyncio.create_task(self._writer())
+
+    @property
+    def subscribed(self) -> bool:
+        return any(self.subscriptions.values())
+
+    def wants(self, message: dict) -> bool:
+        """訊息是否符合此連線的訂閱（補送時逐則判斷，不經索引）"""
+        if not self.subscribed:
+            return True
+        for field, values in message_topics(message).items():
+            if any(str(value) in self.subscriptions[field] for value in values):
+                return True
+        return False
+
+    def enqueue(self, message: dict, key: Optional[tuple] = None, frame: Optional[str] = None):
+        """放入送出佇列，不等待實際送出；frame 為廣播時已編碼好的字串"""
+        if self.closed:
+            return
+        if frame is None:
+            frame = encode_message(message)
+        if self.policy == "coalesce" and key is not None:
+            entry = self._by_key.pop(key, None)
+            if entry is not None:
+                # 不可原地替換：新 frame 的 seq 比排在它後面的訊息大，原地送出會讓客戶端看到 seq 倒退
+                self._queue.remove(entry)
+                self.coalesced += 1
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            if self.policy == "disconnect":
+                self.close("send queue full")
+                return
+            self._forget(self._queue.popleft())
+        entry = [key, frame]
+        self._queue.append(entry)
+        if self.policy == "coalesce" and key is not None:
+            self._by_key[key] = entry
+        self._wakeup.set()
+
+    def _forget(self, entry: list):
+        if entry[0] is not None and self._by_key.get(entry[0]) is entry:
+            del self._by_key[entry[0]]
+
+    async def _writer(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self._queue:
+                    entry = self._queue.popleft()
+                    self._forget(entry)
+                    await asyncio.wait_for(self.websocket.send_text(entry[1]), self.send_timeout)
+                    self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            print(f"WebSocket send timed out after {self.send_timeout}s, disconnecting client")
+            self.close("send timeout")
+        except Exception as e:
+            print(f"Error sending message: {e}")
+            self.close("send error")
+
+    def close(self, reason: str = ""):
+        """停止 writer、關閉連線並自 manager 移除"""
+        if self.closed:
+            return
+        self.closed = True
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+        self._queue.clear()
+        self._by_key.clear()
+        self.manager.disconnect(self.websocket)
+        if reason:
+            if reason != "send error":
+                self.manager.disconnected_slow += 1
+            asyncio.create_task(self._close_socket())
+
+    async def _close_socket(self):
+        try:
+            await self.websocket.close(code=1013)  # Try Again Later
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        client = self.websocket.client
+        return {
+            "client": f"{client.host}:{client.port}" if client else None,
+            "connected_at": self.connected_at.isoformat(),
+            "queue_depth": len(self._queue),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "subscriptions": {field: sorted(values) for field, values in self.subscriptions.items()},
+        }
+
+
+class BroadcastCoalescer:
+    """manager.broadcast 前的合併階段，以 (type, serial, stage) 為 key
+
+    同一 key 的中間狀態每個視窗最多發佈一則：視窗外的第一則立即送出，
+    視窗內後到的只保留最新一則，於視窗結束時送出。pass / fail 一律立即送出，
+    並丟棄同 key 尚未送出的中間狀態，避免舊的 testing 蓋過最終結果。
+    所有訊息經同一個佇列依序發佈到 event bus，順序與呼叫順序一致。
+    """
+
+    def __init__(self, window_ms: int, max_queue: int):
+        self.window = window_ms / 1000
+        self.max_queue = max_queue
+        self._pending: Dict[tuple, dict] = {}
+        self._timers: Dict[tuple, asyncio.TimerHandle] = {}
+        self._last_sent: Dict[tuple, float] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._publisher: Optional[asyncio.Task] = None
+        self.received = 0
+        self.published = 0
+        self.coalesced = 0
+        self.superseded = 0
+        self.dropped = 0
+
+    def submit(self, message: dict):
+        self.received += 1
+        key = None
+        if self.window > 0 and message.get("type") in COALESCE_TYPES:
+            key = coalesce_key(message)
+        if key is None:
+            self._emit(message)
+            return
+
+        status = (message.get("data") or {}).get("status")
+        if status in TERMINAL_STATUSES:
+            if self._pending.pop(key, None) is not None:
+                self._timers.pop(key).cancel()
+                self.superseded += 1
+            self._last_sent.pop(key, None)
+            self._emit(message)
+            return
+
+        if key in self._pending:
+            self._pending[key] = message
+            self.coalesced += 1
+            return
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        last_sent = self._last_sent.get(key)
+        if last_sent is None or now - last_sent >= self.window:
+            self._mark_sent(key, now)
+            self._emit(message)
+            return
+        self._pending[key] = message
+        self._timers[key] = loop.call_at(last_sent + self.window, self._flush, key)
+
+    def _flush(self, key: tuple):
+        self._timers.pop(key, None)
+        message = self._pending.pop(key, None)
+        if message is not None:
+            self._mark_sent(key, asyncio.get_running_loop().time())
+            self._emit(message)
+
+    def _mark_sent(self, key: tuple, now: float):
+        self._last_sent[key] = now
+        if len(self._last_sent) > 4096:
+            # 沒收到 pass / fail 就中斷的測項不會被移除，定期清掉已過視窗的 key
+            self._last_sent = {k: t for k, t in self._last_sent.items() if now - t < self.window}
+
+    def _emit(self, message: dict):
+        if self._publisher is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._publisher = asyncio.create_task(self._publish_loop())
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _publish_loop(self):
+        while True:
+            message = await self._queue.get()
+            try:
+                await event_bus.publish(message)
+                self.published += 1
+            except Exception as e:
+                print(f"Error publishing broadcast: {e}")
+
+    async def stop(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        self._pending.clear()
+        if self._publisher is not None:
+            self._publisher.cancel()
+            try:
+                await self._publisher
+            except asyncio.CancelledError:
+                pass
+            self._publisher = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_ms": int(self.window * 1000),
+            "received": self.received,
+            "published": self.published,
+            "coalesced": self.coalesced,
+            "superseded": self.superseded,
+            "saved": self.coalesced + self.superseded,
+            "pending": len(self._pending),
+            "dropped": self.dropped,
+        }
+
 
 class ConnectionManager:
-    """WebSocket 連線管理器"""
-    
+    """WebSocket 連線管理器
+
+    客戶端可依訊息類型、序號或測試站訂閱（各條件為 OR）；未訂閱的客戶端接收所有訊息。
+    訂閱以「維度 → 值 → 客戶端集合」索引，分派時只查訊息本身的值，
+    成本與有興趣的客戶端數成正比，而非全部連線數。
+
+    每則廣播依分派順序編上遞增的 seq，最近 WS_REPLAY_BUFFER_SIZE 則保留在 ring buffer；
+    重新連線的客戶端帶 last_seq 與 epoch 即可補送錯過的訊息。epoch 於每次啟動時產生，
+    序號只在同一個 process、同一次啟動內有效。
+    """
+
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
-    
-    async def connect(self, websocket: WebSocket):
+        self.active_connections: Dict[WebSocket, ClientConnection] = {}
+        self._unfiltered: Set[ClientConnection] = set()
+        self._index: Dict[str, Dict[str, Set[ClientConnection]]] = {
+            field: {} for field in SUBSCRIPTION_FIELDS
+        }
+        self.policy = settings.WS_BACKPRESSURE_POLICY
+        if self.policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"WS_BACKPRESSURE_POLICY must be one of {BACKPRESSURE_POLICIES}")
+        self._dispatch_queue: Optional[asyncio.Queue] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.coalescer = BroadcastCoalescer(settings.WS_COALESCE_WINDOW_MS, settings.WS_DISPATCH_QUEUE_SIZE)
+        self.epoch = f"{int(time.time())}-{os.getpid()}"
+        self.seq = 0
+        # 每個元素為 (seq, message, coalesce key, frame)
+        self._history: Deque[tuple] = deque(maxlen=settings.WS_REPLAY_BUFFER_SIZE)
+        self.resumed = 0
+        self.replayed = 0
+        self.resyncs = 0
+        self.broadcast_total = 0
+        self.dispatch_dropped = 0
+        self.disconnected_slow = 0
+
+    async def connect(self, websocket: WebSocket) -> ClientConnection:
         await websocket.accept()
-        self.active_connections.append(websocket)
+        client = ClientConnection(websocket, self, settings.WS_SEND_QUEUE_SIZE, self.policy,
+                                  settings.WS_SEND_TIMEOUT_SECONDS)
+        self.active_connections[websocket] = client
+        self._unfiltered.add(client)
         print(f"Client connected. Total connections: {len(self.active_connections)}")
-    
+        return client
+
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+        client = self.active_connections.pop(websocket, None)
+        if client is None:
+            return
+        self._unfiltered.discard(client)
+        self._unindex(client, client.subscriptions)
+        if not client.closed:
+            client.close()
         print(f"Client disconnected. Total connections: {len(self.active_connections)}")
-    
+
+    def subscribe(self, client: ClientConnection, topics: Dict[str, Iterable[str]]):
+        """新增訂閱；topics 為 {"types": [...], "serials": [...], "stations": [...]} 的子集"""
+        if client.websocket not in self.active_connections:
+            return
+        for field in SUBSCRIPTION_FIELDS:
+            for value in topics.get(field) or ():
+                value = str(value)
+                client.subscriptions[field].add(value)
+                self._index[field].setdefault(value, set()).add(client)
+        if client.subscribed:
+            self._unfiltered.discard(client)
+
+    def unsubscribe(self, client: ClientConnection, topics: Optional[Dict[str, Iterable[str]]] = None):
+        """取消訂閱；topics 為 None 時清除全部，恢復接收所有訊息"""
+        if client.websocket not in self.active_connections:
+            return
+        if topics is None:
+            topics = client.subscriptions
+        removed = {field: {str(value) for value in topics.get(field) or ()}
+                   for field in SUBSCRIPTION_FIELDS}
+        self._unindex(client, removed)
+        for field, values in removed.items():
+            client.subscriptions[field] -= values
+        if not client.subscribed:
+            self._unfiltered.add(client)
+
+    def _unindex(self, client: ClientConnection, topics: Dict[str, Set[str]]):
+        for field, values in topics.items():
+            index = self._index[field]
+            for value in values:
+                clients = index.get(value)
+                if clients is None:
+                    continue
+                clients.discard(client)
+                if not clients:
+                    del index[value]
+
+    def _targets(self, message: dict) -> Set[ClientConnection]:
+        targets = set(self._unfiltered)
+        for field, values in message_topics(message).items():
+            index = self._index[field]
+            for value in values:
+                clients = index.get(str(value))
+                if clients:
+                    targets |= clients
+        return targets
+
     async def broadcast(self, message: dict):
-        """廣播訊息給所有連線的客戶端"""
-        disconnected = []
-        for connection in self.active_connections:
+        """廣播訊息給所有 API process 中未訂閱或訂閱條件相符的客戶端
+
+        先經 coalescer 合併中間狀態，再發佈到 event bus，每個 process 由 deliver 放入自己的分派佇列。
+        """
+        self.coalescer.submit(message)
+
+    async def deliver(self, message: dict):
+        """event bus handler：只放入分派佇列即返回，呼叫端不會被任何一個客戶端拖慢"""
+        if self._dispatcher is None:
+            self._dispatch_queue = asyncio.Queue(maxsize=settings.WS_DISPATCH_QUEUE_SIZE)
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+        try:
+            self._dispatch_queue.put_nowait(message)
+            self.broadcast_total += 1
+        except asyncio.QueueFull:
+            self.dispatch_dropped += 1
+
+    async def _dispatch_loop(self):
+        while True:
+            message = dict(await self._dispatch_queue.get(), seq=self.seq + 1)
             try:
-                await connection.send_json(message)
-            except Exception as e:
-                print(f"Error sending message: {e}")
-                disconnected.append(connection)
-        
-        # 移除斷線的連線
-        for connection in disconnected:
-            if connection in self.active_connections:
-                self.active_connections.remove(connection)
+                frame = encode_message(message)
+            except TypeError as e:
+                print(f"Dropping unserializable broadcast message: {e}")
+                continue
+            self.seq += 1
+            key = coalesce_key(message)
+            # 沒有目標的訊息也要保留，重新連線的客戶端可能需要
+            self._history.append((self.seq, message, key, frame))
+            for client in self._targets(message):
+                client.enqueue(message, key, frame)
+            # 讓 writer 先送出，突發大量廣播時正常速度的客戶端不會被誤判為慢速
+            await asyncio.sleep(0)
+
+    def hello(self, client: ClientConnection):
+        """連線後第一則訊息：告知目前的 epoch 與最新序號"""
+        client.enqueue({
+            "type": "hello",
+            "data": {"epoch": self.epoch, "seq": client.live_since},
+            "timestamp": datetime.now().isoformat()
+        })
+
+    def resume(self, client: ClientConnection, last_seq: int, epoch: Optional[str]) -> bool:
+        """補送 last_seq 之後、連線之前的廣播（依訂閱過濾）
+
+        epoch 不符（伺服器重啟或連到其他 process）、缺口已超出 ring buffer，
+        或補送量超過送出佇列時改送 resync_required，由前端重新載入完整資料。
+        """
+        oldest = self._history[0][0] if self._history else self.seq + 1
+        missed = []
+        reason = None
+        if epoch != self.epoch:
+            reason = "epoch changed"
+        elif last_seq > self.seq:
+            reason = "unknown seq"
+        elif last_seq < oldest - 1:
+            reason = "gap too old"
+        else:
+            missed = [entry for entry in self._history
+                      if last_seq < entry[0] <= client.live_since and client.wants(entry[1])]
+            if len(missed) > client.max_queue:
+                reason = "gap too large"
+
+        if reason:
+            self.resync(client, reason)
+            return False
+
+        for seq, message, key, frame in missed:
+            client.enqueue(message, key, frame)
+        self.resumed += 1
+        self.replayed += len(missed)
+        client.enqueue({
+            "type": "resumed",
+            "data": {"from_seq": last_seq, "to_seq": client.live_since, "replayed": len(missed)},
+            "timestamp": datetime.now().isoformat()
+        })
+        return True
+
+    def resync(self, client: ClientConnection, reason: str):
+        """要求客戶端重新載入完整資料，並自 live_since 之後的即時訊息接續"""
+        self.resyncs += 1
+        client.enqueue({
+            "type": "resync_required",
+            "data": {"epoch": self.epoch, "seq": client.live_since, "reason": reason},
+            "timestamp": datetime.now().isoformat()
+        })
+
+    def _idle(self) -> bool:
+        coalescer_queue = self.coalescer._queue
+        return ((coalescer_queue is None or coalescer_queue.empty())
+                and (self._dispatch_queue is None or self._dispatch_queue.empty())
+                and all(not client._queue for client in self.active_connections.values()))
+
+    async def shutdown(self, drain_timeout: float = 1.0):
+        """送出已排入的廣播（最多等 drain_timeout 秒）後停止分派並關閉所有連線"""
+        deadline = time.monotonic() + drain_timeout
+        while not self._idle() and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        await self.coalescer.stop()
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for client in list(self.active_connections.values()):
+            client.close()
+
+    def stats(self) -> Dict[str, Any]:
+        clients: List[Dict[str, Any]] = [client.stats() for client in self.active_connections.values()]
+        return {
+            "connections": len(clients),
+            "unfiltered": len(self._unfiltered),
+            "topics": {field: len(index) for field, index in self._index.items()},
+            "policy": self.policy,
+            "max_queue": settings.WS_SEND_QUEUE_SIZE,
+            "broadcast_total": self.broadcast_total,
+            "epoch": self.epoch,
+            "seq": self.seq,
+            "replay_buffer": len(self._history),
+            "resumed": self.resumed,
+            "replayed": self.replayed,
+            "resyncs": self.resyncs,
+            "dispatch_pending": self._dispatch_queue.qsize() if self._dispatch_queue else 0,
+            "dispatch_dropped": self.dispatch_dropped,
+            "disconnected_slow": self.disconnected_slow,
+            "coalescer": self.coalescer.stats(),
+            "event_bus": event_bus.stats(),
+            "clients": clients,
+        }
 
 
 manager = ConnectionManager()
+event_bus.subscribe(manager.deliver)
+
+
+def _topics_from(source, parse) -> Dict[str, List[str]]:
+    topics = {}
+    for field in SUBSCRIPTION_FIELDS:
+        values = parse(source.get(field))
+        if values:
+            topics[field] = values
+    return topics
+
+
+def _query_list(value: Optional[str]) -> List[str]:
+    return [item for item in (value or "").split(",") if item]
+
+
+def _parse_seq(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
 
 
 @router.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket 端點"""
-    await manager.connect(websocket)
+    """WebSocket 端點
+
+    query string 可帶訂閱與續傳資訊，例如
+    ``/ws?types=pcba_event,uid_search&last_seq=120&epoch=...``；
+    在連線當下套用，補送的訊息不會與即時訊息交錯。
+    """
+    client = await manager.connect(websocket)
+    params = websocket.query_params
+    topics = _topics_from(params, _query_list)
+    if topics:
+        manager.subscribe(client, topics)
+    manager.hello(client)
+    last_seq = _parse_seq(params.get("last_seq"))
+    if last_seq is not None:
+        manager.resume(client, last_seq, params.get("epoch"))
     try:
         while True:
             # 接收客戶端訊息
             data = await websocket.receive_text()
             message = json.loads(data)
-            
-            # 回應客戶端
-            await websocket.send_json({
+
+            # 訂閱協定：{"action": "subscribe" | "unsubscribe", "types": [...], "serials": [...], "stations": [...]}
+            action = message.get("action") if isinstance(message, dict) else None
+            if action in ("subscribe", "unsubscribe"):
+                topics = _topics_from(message, lambda value: value if isinstance(value, list) else None)
+                if action == "subscribe":
+                    manager.subscribe(client, topics)
+                else:
+                    manager.unsubscribe(client, topics or None)
+                client.enqueue({
+                    "type": "subscribed",
+                    "data": {field: sorted(values) for field, values in client.subscriptions.items()},
+                    "timestamp": datetime.now().isoformat()
+                })
+                continue
+            if action == "resume":
+                # 續傳只在連線時（query string）處理：連線後即時訊息可能已送出或排入佇列，
+                # 此時補送會使 seq 倒退，改要求客戶端重新載入
+                manager.resync(client, "resume must be sent when connecting")
+                continue
+
+            # 回應客戶端（同樣經由送出佇列，避免與廣播同時寫入）
+            client.enqueue({
                 "type": "echo",
                 "data": message,
                 "timestamp": datetime.now().isoformat()
@@ -64,12 +600,18 @@ async def websocket_endpoint(websocket: WebSocket):
         manager.disconnect(websocket)
 
 
+@router.get("/api/ws/stats")
+async def get_websocket_stats():
+    """各連線的送出佇列深度與丟棄 / 合併數"""
+    return manager.stats()
+
+
 async def broadcast_test_result(test_record: dict):
-    """廣播測試結果到所有連線的客戶端"""
+    """廣播測試結果到所有連線的客戶端（test_record 可直接包含 datetime）"""
     message = {
         "type": "test_result",
         "data": test_record,
-        "timestamp": datetime.now().isoformat()
+        "timestamp": datetime.now()
     }
     await manager.broadcast(message)
 
@@ -79,6 +621,6 @@ async def broadcast_system_status(status: dict):
     message = {
         "type": "system_status",
         "data": status,
-        "timestamp": datetime.now().isoformat()
+        "timestamp": datetime.now()
     }
     await manager.broadcast(message)
@@ -1,9 +1,10 @@
-import httpx
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from datetime import datetime
 from app.config import settings
-from app.database import SessionLocal
-from app.services import TestRecordService, CloudUploadService
+from app.cloud_upload import upload_pending_records
+from app.database import AsyncSessionLocal
+from app.leader import leader
+from app.services import CloudUploadService
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -17,77 +18,42 @@ async def upload_to_cloud():
     if not settings.CLOUD_UPLOAD_ENABLED:
         logger.info("Cloud upload is disabled")
         return
+    if not leader.is_leader:
+        # 多 worker 部署時只由持有 lease 的 worker 上傳
+        logger.info("Skipping cloud upload: not the scheduler leader")
+        return
     
     logger.info("Starting cloud upload task...")
-    db = SessionLocal()
     
     try:
-        # 取得未上傳的記錄
-        unuploaded_records = TestRecordService.get_unuploaded_records(db)
-        
-        if not unuploaded_records:
-            logger.info("No records to upload")
-            return
-        
-        # 準備上傳資料
-        records_data = [
-            {
-                "id": record.id,
-                "device_id": record.device_id,
-                "product_name": record.product_name,
-                "serial_number": record.serial_number,
-                "test_station": record.test_station,
-                "test_result": record.test_result,
-                "test_time": record.test_time.isoformat(),
-                "test_data": record.test_data,
-                "voltage": record.voltage,
-                "current": record.current,
-                "temperature": record.temperature,
-            }
-            for record in unuploaded_records
-        ]
-        
-        # 發送到雲端 API
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                settings.CLOUD_API_URL,
-                json={"records": records_data},
-                headers={"Authorization": f"Bearer {settings.CLOUD_API_KEY}"}
-            )
-            
-            if response.status_code == 200:
-                # 標記為已上傳
-                record_ids = [r.id for r in unuploaded_records]
-                TestRecordService.mark_as_uploaded(db, record_ids)
-                
-                # 記錄成功日誌
-                CloudUploadService.create_upload_log(
-                    db,
-                    records_count=len(unuploaded_records),
-                    status="SUCCESS"
-                )
-                logger.info(f"Successfully uploaded {len(unuploaded_records)} records")
-            else:
-                # 記錄失敗日誌
-                error_msg = f"HTTP {response.status_code}: {response.text}"
-                CloudUploadService.create_upload_log(
-                    db,
-                    records_count=len(unuploaded_records),
-                    status="FAILED",
-                    error_message=error_msg
-                )
-                logger.error(f"Upload failed: {error_msg}")
-    
+        summary = await upload_pending_records()
     except Exception as e:
         logger.error(f"Upload error: {str(e)}")
-        CloudUploadService.create_upload_log(
-            db,
-            records_count=0,
-            status="FAILED",
-            error_message=str(e)
-        )
-    finally:
-        db.close()
+        async with AsyncSessionLocal() as db:
+            await CloudUploadService.create_upload_log(
+                db,
+                records_count=0,
+                status="FAILED",
+                error_message=str(e)
+            )
+        return
+    
+    if summary.errors == ["circuit breaker open"]:
+        logger.warning("Cloud upload paused: circuit breaker open")
+        return
+    if not summary.chunks:
+        logger.info("No records to upload")
+        return
+    
+    # 每段一筆日誌（batch_id / 嘗試次數 / 延遲），可分析恢復期間的吞吐量
+    if summary.batches:
+        async with AsyncSessionLocal() as db:
+            await CloudUploadService.create_batch_logs(db, summary.batches)
+    if summary.errors:
+        logger.error(f"Upload {summary.status}: {summary.uploaded} records in "
+                     f"{summary.chunks - summary.failed_chunks}/{summary.chunks} chunks")
+    else:
+        logger.info(f"Successfully uploaded {summary.uploaded} records in {summary.chunks} chunks")
 
 
 def start_scheduler():
@@ -109,5 +75,6 @@ def start_scheduler():
 
 def stop_scheduler():
     """停止排程器"""
-    scheduler.shutdown()
-    logger.info("Scheduler stopped")
+    if scheduler.running:
+        scheduler.shutdown()
+        logger.info("Scheduler stopped")
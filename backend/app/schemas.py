@@ -22,6 +22,28 @@ class TestRecordCreate(TestRecordBase):
     pass
 
 
+class TestRecordBulkCreate(BaseModel):
+    # 逐筆驗證：單筆格式錯誤只會被標記為 rejected，不影響同批其他資料
+    records: List[Dict[str, Any]] = Field(..., min_length=1, max_length=1000,
+                                          description="TestRecordCreate 格式的測試記錄")
+
+
+class TestRecordBulkResult(BaseModel):
+    index: int
+    status: str = Field(..., description="inserted / updated / rejected")
+    id: Optional[int] = None
+    device_id: Optional[str] = None
+    serial_number: Optional[str] = None
+    error: Optional[str] = None
+
+
+class TestRecordBulkResponse(BaseModel):
+    inserted: int
+    updated: int
+    rejected: int
+    results: List[TestRecordBulkResult]
+
+
 class TestRecordResponse(TestRecordBase):
     id: int
     uploaded_to_cloud: bool
@@ -51,6 +73,9 @@ class CloudUploadLogResponse(BaseModel):
     records_count: int
     status: str
     error_message: Optional[str]
+    batch_id: Optional[str] = None
+    attempts: Optional[int] = None
+    latency_ms: Optional[float] = None
 
     class Config:
         from_attributes = True
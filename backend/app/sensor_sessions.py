@@ -0,0 +1,81 @@
+"""進行中 Sensor session 的 write-through 快取
+
+以 serial_wle 為 key 保留 session 的 run 欄位與判定 bitmask。每個 stage 事件
+不必每次 selectinload 整個 run 與所有測項，只需鎖定讀取 run 的 bitmask、
+upsert 該測項並更新 run。
+
+快取只在 commit 成功後更新；寫入失敗、session 結束（testComplete）、
+同一 WLE 再次 serial-found、run 被刪除，或其他 API process 更新了同一 session 時移除，
+下一個事件再從資料庫載入。
+"""
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from app.config import settings
+from app.sensor_verdict import SensorVerdict
+
+
+class ActiveSensorSession:
+    """快取中的 session：run 欄位與判定 bitmask"""
+
+    def __init__(self, run_id: int, serial_wle: str, started_at: datetime, test_result: str,
+                 verdict: Optional[SensorVerdict] = None):
+        self.id = run_id
+        self.serial_wle = serial_wle
+        self.started_at = started_at
+        self.test_result = test_result
+        self.verdict = verdict or SensorVerdict()
+
+    @classmethod
+    def from_run(cls, run) -> "ActiveSensorSession":
+        """由 SensorTestRun 建立"""
+        verdict = SensorVerdict(run.passed_mask or 0, run.failed_mask or 0)
+        return cls(run.id, run.serial_wle, run.started_at, run.test_result, verdict)
+
+
+class SensorSessionCache:
+    """LRU 上限的 serial_wle → ActiveSensorSession 快取"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._sessions: "OrderedDict[str, ActiveSensorSession]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, serial_wle: str) -> Optional[ActiveSensorSession]:
+        session = self._sessions.get(serial_wle)
+        if session is None:
+            self.misses += 1
+            return None
+        self._sessions.move_to_end(serial_wle)
+        self.hits += 1
+        return session
+
+    def put(self, session: ActiveSensorSession):
+        self._sessions[session.serial_wle] = session
+        self._sessions.move_to_end(session.serial_wle)
+        while len(self._sessions) > self.max_size:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    def evict(self, serial_wle: str):
+        if self._sessions.pop(serial_wle, None) is not None:
+            self.evictions += 1
+
+    def evict_run(self, run_id: int):
+        for serial_wle in [key for key, session in self._sessions.items() if session.id == run_id]:
+            self.evict(serial_wle)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+sensor_sessions = SensorSessionCache(settings.SENSOR_SESSION_CACHE_SIZE)
@@ -0,0 +1,92 @@
+"""Sensor session 的增量判定
+
+每個結果測項對應一個 bit，run 上保存兩個 bitmask：passed_mask / failed_mask，
+分別為已記錄為 pass / fail 的測項。
+
+每個 stage 事件只以 SQL 對 run 做位元運算（不以記憶體中的值覆寫），再由寫入後的
+bitmask 得出新的 test_result，不必重建整個測項狀態表。寫入路徑、testComplete 與
+init_db 的批次重算都使用本模組，確保三處的判定一致。
+"""
+from typing import Dict, Iterable, Optional
+
+SENSOR_RESULT_STAGES = [
+    "getSensorIC", "sht41", "ens210", "lps22df", "bme690",
+    "testButton", "testGreenLED", "testOrangeLED", "testBuzzer", "testSPI",
+]
+
+# 測項 → bit；測項 → 寫入 sensor_test_items.sequence 的順序
+STAGE_BITS = {stage: 1 << index for index, stage in enumerate(SENSOR_RESULT_STAGES)}
+STAGE_SEQUENCE = {stage: index + 1 for index, stage in enumerate(SENSOR_RESULT_STAGES)}
+ALL_STAGES_MASK = (1 << len(SENSOR_RESULT_STAGES)) - 1
+
+
+def stages_mask(stages: Iterable[str]) -> int:
+    """測項名稱 → bitmask；未知的測項忽略"""
+    mask = 0
+    for stage in stages:
+        mask |= STAGE_BITS.get(stage, 0)
+    return mask
+
+
+def stage_update(stage: str, status: str) -> Dict[str, int]:
+    """一個測項結果對兩個 bitmask 的變更：先清除該測項的 bit，再依狀態設定
+
+    回傳 keep（保留其他測項的 mask）與 passed / failed（要 OR 上的 bit），
+    供 SQL ``passed_mask = (passed_mask & keep) | passed`` 原子更新。
+    """
+    bit = STAGE_BITS[stage]
+    return {
+        "keep": ALL_STAGES_MASK ^ bit,
+        "passed": bit if status == "pass" else 0,
+        "failed": bit if status == "fail" else 0,
+    }
+
+
+class SensorVerdict:
+    """一個 session 的兩個 bitmask 與由其得出的判定"""
+
+    __slots__ = ("passed", "failed")
+
+    def __init__(self, passed: int = 0, failed: int = 0):
+        self.passed = passed
+        self.failed = failed
+
+    def apply(self, stage: str, status: str):
+        """記錄一個測項結果；同一測項重測時覆蓋先前的狀態"""
+        change = stage_update(stage, status)
+        self.passed = (self.passed & change["keep"]) | change["passed"]
+        self.failed = (self.failed & change["keep"]) | change["failed"]
+
+    @property
+    def result(self) -> str:
+        if self.failed:
+            return "FAIL"
+        # session 只記錄 pass / fail，沒有 fail 且至少一項 pass 即「已記錄測項全數通過」；
+        # 依 getSensorIC 偵測結果所需的測項全數通過時必然也符合此條件
+        if self.passed:
+            return "PASS"
+        return "PENDING"
+
+    def final_result(self, expected_stages: Optional[Iterable[str]] = None) -> str:
+        """testComplete 時的判定：watcher 提供 expected_stages 時以其為準"""
+        if self.failed:
+            return "FAIL"
+        if expected_stages and all(stage in STAGE_BITS for stage in expected_stages):
+            if not stages_mask(expected_stages) & ~self.passed:
+                return "PASS"
+        if self.passed & STAGE_BITS["getSensorIC"]:
+            return "PASS"
+        return "PENDING"
+
+    def values(self) -> Dict[str, int]:
+        """sensor_test_runs 的對應欄位"""
+        return {"passed_mask": self.passed, "failed_mask": self.failed}
+
+
+def verdict_sql(passed_column: str = "passed_mask", failed_column: str = "failed_mask") -> str:
+    """與 SensorVerdict.result 相同的 SQL 運算式，供 init_db 批次重算"""
+    return f"""CASE
+                    WHEN {failed_column} <> 0 THEN 'FAIL'
+                    WHEN {passed_column} <> 0 THEN 'PASS'
+                    ELSE 'PENDING'
+                END"""
@@ -1,16 +1,32 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import desc, and_
-from typing import List, Optional
-from datetime import datetime
-from app.models import TestRecord, CloudUploadLog
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import case, delete, desc, func, insert, select, update, tuple_
+from sqlalchemy.exc import IntegrityError
+from pydantic import ValidationError
+from collections import Counter
+import operator
+from typing import AsyncIterator, List, Optional, Dict, Any
+from datetime import datetime, timedelta
+from app.cache import TEST_RECORD_STATS, stats_cache
+from app.database import collation_key, seconds_ago, upsert_statement
+from app.exporting import stream_table
+from app.measurements import parse_filter_value, parse_measurements
+from app.pagination import keyset_before
+from app.models import (
+    TestRecord, CloudUploadLog, TestRecordHourlyStat, SensorRunHourlyStat, TestMeasurement,
+    TestRecordOutbox, CloudUploadCursor, CLOUD_UPLOAD_CURSOR,
+)
 from app.schemas import TestRecordCreate, TestRecordUpdate
+from app.upload_signal import upload_signal
+
+# 批次新增與其他 transaction 衝突時，重新鎖定讀取的次數上限
+BULK_INSERT_ATTEMPTS = 3
 
 
 class TestRecordService:
     """測試記錄服務"""
     
     @staticmethod
-    def create_test_record(db: Session, record: TestRecordCreate) -> TestRecord:
+    async def create_test_record(db: AsyncSession, record: TestRecordCreate) -> TestRecord:
         """建立或更新測試記錄
         
         使用 upsert 邏輯：
@@ -22,102 +38,652 @@ class TestRecordService:
         serial_number = record_data.get('serial_number')
         
         # 查詢是否已存在相同的 device_id + serial_number
-        existing_record = db.query(TestRecord).filter(
-            TestRecord.device_id == device_id,
-            TestRecord.serial_number == serial_number
-        ).first()
+        existing_record = (await db.execute(
+            select(TestRecord).where(
+                TestRecord.device_id == device_id,
+                TestRecord.serial_number == serial_number
+            ).with_for_update()
+        )).scalars().first()
         
+        deltas = Counter({StatsRollupService.test_record_key(record_data): 1})
         if existing_record:
             # 更新現有記錄
+            deltas[StatsRollupService.test_record_key(existing_record)] -= 1
             for key, value in record_data.items():
                 setattr(existing_record, key, value)
-            db.commit()
-            db.refresh(existing_record)
+            existing_record.uploaded_to_cloud = False
+            await MeasurementService.replace_measurements(db, {existing_record.id: existing_record.test_data})
+            await CloudUploadService.enqueue(db, [existing_record.id])
+            await StatsRollupService.apply_test_record_deltas(db, deltas)
+            await db.commit()
+            stats_cache.invalidate(TEST_RECORD_STATS)
+            upload_signal.notify()
+            await db.refresh(existing_record)
             return existing_record
         else:
             # 新增新記錄
             db_record = TestRecord(**record_data)
             db.add(db_record)
-            db.commit()
-            db.refresh(db_record)
+            await db.flush()
+            await MeasurementService.replace_measurements(db, {db_record.id: db_record.test_data})
+            await CloudUploadService.enqueue(db, [db_record.id])
+            await StatsRollupService.apply_test_record_deltas(db, deltas)
+            await db.commit()
+            stats_cache.invalidate(TEST_RECORD_STATS)
+            upload_signal.notify()
+            await db.refresh(db_record)
             return db_record
     
     @staticmethod
-    def get_test_record(db: Session, record_id: int) -> Optional[TestRecord]:
+    async def bulk_upsert(db: AsyncSession, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """批次建立或更新測試記錄
+
+        一次 SELECT ... FOR UPDATE 鎖定既有資料、一次多筆 INSERT 新增不存在的記錄、
+        一次多筆 native upsert（對 uq_device_serial）更新既有記錄，
+        整批在同一個 transaction 內 commit。回傳每筆的處理結果：
+        - inserted / updated：已寫入，附上記錄 id
+        - rejected：格式驗證失敗，或被同批後面相同 (device_id, serial_number) 取代
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(rows)
+        # key 依資料庫比對規則正規化，與唯一索引視為相同的序號才會歸為同一筆
+        accepted: Dict[tuple, tuple] = {}
+
+        for index, raw in enumerate(rows):
+            try:
+                data = TestRecordCreate.model_validate(raw).model_dump()
+            except ValidationError as e:
+                results[index] = {
+                    "index": index,
+                    "status": "rejected",
+                    "device_id": raw.get("device_id") if isinstance(raw, dict) else None,
+                    "serial_number": raw.get("serial_number") if isinstance(raw, dict) else None,
+                    "error": "; ".join(
+                        f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()
+                    ),
+                }
+                continue
+
+            key = collation_key(db, data["device_id"], data["serial_number"])
+            if key in accepted:
+                # 同批重複序號：以最後一筆為準
+                previous_index, previous = accepted[key]
+                results[previous_index] = {
+                    "index": previous_index,
+                    "status": "rejected",
+                    "device_id": previous["device_id"],
+                    "serial_number": previous["serial_number"],
+                    "error": f"superseded by row {index} with the same device_id/serial_number",
+                }
+            accepted[key] = (index, data)
+
+        if accepted:
+            existing = await TestRecordService._insert_missing(db, accepted)
+
+            if existing:
+                update_columns = list(TestRecordCreate.model_fields.keys())
+                stmt = upsert_statement(
+                    db,
+                    TestRecord.__table__,
+                    [accepted[key][1] for key in existing],
+                    index_elements=["device_id", "serial_number"],
+                    update=lambda new: {
+                        **{column: new[column] for column in update_columns},
+                        # native upsert 不會觸發 ORM 的 onupdate
+                        "updated_at": func.now(),
+                        "uploaded_to_cloud": False,
+                    },
+                )
+                await db.execute(stmt)
+
+            deltas = Counter()
+            for key, (_, data) in accepted.items():
+                deltas[StatsRollupService.test_record_key(data)] += 1
+                if key in existing:
+                    deltas[StatsRollupService.test_record_key(existing[key])] -= 1
+            await StatsRollupService.apply_test_record_deltas(db, deltas)
+
+            ids = {
+                collation_key(db, row.device_id, row.serial_number): row.id
+                for row in await db.execute(
+                    select(TestRecord.id, TestRecord.device_id, TestRecord.serial_number)
+                    .where(TestRecordService._key_filter(accepted))
+                )
+            }
+            await MeasurementService.replace_measurements(
+                db, {ids[key]: data["test_data"] for key, (_, data) in accepted.items()}
+            )
+            await CloudUploadService.enqueue(db, [ids[key] for key in accepted])
+            await db.commit()
+            stats_cache.invalidate(TEST_RECORD_STATS)
+            upload_signal.notify(len(accepted))
+
+            for key, (index, data) in accepted.items():
+                results[index] = {
+                    "index": index,
+                    "status": "updated" if key in existing else "inserted",
+                    "id": ids[key],
+                    "device_id": data["device_id"],
+                    "serial_number": data["serial_number"],
+                }
+
+        return {
+            "inserted": sum(1 for r in results if r["status"] == "inserted"),
+            "updated": sum(1 for r in results if r["status"] == "updated"),
+            "rejected": sum(1 for r in results if r["status"] == "rejected"),
+            "results": results,
+        }
+    
+    @staticmethod
+    def _key_filter(accepted: Dict[tuple, tuple]):
+        """以請求中的寫法查詢本批序號，由資料庫依其 collation 比對"""
+        return tuple_(TestRecord.device_id, TestRecord.serial_number).in_(
+            [(data["device_id"], data["serial_number"]) for _, data in accepted.values()]
+        )
+
+    @staticmethod
+    async def _insert_missing(db: AsyncSession, accepted: Dict[tuple, tuple]) -> Dict[tuple, Any]:
+        """鎖定既有的記錄並新增不存在的記錄，回傳既有記錄寫入前的值
+
+        既有記錄以 SELECT ... FOR UPDATE 讀取，同時進行的 transaction 要等本批 commit 後
+        才能讀到，rollup 的增減不會重複計算。不存在的記錄以一般 INSERT 新增；
+        其他 transaction 同時新增了相同的序號時 INSERT 失敗，改為重新鎖定讀取，
+        因此「新增」一定是本 transaction 實際寫入的列。重試 BULK_INSERT_ATTEMPTS 次
+        仍衝突（例如序號比對規則與資料庫 collation 不一致）時放棄整批，不持鎖無限重試。
+        """
+        for attempt in range(1, BULK_INSERT_ATTEMPTS + 1):
+            existing = {
+                collation_key(db, row.device_id, row.serial_number): row
+                for row in await db.execute(
+                    select(
+                        TestRecord.device_id, TestRecord.serial_number, TestRecord.test_time,
+                        TestRecord.test_station, TestRecord.product_name, TestRecord.test_result,
+                    ).where(TestRecordService._key_filter(accepted)).with_for_update()
+                )
+            }
+            missing = [data for key, (_, data) in accepted.items() if key not in existing]
+            if not missing:
+                return existing
+            try:
+                async with db.begin_nested():
+                    await db.execute(insert(TestRecord.__table__), missing)
+                return existing
+            except IntegrityError:
+                if attempt == BULK_INSERT_ATTEMPTS:
+                    raise
+
+    @staticmethod
+    async def get_test_record(db: AsyncSession, record_id: int) -> Optional[TestRecord]:
         """取得單筆測試記錄"""
-        return db.query(TestRecord).filter(TestRecord.id == record_id).first()
+        return await db.get(TestRecord, record_id)
     
     @staticmethod
-    def get_test_records(
-        db: Session,
-        skip: int = 0,
-        limit: int = 100,
+    def apply_filters(
+        query,
         device_id: Optional[str] = None,
         test_result: Optional[str] = None,
         start_date: Optional[datetime] = None,
         end_date: Optional[datetime] = None
-    ) -> List[TestRecord]:
-        """取得測試記錄列表（支援篩選）"""
-        query = db.query(TestRecord)
-        
+    ):
+        """套用列表 / 匯出共用的篩選條件"""
         if device_id:
-            query = query.filter(TestRecord.device_id == device_id)
+            query = query.where(TestRecord.device_id == device_id)
         if test_result:
-            query = query.filter(TestRecord.test_result == test_result)
+            query = query.where(TestRecord.test_result == test_result)
         if start_date:
-            query = query.filter(TestRecord.test_time >= start_date)
+            query = query.where(TestRecord.test_time >= start_date)
         if end_date:
-            query = query.filter(TestRecord.test_time <= end_date)
-        
-        return query.order_by(desc(TestRecord.test_time)).offset(skip).limit(limit).all()
+            query = query.where(TestRecord.test_time <= end_date)
+        return query
+    
+    @staticmethod
+    def export_test_records(
+        export_format: str,
+        device_id: Optional[str] = None,
+        test_result: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None
+    ) -> AsyncIterator[str]:
+        """依篩選條件串流匯出測試記錄（依 test_time 由舊到新）"""
+        columns = [column.name for column in TestRecord.__table__.columns]
+        query = TestRecordService.apply_filters(
+            select(*TestRecord.__table__.columns), device_id, test_result, start_date, end_date
+        ).order_by(TestRecord.test_time, TestRecord.id)
+        return stream_table(query, columns, export_format)
     
     @staticmethod
-    def update_test_record(
-        db: Session,
+    async def get_test_records(
+        db: AsyncSession,
+        skip: int = 0,
+        limit: int = 100,
+        device_id: Optional[str] = None,
+        test_result: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        cursor: Optional[str] = None
+    ) -> List[TestRecord]:
+        """取得測試記錄列表（支援篩選）
+
+        有 cursor 時使用 keyset 分頁並忽略 skip；skip 僅保留給舊版客戶端。
+        """
+        query = TestRecordService.apply_filters(
+            select(TestRecord), device_id, test_result, start_date, end_date
+        )
+        query = query.order_by(desc(TestRecord.test_time), desc(TestRecord.id))
+        if cursor:
+            query = keyset_before(query, TestRecord.test_time, TestRecord.id, cursor)
+        else:
+            query = query.offset(skip)
+        query = query.limit(limit)
+        return list((await db.execute(query)).scalars().all())
+    
+    @staticmethod
+    async def update_test_record(
+        db: AsyncSession,
         record_id: int,
         record_update: TestRecordUpdate
     ) -> Optional[TestRecord]:
         """更新測試記錄"""
-        db_record = db.query(TestRecord).filter(TestRecord.id == record_id).first()
+        db_record = await db.get(TestRecord, record_id)
         if db_record:
+            deltas = Counter({StatsRollupService.test_record_key(db_record): -1})
             update_data = record_update.model_dump(exclude_unset=True)
             for key, value in update_data.items():
                 setattr(db_record, key, value)
-            db.commit()
-            db.refresh(db_record)
+            deltas[StatsRollupService.test_record_key(db_record)] += 1
+            db_record.uploaded_to_cloud = False
+            if "test_data" in update_data:
+                await MeasurementService.replace_measurements(db, {db_record.id: db_record.test_data})
+            await CloudUploadService.enqueue(db, [db_record.id])
+            await StatsRollupService.apply_test_record_deltas(db, deltas)
+            await db.commit()
+            stats_cache.invalidate(TEST_RECORD_STATS)
+            upload_signal.notify()
+            await db.refresh(db_record)
         return db_record
     
     @staticmethod
-    def delete_test_record(db: Session, record_id: int) -> bool:
+    async def delete_test_record(db: AsyncSession, record_id: int) -> bool:
         """刪除測試記錄"""
-        db_record = db.query(TestRecord).filter(TestRecord.id == record_id).first()
+        db_record = await db.get(TestRecord, record_id)
         if db_record:
-            db.delete(db_record)
-            db.commit()
+            await db.execute(delete(TestMeasurement).where(TestMeasurement.record_id == record_id))
+            await db.delete(db_record)
+            await StatsRollupService.apply_test_record_deltas(
+                db, Counter({StatsRollupService.test_record_key(db_record): -1})
+            )
+            await db.commit()
+            stats_cache.invalidate(TEST_RECORD_STATS)
             return True
         return False
-    
-    @staticmethod
-    def get_unuploaded_records(db: Session) -> List[TestRecord]:
-        """取得未上傳至雲端的記錄"""
-        return db.query(TestRecord).filter(TestRecord.uploaded_to_cloud == False).all()
-    
+
+
+class MeasurementService:
+    """test_data 量測值索引與查詢"""
+
+    OPERATORS = {
+        "eq": operator.eq, "ne": operator.ne,
+        "gt": operator.gt, "gte": operator.ge,
+        "lt": operator.lt, "lte": operator.le,
+    }
+
     @staticmethod
-    def mark_as_uploaded(db: Session, record_ids: List[int]):
-        """標記記錄為已上傳"""
-        db.query(TestRecord).filter(TestRecord.id.in_(record_ids)).update(
-            {"uploaded_to_cloud": True},
-            synchronize_session=False
+    async def replace_measurements(db: AsyncSession, test_data_by_record: Dict[int, Optional[str]]):
+        """以 test_data 重建指定記錄的量測值（不 commit，由呼叫端一併提交）"""
+        if not test_data_by_record:
+            return
+        await db.execute(
+            delete(TestMeasurement).where(TestMeasurement.record_id.in_(list(test_data_by_record)))
         )
-        db.commit()
+        rows = [
+            {"record_id": record_id, **row}
+            for record_id, test_data in test_data_by_record.items()
+            for row in parse_measurements(test_data)
+        ]
+        if rows:
+            await db.execute(insert(TestMeasurement), rows)
+
+    @staticmethod
+    def condition(op: str, raw_value: str):
+        """依值的型別比對對應欄位；bool / 字串僅支援 eq、ne"""
+        value = parse_filter_value(raw_value)
+        if isinstance(value, bool):
+            column = TestMeasurement.bool_value
+        elif isinstance(value, float):
+            column = TestMeasurement.num_value
+        else:
+            column = TestMeasurement.text_value
+        if column is not TestMeasurement.num_value and op not in ("eq", "ne"):
+            raise ValueError(f"operator '{op}' requires a numeric value")
+        return MeasurementService.OPERATORS[op](column, value)
+
+    @staticmethod
+    async def search_records(
+        db: AsyncSession,
+        key: str,
+        op: str,
+        value: str,
+        limit: int = 100,
+        device_id: Optional[str] = None,
+        test_result: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        cursor: Optional[str] = None
+    ) -> List[TestRecord]:
+        """依量測值條件查詢測試記錄（由新到舊，支援 keyset 分頁）"""
+        query = select(TestRecord).join(
+            TestMeasurement, TestMeasurement.record_id == TestRecord.id
+        ).where(TestMeasurement.key == key, MeasurementService.condition(op, value))
+        query = TestRecordService.apply_filters(query, device_id, test_result, start_date, end_date)
+        query = query.order_by(desc(TestRecord.test_time), desc(TestRecord.id))
+        if cursor:
+            query = keyset_before(query, TestRecord.test_time, TestRecord.id, cursor)
+        return list((await db.execute(query.limit(limit))).scalars().all())
+
+    @staticmethod
+    async def aggregate(
+        db: AsyncSession,
+        key: str,
+        group_by: Optional[str] = None,
+        device_id: Optional[str] = None,
+        test_result: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None
+    ) -> List[Dict[str, Any]]:
+        """量測值統計：數值的 count/min/max/avg，布林值的 true/false 筆數"""
+        measurement = TestMeasurement
+        group_column = getattr(TestRecord, group_by) if group_by else None
+        query = select(
+            *([group_column.label("group")] if group_column is not None else []),
+            func.count(measurement.id).label("count"),
+            func.min(measurement.num_value).label("min"),
+            func.max(measurement.num_value).label("max"),
+            func.avg(measurement.num_value).label("avg"),
+            func.sum(case((measurement.bool_value == True, 1), else_=0)).label("true_count"),
+            func.sum(case((measurement.bool_value == False, 1), else_=0)).label("false_count"),
+        ).select_from(measurement).join(
+            TestRecord, TestRecord.id == measurement.record_id
+        ).where(measurement.key == key)
+        query = TestRecordService.apply_filters(query, device_id, test_result, start_date, end_date)
+        if group_column is not None:
+            query = query.group_by(group_column).order_by(group_column)
+
+        return [
+            {
+                **({"group": row.group} if group_column is not None else {}),
+                "key": key,
+                "count": int(row.count or 0),
+                "min": row.min,
+                "max": row.max,
+                "avg": round(float(row.avg), 4) if row.avg is not None else None,
+                "true_count": int(row.true_count or 0),
+                "false_count": int(row.false_count or 0),
+            }
+            for row in await db.execute(query)
+        ]
+
+
+def hour_bucket(value: datetime) -> datetime:
+    """取整點，作為彙總表的時間桶"""
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def _pass_rate(passed: int, completed: int) -> float:
+    return round((passed / completed) * 100, 1) if completed else 0
+
+
+class StatsRollupService:
+    """Dashboard 統計彙總服務
+
+    寫入路徑在同一個 transaction 內呼叫 apply_*_deltas 增量更新每小時彙總表，
+    統計與趨勢查詢只讀彙總表，成本不隨歷史資料量成長。
+    """
+
+    @staticmethod
+    def test_record_key(record) -> tuple:
+        """測試記錄對應的彙總鍵；可傳入 ORM 物件、查詢 row 或 dict"""
+        get = record.get if isinstance(record, dict) else lambda name: getattr(record, name)
+        test_time = get("test_time")
+        if isinstance(test_time, str):
+            test_time = datetime.fromisoformat(test_time)
+        return (hour_bucket(test_time), get("device_id"), get("test_station"),
+                get("product_name"), get("test_result"))
+
+    @staticmethod
+    async def apply_test_record_deltas(db: AsyncSession, deltas: Counter):
+        """以 native upsert 累加計數（不 commit，由呼叫端一併提交）"""
+        rows = [
+            {"bucket_hour": key[0], "device_id": key[1], "test_station": key[2],
+             "product_name": key[3], "test_result": key[4], "record_count": count}
+            for key, count in deltas.items() if count
+        ]
+        if not rows:
+            return
+        table = TestRecordHourlyStat.__table__
+        await db.execute(upsert_statement(
+            db, table, rows,
+            index_elements=[column.name for column in table.primary_key],
+            update=lambda new: {"record_count": table.c.record_count + new.record_count},
+        ))
+
+    @staticmethod
+    async def apply_sensor_run_transition(
+        db: AsyncSession,
+        started_at: datetime,
+        old_result: Optional[str],
+        new_result: Optional[str]
+    ):
+        """Sensor session 結果變更；old_result 為 None 表示新建，new_result 為 None 表示刪除"""
+        if old_result == new_result:
+            return
+        bucket = hour_bucket(started_at)
+        deltas = Counter()
+        if old_result:
+            deltas[old_result] -= 1
+        if new_result:
+            deltas[new_result] += 1
+        table = SensorRunHourlyStat.__table__
+        await db.execute(upsert_statement(
+            db, table,
+            [{"bucket_hour": bucket, "test_result": result, "run_count": count}
+             for result, count in deltas.items()],
+            index_elements=["bucket_hour", "test_result"],
+            update=lambda new: {"run_count": table.c.run_count + new.run_count},
+        ))
+
+    @staticmethod
+    def _test_record_filters(query, device_id, test_station, product_name):
+        if device_id:
+            query = query.where(TestRecordHourlyStat.device_id == device_id)
+        if test_station:
+            query = query.where(TestRecordHourlyStat.test_station == test_station)
+        if product_name:
+            query = query.where(TestRecordHourlyStat.product_name == product_name)
+        return query
+
+    @staticmethod
+    async def get_test_record_stats(
+        db: AsyncSession,
+        device_id: Optional[str] = None,
+        test_station: Optional[str] = None,
+        product_name: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """測試記錄總數、良率與今日筆數"""
+        stat = TestRecordHourlyStat
+        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        query = StatsRollupService._test_record_filters(select(
+            func.sum(stat.record_count).label("total"),
+            func.sum(case((stat.test_result == "PASS", stat.record_count), else_=0)).label("passed"),
+            func.sum(case((stat.test_result == "FAIL", stat.record_count), else_=0)).label("failed"),
+            func.sum(case((stat.bucket_hour >= today_start, stat.record_count), else_=0)).label("today_total"),
+        ), device_id, test_station, product_name)
+        totals = (await db.execute(query)).one()
+
+        passed = int(totals.passed or 0)
+        failed = int(totals.failed or 0)
+        return {
+            "total": int(totals.total or 0),
+            "passed": passed,
+            "failed": failed,
+            "today_total": int(totals.today_total or 0),
+            "pass_rate": _pass_rate(passed, passed + failed),
+        }
+
+    @staticmethod
+    async def get_test_record_trend(
+        db: AsyncSession,
+        hours: int = 24,
+        device_id: Optional[str] = None,
+        test_station: Optional[str] = None,
+        product_name: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """最近 N 小時每小時的測試筆數與良率"""
+        stat = TestRecordHourlyStat
+        since = hour_bucket(datetime.now()) - timedelta(hours=hours - 1)
+        query = StatsRollupService._test_record_filters(select(
+            stat.bucket_hour,
+            func.sum(stat.record_count).label("total"),
+            func.sum(case((stat.test_result == "PASS", stat.record_count), else_=0)).label("passed"),
+            func.sum(case((stat.test_result == "FAIL", stat.record_count), else_=0)).label("failed"),
+        ).where(stat.bucket_hour >= since), device_id, test_station, product_name)
+        query = query.group_by(stat.bucket_hour).order_by(stat.bucket_hour)
+        return [
+            {
+                "bucket_hour": row.bucket_hour,
+                "total": int(row.total or 0),
+                "passed": int(row.passed or 0),
+                "failed": int(row.failed or 0),
+                "pass_rate": _pass_rate(int(row.passed or 0), int(row.passed or 0) + int(row.failed or 0)),
+            }
+            for row in await db.execute(query)
+        ]
+
+    @staticmethod
+    async def get_sensor_run_stats(db: AsyncSession) -> Dict[str, Any]:
+        """Sensor session 總數、良率與今日筆數"""
+        stat = SensorRunHourlyStat
+        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        totals = (await db.execute(select(
+            func.sum(stat.run_count).label("total"),
+            func.sum(case((stat.test_result == "PASS", stat.run_count), else_=0)).label("passed"),
+            func.sum(case((stat.test_result == "FAIL", stat.run_count), else_=0)).label("failed"),
+            func.sum(case((stat.test_result == "PENDING", stat.run_count), else_=0)).label("pending"),
+            func.sum(case((stat.bucket_hour >= today_start, stat.run_count), else_=0)).label("today_total"),
+        ))).one()
+
+        passed = int(totals.passed or 0)
+        failed = int(totals.failed or 0)
+        return {
+            "total": int(totals.total or 0),
+            "passed": passed,
+            "failed": failed,
+            "pending": int(totals.pending or 0),
+            "today_total": int(totals.today_total or 0),
+            "pass_rate": _pass_rate(passed, passed + failed),
+        }
+
+    @staticmethod
+    async def get_sensor_run_trend(db: AsyncSession, hours: int = 24) -> List[Dict[str, Any]]:
+        """最近 N 小時每小時的 Sensor session 數與良率"""
+        stat = SensorRunHourlyStat
+        since = hour_bucket(datetime.now()) - timedelta(hours=hours - 1)
+        query = select(
+            stat.bucket_hour,
+            func.sum(stat.run_count).label("total"),
+            func.sum(case((stat.test_result == "PASS", stat.run_count), else_=0)).label("passed"),
+            func.sum(case((stat.test_result == "FAIL", stat.run_count), else_=0)).label("failed"),
+            func.sum(case((stat.test_result == "PENDING", stat.run_count), else_=0)).label("pending"),
+        ).where(stat.bucket_hour >= since).group_by(stat.bucket_hour).order_by(stat.bucket_hour)
+        return [
+            {
+                "bucket_hour": row.bucket_hour,
+                "total": int(row.total or 0),
+                "passed": int(row.passed or 0),
+                "failed": int(row.failed or 0),
+                "pending": int(row.pending or 0),
+                "pass_rate": _pass_rate(int(row.passed or 0), int(row.passed or 0) + int(row.failed or 0)),
+            }
+            for row in await db.execute(query)
+        ]
+
+
+# 上傳雲端時送出的欄位
+CLOUD_UPLOAD_COLUMNS = [
+    TestRecord.id, TestRecord.device_id, TestRecord.product_name, TestRecord.serial_number,
+    TestRecord.test_station, TestRecord.test_result, TestRecord.test_time, TestRecord.test_data,
+    TestRecord.voltage, TestRecord.current, TestRecord.temperature,
+]
 
 
 class CloudUploadService:
-    """雲端上傳服務"""
+    """雲端上傳服務
+
+    新增 / 更新測試記錄時同一個 transaction 寫入 outbox；上傳端依 outbox id
+    遞增讀取，確認後推進高水位游標並依範圍清除，不需掃描 uploaded_to_cloud。
+    """
+    
+    @staticmethod
+    async def enqueue(db: AsyncSession, record_ids: List[int]):
+        """記錄需上傳的變更（不 commit，由呼叫端一併提交）"""
+        if record_ids:
+            await db.execute(insert(TestRecordOutbox), [{"record_id": record_id} for record_id in record_ids])
+    
+    @staticmethod
+    async def get_cursor(db: AsyncSession) -> int:
+        """目前已確認上傳的最大 outbox id"""
+        last_id = (await db.execute(
+            select(CloudUploadCursor.last_id).where(CloudUploadCursor.name == CLOUD_UPLOAD_CURSOR)
+        )).scalar()
+        return last_id or 0
+    
+    @staticmethod
+    async def get_pending_chunk(
+        db: AsyncSession,
+        after_id: int,
+        limit: int,
+        settle_seconds: float = 0
+    ) -> List[Any]:
+        """依 outbox id 遞增取得下一段待上傳變更
+
+        只取寫入超過 settle_seconds 的 outbox：較小的 AUTO_INCREMENT id 可能比
+        較大的晚 commit，略過尚未穩定的尾端，避免游標越過未讀到的變更。
+        記錄已刪除時記錄欄位為 NULL，仍回傳以便游標涵蓋該 outbox id。
+        """
+        query = (
+            select(TestRecordOutbox.id.label("outbox_id"), *CLOUD_UPLOAD_COLUMNS)
+            .outerjoin(TestRecord, TestRecord.id == TestRecordOutbox.record_id)
+            .where(TestRecordOutbox.id > after_id)
+            .order_by(TestRecordOutbox.id)
+            .limit(limit)
+        )
+        if settle_seconds:
+            query = query.where(TestRecordOutbox.created_at <= seconds_ago(db, settle_seconds))
+        return list((await db.execute(query)).all())
+    
+    @staticmethod
+    async def acknowledge(db: AsyncSession, previous_id: int, last_id: int):
+        """雲端已確認 (previous_id, last_id] 的 outbox：標記記錄、推進游標、清除 outbox"""
+        acknowledged = select(TestRecordOutbox.record_id).where(
+            TestRecordOutbox.id > previous_id, TestRecordOutbox.id <= last_id
+        )
+        # 之後又被更新的記錄仍在 outbox 中等待上傳，保持未上傳狀態
+        still_pending = select(TestRecordOutbox.record_id).where(TestRecordOutbox.id > last_id)
+        await db.execute(
+            update(TestRecord)
+            .where(TestRecord.id.in_(acknowledged), TestRecord.id.not_in(still_pending))
+            .values(uploaded_to_cloud=True)
+            .execution_options(synchronize_session=False)
+        )
+        await db.execute(
+            update(CloudUploadCursor)
+            .where(CloudUploadCursor.name == CLOUD_UPLOAD_CURSOR)
+            .values(last_id=last_id)
+        )
+        await db.execute(delete(TestRecordOutbox).where(TestRecordOutbox.id <= last_id))
+        await db.commit()
     
     @staticmethod
-    def create_upload_log(
-        db: Session,
+    async def create_upload_log(
+        db: AsyncSession,
         records_count: int,
         status: str,
         error_message: Optional[str] = None
@@ -129,11 +695,21 @@ class CloudUploadService:
             error_message=error_message
         )
         db.add(log)
-        db.commit()
-        db.refresh(log)
+        await db.commit()
+        await db.refresh(log)
         return log
     
     @staticmethod
-    def get_upload_logs(db: Session, limit: int = 50) -> List[CloudUploadLog]:
+    async def create_batch_logs(db: AsyncSession, batches: List[Dict[str, Any]]):
+        """一次寫入多段上傳的日誌（batch_id / attempts / latency_ms）"""
+        if batches:
+            await db.execute(insert(CloudUploadLog), batches)
+            await db.commit()
+    
+    @staticmethod
+    async def get_upload_logs(db: AsyncSession, limit: int = 50) -> List[CloudUploadLog]:
         """取得上傳日誌"""
-        return db.query(CloudUploadLog).order_by(desc(CloudUploadLog.upload_time)).limit(limit).all()
+        result = await db.execute(
+            select(CloudUploadLog).order_by(desc(CloudUploadLog.upload_time)).limit(limit)
+        )
+        return list(result.scalars().all())
@@ -0,0 +1,147 @@
+"""
+Dashboard 統計推播
+
+寫入路徑 commit 後會呼叫 ``stats_cache.invalidate``；本模組監聽失效通知，合併
+``STATS_PUSH_DELAY_MS`` 內的連續寫入後重新讀取彙總統計（同時預熱快取），
+只把有變動的欄位以 ``stats_delta`` 廣播給前端，取代各畫面定時輪詢統計端點。
+
+    {"type": "stats_delta",
+     "data": {"scope": "sensor_runs", "changed": {"total": 1203, "pending": 4, "today_total": 88}}}
+
+changed 內為變動後的絕對值，漏接一則也會在該欄位下次變動時更正。
+跨日時 today_total 歸零但沒有寫入觸發失效，因此每天零時另外失效一次統計並推播。
+"""
+
+import asyncio
+import logging
+from datetime import datetime, time, timedelta
+from typing import Any, Dict, Hashable, Optional, Set
+
+from app.cache import SENSOR_RUN_STATS, TEST_RECORD_STATS, stats_cache
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.routers.websocket import manager
+from app.services import StatsRollupService
+
+logger = logging.getLogger(__name__)
+
+# 快取命名空間 → (推播 scope, 與統計端點相同的快取 key, loader)
+STATS_SOURCES = {
+    SENSOR_RUN_STATS: (
+        "sensor_runs",
+        (SENSOR_RUN_STATS, "totals"),
+        StatsRollupService.get_sensor_run_stats,
+    ),
+    TEST_RECORD_STATS: (
+        "test_records",
+        (TEST_RECORD_STATS, "totals", None, None, None),
+        StatsRollupService.get_test_record_stats,
+    ),
+}
+
+
+class StatsPusher:
+    """統計失效後延遲重算，與上次推播的值比較後廣播差異"""
+
+    def __init__(self, delay_ms: int):
+        self.delay = delay_ms / 1000
+        self._dirty: Set[Hashable] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._day_task: Optional[asyncio.Task] = None
+        self._last: Dict[str, Dict[str, Any]] = {}
+        self.pushed = 0
+        self.unchanged = 0
+        self.errors = 0
+
+    async def start(self):
+        """啟動跨日推播"""
+        if self._day_task is None or self._day_task.done():
+            self._day_task = asyncio.create_task(self._watch_day_boundary())
+
+    async def _watch_day_boundary(self):
+        day = datetime.now().date()
+        while True:
+            now = datetime.now()
+            midnight = datetime.combine(now.date() + timedelta(days=1), time())
+            await asyncio.sleep((midnight - now).total_seconds())
+            # sleep 可能比系統時鐘早醒，確認日期真的改變才失效
+            today = datetime.now().date()
+            if today != day:
+                day = today
+                stats_cache.invalidate(*STATS_SOURCES)
+
+    def mark_changed(self, namespace: Hashable):
+        """stats_cache 失效通知（同步呼叫）"""
+        if namespace not in STATS_SOURCES:
+            return
+        self._dirty.add(namespace)
+        if self._task is None or self._task.done():
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return  # 同步程式（例如 init_db）中的失效不推播
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while self._dirty:
+            await asyncio.sleep(self.delay)
+            dirty, self._dirty = self._dirty, set()
+            for namespace in dirty:
+                try:
+                    await self._push(namespace)
+                except Exception as e:
+                    self.errors += 1
+                    logger.warning(f"Failed to push {namespace} stats: {e}")
+
+    async def _push(self, namespace: Hashable):
+        scope, key, loader = STATS_SOURCES[namespace]
+        async with AsyncSessionLocal() as db:
+            stats = await stats_cache.get_or_load(key, lambda: loader(db))
+
+        previous = self._last.get(scope)
+        self._last[scope] = stats
+        changed = {field: value for field, value in stats.items()
+                   if previous is None or previous.get(field) != value}
+        if not changed:
+            self.unchanged += 1
+            return
+        await manager.broadcast({
+            "type": "stats_delta",
+            "data": {"scope": scope, "changed": changed},
+            "timestamp": datetime.now().isoformat(),
+        })
+        self.pushed += 1
+
+    async def stop(self, timeout: float = 5.0):
+        """停止推播；已標記變動的統計先推播完（最多等 timeout 秒）"""
+        if self._day_task is not None:
+            self._day_task.cancel()
+            try:
+                await self._day_task
+            except asyncio.CancelledError:
+                pass
+            self._day_task = None
+        if self._task is not None:
+            if not self._task.done():
+                try:
+                    await asyncio.wait_for(asyncio.shield(self._task), timeout)
+                except asyncio.TimeoutError:
+                    logger.warning("Stats push did not finish before shutdown")
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "delay_ms": int(self.delay * 1000),
+            "pushed": self.pushed,
+            "unchanged": self.unchanged,
+            "errors": self.errors,
+        }
+
+
+stats_push = StatsPusher(settings.STATS_PUSH_DELAY_MS)
+stats_cache.add_listener(stats_push.mark_changed)
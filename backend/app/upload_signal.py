@@ -0,0 +1,71 @@
+"""
+雲端上傳變更通知
+
+services 寫入 outbox 並 commit 後呼叫 ``upload_signal.notify``，streaming 同步模式的
+背景 task 依此決定何時送出下一批。本模組不 import 其他 app 模組，
+讓 services 與 cloud_upload 都能使用而不形成循環 import。
+"""
+
+import asyncio
+import time
+from typing import Optional
+
+
+class UploadSignal:
+    """累積待上傳變更數，達到筆數或時間門檻時喚醒等待者"""
+
+    def __init__(self):
+        self.pending = 0
+        self.first_pending_at: Optional[float] = None
+        self.last_change_at = 0.0
+        self._retry_at: Optional[float] = None
+        self._event = asyncio.Event()
+
+    def notify(self, count: int = 1):
+        """通知有 count 筆記錄進入 outbox（須在 commit 之後呼叫）"""
+        if count <= 0:
+            return
+        now = time.monotonic()
+        if self.first_pending_at is None:
+            self.first_pending_at = now
+        self.pending += count
+        self.last_change_at = now
+        self._event.set()
+
+    def retry_after(self, seconds: float):
+        """seconds 秒後再觸發一次，不論期間是否有新變更"""
+        retry_at = time.monotonic() + seconds
+        if self._retry_at is None or retry_at < self._retry_at:
+            self._retry_at = retry_at
+        self._event.set()
+
+    def _deadline(self, flush_seconds: float) -> Optional[float]:
+        deadlines = [self._retry_at] if self._retry_at is not None else []
+        if self.first_pending_at is not None:
+            deadlines.append(self.first_pending_at + flush_seconds)
+        return min(deadlines) if deadlines else None
+
+    async def wait_for_batch(self, batch_size: int, flush_seconds: float) -> int:
+        """等到累積 batch_size 筆，或距第一筆變更 flush_seconds 秒（先到者為準）
+
+        回傳本批累積的變更數並歸零。
+        """
+        while True:
+            deadline = self._deadline(flush_seconds)
+            if self.pending >= batch_size or (deadline is not None and time.monotonic() >= deadline):
+                break
+            self._event.clear()
+            timeout = None if deadline is None else deadline - time.monotonic()
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        count = self.pending
+        self.pending = 0
+        self.first_pending_at = None
+        self._retry_at = None
+        return count
+
+
+upload_signal = UploadSignal()
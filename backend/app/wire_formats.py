@@ -0,0 +1,101 @@
+"""
+雲端上傳的 payload 格式
+
+由 ``CLOUD_UPLOAD_FORMAT`` 選擇：
+  - json：``{"records": [...]}``，gzip 壓縮（預設，與舊版雲端 API 相容）
+  - ndjson+gzip / ndjson+zstd：每行一筆記錄，壓縮後送出
+  - msgpack / msgpack+zstd：``{"columns": [...], "rows": [[...], ...]}``，
+    欄位名稱只出現一次，test_time 使用 MessagePack timestamp
+
+zstd 需安裝 ``zstandard``，msgpack 需安裝 ``msgpack``（皆為選用套件）。
+"""
+
+import gzip
+import json
+from typing import Any, Callable, Dict, List
+
+UPLOAD_COLUMNS = [
+    "id", "device_id", "product_name", "serial_number", "test_station", "test_result",
+    "test_time", "test_data", "voltage", "current", "temperature",
+]
+
+
+class WireFormat:
+    def __init__(self, name: str, content_type: str, content_encoding: str,
+                 encode: Callable[[List[Any]], bytes]):
+        self.name = name
+        self.content_type = content_type
+        self.content_encoding = content_encoding
+        self.encode = encode
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        headers = {"Content-Type": self.content_type}
+        if self.content_encoding:
+            headers["Content-Encoding"] = self.content_encoding
+        return headers
+
+
+def serialize_record(row: Any) -> dict:
+    record = {column: getattr(row, column) for column in UPLOAD_COLUMNS}
+    record["test_time"] = row.test_time.isoformat()
+    return record
+
+
+def _gzip(data: bytes) -> bytes:
+    return gzip.compress(data, compresslevel=6)
+
+
+def _zstd(data: bytes) -> bytes:
+    import zstandard
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+
+def _json(rows: List[Any]) -> bytes:
+    payload = {"records": [serialize_record(row) for row in rows]}
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+def _ndjson(rows: List[Any]) -> bytes:
+    lines = [json.dumps(serialize_record(row), ensure_ascii=False) for row in rows]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _msgpack(rows: List[Any]) -> bytes:
+    import msgpack
+
+    def values(row):
+        # naive datetime 視為本機時間；MessagePack timestamp 需要時區
+        return [row.test_time.astimezone() if column == "test_time" else getattr(row, column)
+                for column in UPLOAD_COLUMNS]
+
+    payload = {"columns": UPLOAD_COLUMNS, "rows": [values(row) for row in rows]}
+    return msgpack.packb(payload, datetime=True)
+
+
+WIRE_FORMATS = {
+    "json": WireFormat("json", "application/json", "gzip", lambda rows: _gzip(_json(rows))),
+    "ndjson+gzip": WireFormat("ndjson+gzip", "application/x-ndjson", "gzip", lambda rows: _gzip(_ndjson(rows))),
+    "ndjson+zstd": WireFormat("ndjson+zstd", "application/x-ndjson", "zstd", lambda rows: _zstd(_ndjson(rows))),
+    "msgpack": WireFormat("msgpack", "application/msgpack", "", _msgpack),
+    "msgpack+zstd": WireFormat("msgpack+zstd", "application/msgpack", "zstd", lambda rows: _zstd(_msgpack(rows))),
+}
+
+# 各格式需要的選用套件
+_REQUIRED_MODULES = {
+    "ndjson+zstd": ["zstandard"],
+    "msgpack": ["msgpack"],
+    "msgpack+zstd": ["msgpack", "zstandard"],
+}
+
+
+def get_wire_format(name: str) -> WireFormat:
+    """取得上傳格式；名稱錯誤或缺少選用套件時丟出 ValueError"""
+    if name not in WIRE_FORMATS:
+        raise ValueError(f"Unknown CLOUD_UPLOAD_FORMAT '{name}', expected one of {sorted(WIRE_FORMATS)}")
+    for module in _REQUIRED_MODULES.get(name, []):
+        try:
+            __import__(module)
+        except ImportError:
+            raise ValueError(f"CLOUD_UPLOAD_FORMAT '{name}' requires the '{module}' package")
+    return WIRE_FORMATS[name]
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+雲端上傳 HTTP client 基準測試
+
+在本機啟動替身雲端伺服器（預設 HTTPS，自簽憑證），比較：
+  - per-request：每次上傳都新建 httpx.AsyncClient（舊版 upload_to_cloud 的做法）
+  - shared：應用程式共用的 app.cloud_client 連線池
+
+使用方式（在 backend/ 目錄下）:
+  python -m benchmarks.cloud_client_bench --requests 200 --payload-kb 64
+  python -m benchmarks.cloud_client_bench --no-tls
+"""
+
+import argparse
+import asyncio
+import datetime
+import gzip
+import os
+import statistics
+import tempfile
+import threading
+import time
+from typing import List
+
+import httpx
+import uvicorn
+
+from app.config import settings
+
+
+async def stand_in_cloud(scope, receive, send):
+    """替身雲端 API：讀完 body 後回 200"""
+    if scope["type"] != "http":
+        return
+    more_body = True
+    while more_body:
+        message = await receive()
+        more_body = message.get("more_body", False)
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": b'{"ok":true}'})
+
+
+def write_self_signed_cert(directory: str):
+    """產生 localhost 的自簽憑證，回傳 (certfile, keyfile)"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+    import ipaddress
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.utcnow()
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([
+            x509.DNSName("localhost"), x509.IPAddress(ipaddress.ip_address("127.0.0.1")),
+        ]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    with open(certfile, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(keyfile, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return certfile, keyfile
+
+
+def start_server(port: int, certfile: str = None, keyfile: str = None) -> uvicorn.Server:
+    config = uvicorn.Config(stand_in_cloud, host="127.0.0.1", port=port, log_level="warning",
+                            ssl_certfile=certfile, ssl_keyfile=keyfile)
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def summarize(name: str, latencies: List[float], elapsed: float):
+    latencies = sorted(latencies)
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    print(f"{name:<14} mean={statistics.mean(latencies):7.2f} ms  p50={statistics.median(latencies):7.2f} ms  "
+          f"p95={p95:7.2f} ms  total={elapsed:6.2f} s")
+
+
+async def run_requests(post, count: int, concurrency: int) -> List[float]:
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            response = await post()
+            response.raise_for_status()
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(one() for _ in range(count)))
+    return latencies
+
+
+async def benchmark(args: argparse.Namespace):
+    body = gzip.compress(os.urandom(args.payload_kb * 512).hex().encode())
+    headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+
+    async def per_request_post():
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            return await client.post(settings.CLOUD_API_URL, content=body, headers=headers)
+
+    from app.cloud_client import cloud_client
+    await cloud_client.start()
+
+    async def shared_post():
+        return await cloud_client.client.post(settings.CLOUD_API_URL, content=body, headers=headers)
+
+    # 暖機，排除 import 與第一次連線的差異
+    await run_requests(shared_post, 5, 1)
+    await run_requests(per_request_post, 5, 1)
+
+    print(f"{args.requests} requests, gzip body {len(body) / 1024:.1f} KiB, "
+          f"concurrency {args.concurrency}, {'HTTP' if args.no_tls else 'HTTPS'} → {settings.CLOUD_API_URL}")
+    for name, post in (("per-request", per_request_post), ("shared", shared_post)):
+        started = time.perf_counter()
+        latencies = await run_requests(post, args.requests, args.concurrency)
+        summarize(name, latencies, time.perf_counter() - started)
+
+    await cloud_client.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-request vs shared cloud HTTP client")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--payload-kb", type=int, default=64, help="壓縮前 payload 大小")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--no-tls", action="store_true", help="以 HTTP 啟動替身伺服器")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.no_tls:
+            start_server(args.port)
+            settings.CLOUD_API_URL = f"http://127.0.0.1:{args.port}/upload"
+        else:
+            certfile, keyfile = write_self_signed_cert(directory)
+            # httpx 依 SSL_CERT_FILE 信任自簽憑證，兩種模式走相同的驗證流程
+            os.environ["SSL_CERT_FILE"] = certfile
+            start_server(args.port, certfile, keyfile)
+            settings.CLOUD_API_URL = f"https://localhost:{args.port}/upload"
+        asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
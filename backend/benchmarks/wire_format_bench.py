@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+雲端上傳 payload 格式基準測試
+
+以模擬測試記錄比較各 CLOUD_UPLOAD_FORMAT 的 payload 大小、編碼 CPU 時間，
+以及對本機替身雲端伺服器的端到端上傳時間（編碼 + POST）。
+
+使用方式（在 backend/ 目錄下）:
+  python -m benchmarks.wire_format_bench
+  python -m benchmarks.wire_format_bench --sizes 1000 10000 --formats json msgpack+zstd
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import List
+
+import httpx
+
+from app.wire_formats import WIRE_FORMATS, get_wire_format
+from benchmarks.cloud_client_bench import start_server
+
+
+def make_records(count: int) -> List[SimpleNamespace]:
+    """產生與 tester.py 相似的測試記錄"""
+    random.seed(count)
+    started = datetime(2024, 1, 1, 8, 0, 0)
+    records = []
+    for i in range(count):
+        voltage = round(random.uniform(4.8, 5.2), 2)
+        current = round(random.uniform(0.45, 0.55), 2)
+        temperature = round(random.uniform(20, 35), 1)
+        passed = 4.9 <= voltage <= 5.1 and 0.48 <= current <= 0.52 and temperature <= 32
+        records.append(SimpleNamespace(
+            id=i + 1,
+            device_id=f"TESTER_{i % 20:03d}",
+            product_name=random.choice(["產品型號A", "產品型號B", "產品型號C"]),
+            serial_number=f"SN20240101{i:07d}",
+            test_station=f"STATION_{'ABCD'[i % 4]}",
+            test_result="PASS" if passed else "FAIL",
+            test_time=started + timedelta(seconds=i * 3),
+            test_data=json.dumps({
+                "voltage_spec": "5V ±2%", "current_spec": "0.5A ±4%", "temp_spec": "≤32°C",
+                "voltage_ok": 4.9 <= voltage <= 5.1, "current_ok": 0.48 <= current <= 0.52,
+                "temp_ok": temperature <= 32, "test_duration_ms": random.randint(1000, 3000),
+            }, ensure_ascii=False),
+            voltage=voltage,
+            current=current,
+            temperature=temperature,
+        ))
+    return records
+
+
+async def upload(client: httpx.AsyncClient, url: str, name: str, records) -> float:
+    wire_format = WIRE_FORMATS[name]
+    started = time.perf_counter()
+    body = wire_format.encode(records)
+    response = await client.post(url, content=body, headers=wire_format.headers)
+    response.raise_for_status()
+    return time.perf_counter() - started
+
+
+async def benchmark(args: argparse.Namespace, url: str):
+    formats = []
+    for name in args.formats:
+        try:
+            get_wire_format(name)
+            formats.append(name)
+        except ValueError as e:
+            print(f"skip {name}: {e}")
+
+    async with httpx.AsyncClient(timeout=120.0) as client:
+        for size in args.sizes:
+            records = make_records(size)
+            print(f"\n{size:,} records")
+            print(f"{'format':<14}{'bytes':>14}{'vs json':>9}{'encode cpu':>13}{'upload e2e':>13}")
+            baseline = None
+            for name in formats:
+                wire_format = WIRE_FORMATS[name]
+                cpu_started = time.process_time()
+                for _ in range(args.repeat):
+                    body = wire_format.encode(records)
+                encode_ms = (time.process_time() - cpu_started) * 1000 / args.repeat
+                baseline = baseline or len(body)
+
+                await upload(client, url, name, records)  # 暖機
+                e2e_ms = min([await upload(client, url, name, records) for _ in range(args.repeat)]) * 1000
+                print(f"{name:<14}{len(body):>14,}{len(body) / baseline:>8.0%}"
+                      f"{encode_ms:>10.1f} ms{e2e_ms:>10.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cloud upload wire format comparison")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--formats", nargs="+", default=list(WIRE_FORMATS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8789)
+    args = parser.parse_args()
+
+    start_server(args.port)
+    asyncio.run(benchmark(args, f"http://127.0.0.1:{args.port}/upload"))
+
+
+if __name__ == "__main__":
+    main()
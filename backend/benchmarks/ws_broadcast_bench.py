@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+WebSocket 廣播編碼基準測試
+
+以 ConnectionManager 與不做 I/O 的替身連線比較兩種廣播方式的 CPU 時間：
+  - per-client：每個連線各自以標準 json 編碼一次（舊版 send_json 的做法）
+  - encode-once：分派時以 encode_message 編碼一次，所有連線送出同一個 frame
+
+encode 欄位只計編碼本身，dispatch 欄位為廣播到所有 writer 送出完畢的總 CPU 時間。
+
+使用方式（在 backend/ 目錄下）:
+  python -m benchmarks.ws_broadcast_bench
+  python -m benchmarks.ws_broadcast_bench --connections 50 500 --messages 2000
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime
+from typing import List
+
+from app import event_bus
+from app.config import settings
+from app.routers import websocket as ws
+from app.routers.websocket import ConnectionManager, coalesce_key, encode_message
+
+PCBA_STAGES = ["wifi", "firmware", "touch", "bluetooth", "speaker"]
+SENSOR_STAGES = ["getSensorIC", "getHumidity", "getTemperature", "getPressure"]
+
+
+class NullSocket:
+    """只計數、不做 I/O 的 WebSocket 替身"""
+
+    client = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def send_json_encode(message: dict) -> str:
+    """Starlette WebSocket.send_json 的編碼方式"""
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def make_messages(count: int) -> List[dict]:
+    """產生與 C watcher 相似的 pcba_event / sensor_event 訊息"""
+    random.seed(count)
+    messages = []
+    for i in range(count):
+        if i % 2:
+            stage = random.choice(PCBA_STAGES)
+            data = {"serial": f"PCBA{i % 40:06d}", "stage": stage,
+                    "status": random.choice(["testing", "pass", "fail"]),
+                    "progress": random.randint(0, 100),
+                    "detail": {"rssi": -random.randint(30, 80), "fw": "1.4.2"}}
+            message_type = "pcba_event"
+        else:
+            stage = random.choice(SENSOR_STAGES)
+            data = {"serial": f"WLE{i % 40:08d}", "stage": stage,
+                    "status": random.choice(["testing", "pass", "fail"]),
+                    "progress": random.randint(0, 100),
+                    "detail": {"value": round(random.uniform(20, 80), 2), "unit": "%RH", "raw": [1, 2, 3, 4]}}
+            message_type = "sensor_event"
+        messages.append({"type": message_type, "data": data, "timestamp": datetime.now().isoformat()})
+    return messages
+
+
+async def drain(manager: ConnectionManager, expected: int):
+    clients = list(manager.active_connections.values())
+    while sum(client.sent for client in clients) + sum(client.dropped for client in clients) < expected:
+        await asyncio.sleep(0)
+
+
+async def run(mode: str, connections: int, messages: List[dict]) -> dict:
+    manager = ConnectionManager()
+    for _ in range(connections):
+        await manager.connect(NullSocket())
+    clients = list(manager.active_connections.values())
+
+    cpu_started = time.process_time()
+    for message in messages:
+        if mode == "encode-once":
+            await manager.deliver(message)  # 略過 event bus，只量本 process 的分派
+        else:
+            key = coalesce_key(message)
+            for client in clients:
+                client.enqueue(message, key, send_json_encode(message))
+            await asyncio.sleep(0)
+    await drain(manager, connections * len(messages))
+    cpu_ms = (time.process_time() - cpu_started) * 1000
+
+    dropped = sum(client.dropped for client in clients)
+    await manager.shutdown()
+    return {"cpu_ms": cpu_ms, "dropped": dropped}
+
+
+def encode_cpu_ms(mode: str, connections: int, messages: List[dict]) -> float:
+    cpu_started = time.process_time()
+    for message in messages:
+        if mode == "encode-once":
+            encode_message(message)
+        else:
+            for _ in range(connections):
+                send_json_encode(message)
+    return (time.process_time() - cpu_started) * 1000
+
+
+async def benchmark(args: argparse.Namespace):
+    # 替身連線不會慢，佇列放大到不會丟訊息，只量編碼與分派
+    settings.WS_SEND_QUEUE_SIZE = args.messages + 1
+    settings.WS_DISPATCH_QUEUE_SIZE = args.messages + 1
+    messages = make_messages(args.messages)
+    encoder = "orjson" if event_bus.orjson is not None else "json"
+    print(f"{args.messages:,} messages, encoder={encoder}")
+    print(f"{'':>12}{'encode cpu':^34}{'dispatch cpu':^34}")
+    print(f"{'connections':>12}" + f"{'per-client':>12}{'once':>12}{'saved':>10}" * 2)
+
+    for connections in args.connections:
+        results = {}
+        for mode in ("per-client", "encode-once"):
+            await run(mode, connections, messages[:50])  # 暖機
+            results[mode] = min([await run(mode, connections, messages) for _ in range(args.repeat)],
+                                key=lambda r: r["cpu_ms"])
+            assert results[mode]["dropped"] == 0, f"{mode} dropped frames"
+        encode = {mode: min(encode_cpu_ms(mode, connections, messages) for _ in range(args.repeat))
+                  for mode in ("per-client", "encode-once")}
+        line = f"{connections:>12}"
+        for before, after in ((encode["per-client"], encode["encode-once"]),
+                              (results["per-client"]["cpu_ms"], results["encode-once"]["cpu_ms"])):
+            line += f"{before:>9.0f} ms{after:>9.0f} ms{1 - after / before:>10.0%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket broadcast encoding comparison")
+    parser.add_argument("--connections", type=int, nargs="+", default=[50, 500])
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # ConnectionManager 每次連線 / 斷線都會 print，基準測試時關閉
+    ws.print = lambda *a, **k: None
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""測試共用設定：以暫存 SQLite 取代 MySQL，所有 async 測試共用同一個 event loop"""
+import asyncio
+import os
+import tempfile
+
+# 必須在 import app 之前設定，settings 與 engine 於 import 時建立
+_DB_DIR = tempfile.mkdtemp(prefix="production-test-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_DB_DIR}/test.db"
+os.environ["ASYNC_DATABASE_URL"] = ""
+os.environ["WRITE_BEHIND_JOURNAL_PATH"] = os.path.join(_DB_DIR, "ingest_journal.ndjson")
+os.environ["STATS_PUSH_DELAY_MS"] = "10"
+
+import pytest  # noqa: E402
+
+import app.models  # noqa: E402,F401  註冊所有資料表
+from app.cache import SENSOR_RUN_STATS, TEST_RECORD_STATS, stats_cache  # noqa: E402
+from app.database import Base, async_engine, engine, init_db  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def event_loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    # 關閉連線池，否則 aiosqlite 的連線 thread 會讓 process 無法結束
+    loop.run_until_complete(async_engine.dispose())
+    loop.close()
+
+
+@pytest.fixture
+def run(event_loop):
+    """在共用 event loop 上執行 coroutine；async engine 的連線與 loop 綁定
+
+    回傳前先等寫入觸發的統計推播結束：event loop 停止時推播若正在讀取資料庫，
+    其 SQLite 讀鎖不會釋放，之後以同步 engine 執行的 DDL / init_db 會 database is locked。
+    """
+    from app.stats_push import stats_push
+
+    def run_until_complete(coroutine):
+        try:
+            return event_loop.run_until_complete(coroutine)
+        finally:
+            event_loop.run_until_complete(stats_push.stop())
+
+    return run_until_complete
+
+
+@pytest.fixture
+def database(run):
+    """每個測試使用空的資料庫"""
+    Base.metadata.drop_all(bind=engine)
+    init_db()
+    stats_cache.invalidate(TEST_RECORD_STATS, SENSOR_RUN_STATS)
+    yield engine
@@ -0,0 +1,161 @@
+from collections import Counter
+
+import httpx
+import pytest
+from sqlalchemy import insert, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from app import services
+from app.database import AsyncSessionLocal, engine
+from app.main import app
+from app.models import TestRecord, TestRecordHourlyStat, TestRecordOutbox
+from app.schemas import TestRecordCreate
+from app.services import StatsRollupService, TestRecordService
+
+
+def _row(serial, result="PASS", station="ST1", **extra):
+    return {"device_id": "DEV1", "product_name": "P", "serial_number": serial,
+            "test_station": station, "test_result": result,
+            "test_time": "2025-01-01T08:30:00", **extra}
+
+
+async def _bulk(rows):
+    async with AsyncSessionLocal() as db:
+        return await TestRecordService.bulk_upsert(db, rows)
+
+
+async def _rollup():
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(select(TestRecordHourlyStat))).scalars().all()
+    return {(row.test_station, row.test_result): row.record_count for row in rows if row.record_count}
+
+
+async def _records():
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(select(TestRecord).order_by(TestRecord.serial_number))).scalars().all()
+    return [(row.serial_number, row.test_station, row.test_result, row.uploaded_to_cloud) for row in rows]
+
+
+def test_outcomes_for_insert_update_superseded_and_rejected(run, database):
+    run(_bulk([_row("SN1")]))
+    result = run(_bulk([
+        _row("SN1", "FAIL"),
+        _row("SN2"),
+        _row("SN3", "FAIL"),
+        _row("SN3", "PASS"),
+        {"device_id": "DEV1"},
+    ]))
+    assert (result["inserted"], result["updated"], result["rejected"]) == (2, 1, 2)
+    assert [r["status"] for r in result["results"]] == ["updated", "inserted", "rejected", "inserted", "rejected"]
+    assert "superseded by row 3" in result["results"][2]["error"]
+    assert all(r["id"] for r in result["results"] if r["status"] != "rejected")
+    assert run(_records()) == [
+        ("SN1", "ST1", "FAIL", False), ("SN2", "ST1", "PASS", False), ("SN3", "ST1", "PASS", False),
+    ]
+
+
+def test_rollup_moves_updated_records_between_keys(run, database):
+    run(_bulk([_row("SN1"), _row("SN2"), _row("SN3", "FAIL")]))
+    assert run(_rollup()) == {("ST1", "PASS"): 2, ("ST1", "FAIL"): 1}
+    run(_bulk([_row("SN1", "FAIL"), _row("SN3", "FAIL", station="ST2"), _row("SN4")]))
+    assert run(_rollup()) == {("ST1", "PASS"): 2, ("ST1", "FAIL"): 1, ("ST2", "FAIL"): 1}
+    # 相同內容重送不改變彙總
+    run(_bulk([_row("SN1", "FAIL")]))
+    assert run(_rollup()) == {("ST1", "PASS"): 2, ("ST1", "FAIL"): 1, ("ST2", "FAIL"): 1}
+
+
+def test_record_inserted_concurrently_is_counted_once(run, database, monkeypatch):
+    """鎖定讀取之後、INSERT 之前另一個 flush 新增了相同序號：改以更新計算，不重複 +1"""
+    real_insert_missing = TestRecordService._insert_missing
+    racer = _row("SN1", "FAIL", station="ST9")
+
+    async def racing_insert_missing(db, accepted):
+        original_execute = db.execute
+        raced = []
+
+        async def execute(statement, *args, **kwargs):
+            result = await original_execute(statement, *args, **kwargs)
+            if not raced and getattr(statement, "is_select", False):
+                raced.append(True)
+                # 模擬另一個 transaction 已 commit 的新增
+                data = TestRecordCreate.model_validate(racer).model_dump()
+                await original_execute(insert(TestRecord.__table__), [data])
+                await StatsRollupService.apply_test_record_deltas(
+                    db, Counter({StatsRollupService.test_record_key(data): 1}))
+            return result
+
+        monkeypatch.setattr(db, "execute", execute)
+        try:
+            return await real_insert_missing(db, accepted)
+        finally:
+            monkeypatch.setattr(db, "execute", original_execute)
+
+    monkeypatch.setattr(TestRecordService, "_insert_missing", staticmethod(racing_insert_missing))
+    result = run(_bulk([_row("SN1"), _row("SN2")]))
+    assert [r["status"] for r in result["results"]] == ["updated", "inserted"]
+    assert run(_records()) == [("SN1", "ST1", "PASS", False), ("SN2", "ST1", "PASS", False)]
+    assert run(_rollup()) == {("ST1", "PASS"): 2}
+
+
+
+async def _post_bulk(records):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.post("/api/test-records/bulk", json={"records": records})
+
+
+async def _outbox_record_ids():
+    async with AsyncSessionLocal() as db:
+        return sorted((await db.execute(select(TestRecordOutbox.record_id))).scalars().all())
+
+
+def test_bulk_endpoint_reports_per_row_results_and_enqueues_uploads(run, database):
+    response = run(_post_bulk([_row("SN1"), _row("SN2"), {"serial_number": "SN3"}]))
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["inserted"], body["updated"], body["rejected"]) == (2, 0, 1)
+    assert "device_id" in body["results"][2]["error"]
+    ids = [result["id"] for result in body["results"][:2]]
+    assert run(_outbox_record_ids()) == sorted(ids)
+
+    body = run(_post_bulk([_row("SN2", "FAIL")])).json()
+    assert body["results"][0] == {"index": 0, "status": "updated", "id": ids[1], "device_id": "DEV1",
+                                  "serial_number": "SN2", "error": None}
+
+
+def test_bulk_endpoint_validates_batch_size(run, database):
+    assert run(_post_bulk([])).status_code == 422
+    assert run(_post_bulk([_row(f"SN{i}") for i in range(1001)])).status_code == 422
+
+
+@pytest.fixture
+def case_insensitive_serials(database):
+    """模擬 MySQL 預設 collation：序號比對（含唯一索引）不分大小寫"""
+    ddl = str(CreateTable(TestRecord.__table__).compile(engine))
+    assert "serial_number VARCHAR(100) NOT NULL" in ddl
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE test_records"))
+        conn.execute(text(ddl.replace("serial_number VARCHAR(100) NOT NULL",
+                                      "serial_number VARCHAR(100) COLLATE NOCASE NOT NULL")))
+        for index in TestRecord.__table__.indexes:
+            conn.execute(CreateIndex(index))
+    yield
+
+
+def test_serials_differing_only_in_case_follow_the_database_collation(run, case_insensitive_serials,
+                                                                      monkeypatch):
+    monkeypatch.setattr(services, "collation_key", lambda db, *values: tuple(v.casefold() for v in values))
+    run(_bulk([_row("SN1")]))
+    result = run(_bulk([_row("sn1", "FAIL"), _row("SN2"), _row("sn2", "FAIL")]))
+    assert [r["status"] for r in result["results"]] == ["updated", "rejected", "inserted"]
+    assert result["results"][1]["serial_number"] == "SN2"
+    assert run(_records()) == [("sn1", "ST1", "FAIL", False), ("sn2", "ST1", "FAIL", False)]
+    assert run(_rollup()) == {("ST1", "FAIL"): 2}
+
+
+def test_unresolvable_insert_conflict_fails_the_batch(run, case_insensitive_serials):
+    """比對規則與資料庫 collation 不一致時，有限次重試後整批失敗而不是無限重試"""
+    run(_bulk([_row("SN1")]))
+    with pytest.raises(IntegrityError):
+        run(_bulk([_row("sn1", "FAIL")]))
+    assert run(_records()) == [("SN1", "ST1", "PASS", False)]
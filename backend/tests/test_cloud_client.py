@@ -0,0 +1,25 @@
+from app.cloud_client import CloudClient
+from app.config import settings
+
+
+def test_client_is_shared_until_stopped(run, monkeypatch):
+    monkeypatch.setattr(settings, "CLOUD_API_KEY", "secret")
+    cloud = CloudClient()
+    client = cloud.client
+    assert cloud.client is client
+    assert client.headers["Authorization"] == "Bearer secret"
+    assert "gzip" in client.headers["Accept-Encoding"]
+
+    run(cloud.stop())
+    assert client.is_closed
+    # 停止後（例如命令列工具再次使用）重新建立
+    assert cloud.client is not client
+    run(cloud.stop())
+
+
+def test_closed_client_is_recreated(run):
+    cloud = CloudClient()
+    client = cloud.client
+    run(client.aclose())
+    assert cloud.client is not client
+    run(cloud.stop())
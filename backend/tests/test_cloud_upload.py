@@ -0,0 +1,168 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, select
+
+from app import cloud_upload
+from app.cloud_upload import (
+    ChunkUploadError, CircuitBreaker, CircuitOpenError, _Chunk, _is_acknowledged_ahead, _merge_ranges,
+)
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import TestRecord, TestRecordOutbox
+from app.schemas import TestRecordCreate
+from app.services import CloudUploadService, TestRecordService
+
+
+def test_merge_ranges_sorts_and_merges_overlaps():
+    assert _merge_ranges([(6, 9), (9, 10), (6, 9), (1, 3), (12, 15), (13, 14)]) == [(1, 3), (6, 10), (12, 15)]
+    assert _merge_ranges([]) == []
+
+
+def test_is_acknowledged_ahead_uses_half_open_ranges(monkeypatch):
+    monkeypatch.setattr(cloud_upload, "_acknowledged_ahead", [(1, 3), (6, 10)])
+    assert [i for i in range(12) if _is_acknowledged_ahead(i)] == [2, 3, 7, 8, 9, 10]
+
+
+@pytest.fixture
+def uploader(database, monkeypatch):
+    """以替身取代實際的 HTTP 上傳；failing 內的 batch_id 回傳 503"""
+    sent, failing = [], set()
+
+    async def fake_post_chunk(client, body, batch_id, wire_format):
+        if batch_id in failing:
+            await asyncio.sleep(0.05)  # 讓後面的段先送出，模擬失敗段擋住游標
+            raise ChunkUploadError("HTTP 503", retryable=True)
+        sent.append(batch_id)
+
+    monkeypatch.setattr(cloud_upload, "post_chunk", fake_post_chunk)
+    monkeypatch.setattr(cloud_upload, "_acknowledged_ahead", [])
+    monkeypatch.setattr(cloud_upload.breaker, "opened_at", None)
+    monkeypatch.setattr(cloud_upload.breaker, "consecutive_failures", 0)
+    monkeypatch.setattr(cloud_upload.breaker, "_probing", False)
+    monkeypatch.setattr(settings, "CLOUD_OUTBOX_SETTLE_SECONDS", 0)
+    monkeypatch.setattr(settings, "CLOUD_RETRY_MAX_ATTEMPTS", 1)
+    monkeypatch.setattr(settings, "CLOUD_BREAKER_FAILURE_THRESHOLD", 100)
+    return sent, failing
+
+
+async def _create_records(count):
+    async with AsyncSessionLocal() as db:
+        for i in range(count):
+            await TestRecordService.create_test_record(db, TestRecordCreate(
+                device_id="DEV1", product_name="P", serial_number=f"SN{i:04d}",
+                test_station="ST1", test_result="PASS", test_time=datetime(2025, 1, 1, 8, i),
+            ))
+
+
+async def _state():
+    async with AsyncSessionLocal() as db:
+        cursor = await CloudUploadService.get_cursor(db)
+        uploaded = (await db.execute(
+            select(func.count()).select_from(TestRecord).where(TestRecord.uploaded_to_cloud.is_(True))
+        )).scalar()
+        outbox = (await db.execute(select(func.count()).select_from(TestRecordOutbox))).scalar()
+    return cursor, uploaded, outbox
+
+
+def test_upload_acknowledges_all_chunks_and_advances_cursor(run, uploader):
+    sent, _ = uploader
+    run(_create_records(7))
+    summary = run(cloud_upload.upload_pending_records(chunk_size=3, concurrency=2))
+    assert summary.chunks == 3 and summary.uploaded == 7 and not summary.errors
+    assert sorted(sent) == ["1-3", "4-6", "7-7"]
+    assert run(_state()) == (7, 7, 0)
+
+
+def test_failed_chunk_holds_cursor_and_is_the_only_chunk_resent(run, uploader):
+    sent, failing = uploader
+    run(_create_records(9))
+    failing.add("4-6")
+    summary = run(cloud_upload.upload_pending_records(chunk_size=3, concurrency=1))
+    # 失敗後不再送出新段；游標停在失敗段之前
+    assert summary.failed_chunks == 1
+    assert run(_state())[0] == 3
+
+    failing.clear()
+    sent.clear()
+    run(cloud_upload.upload_pending_records(chunk_size=3, concurrency=1))
+    assert sent == ["4-6", "7-9"]
+    assert run(_state()) == (9, 9, 0)
+    assert cloud_upload._acknowledged_ahead == []
+
+
+def test_acknowledged_ranges_do_not_grow_while_cursor_is_held(run, uploader):
+    sent, failing = uploader
+    run(_create_records(12))
+    failing.add("1-3")
+    for _ in range(3):
+        run(cloud_upload.upload_pending_records(chunk_size=3, concurrency=4))
+    # 後面三段只送一次，重複執行不會累積重複的範圍
+    assert sorted(sent) == ["10-12", "4-6", "7-9"]
+    assert cloud_upload._acknowledged_ahead == [(3, 12)]
+    assert run(_state())[0] == 0
+
+    failing.clear()
+    sent.clear()
+    run(cloud_upload.upload_pending_records(chunk_size=3, concurrency=4))
+    assert sent == ["1-3"]
+    assert run(_state()) == (12, 12, 0)
+    assert cloud_upload._acknowledged_ahead == []
+
+
+def test_acknowledge_failure_keeps_the_acknowledged_range(run, uploader, monkeypatch):
+    sent, _ = uploader
+    run(_create_records(6))
+    real_acknowledge = CloudUploadService.acknowledge
+
+    async def failing_acknowledge(db, previous_id, last_id):
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(CloudUploadService, "acknowledge", staticmethod(failing_acknowledge))
+    summary = run(cloud_upload.upload_pending_records(chunk_size=3, concurrency=1))
+    assert summary.failed_chunks == 1 and sent == ["1-3"]
+    # 雲端已確認但游標未寫入：範圍仍記在記憶體，下次不重送
+    assert cloud_upload._acknowledged_ahead == [(0, 3)]
+    assert run(_state())[0] == 0
+
+    monkeypatch.setattr(CloudUploadService, "acknowledge", staticmethod(real_acknowledge))
+    sent.clear()
+    run(cloud_upload.upload_pending_records(chunk_size=3, concurrency=1))
+    assert sent == ["4-6"]
+    assert run(_state())[0] == 6
+
+
+@pytest.fixture
+def half_open_breaker(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=60)
+    breaker.record_failure()
+    breaker.opened_at -= 61
+    assert breaker.state == "half_open"
+    monkeypatch.setattr(cloud_upload, "breaker", breaker)
+    monkeypatch.setattr(settings, "CLOUD_RETRY_MAX_ATTEMPTS", 1)
+    return breaker
+
+
+@pytest.mark.parametrize("failure", [ChunkUploadError("HTTP 400", retryable=False), asyncio.CancelledError()])
+def test_probe_ending_without_a_verdict_releases_the_breaker(run, half_open_breaker, monkeypatch, failure):
+    async def fake_post_chunk(client, body, batch_id, wire_format):
+        raise failure
+
+    monkeypatch.setattr(cloud_upload, "post_chunk", fake_post_chunk)
+    with pytest.raises(type(failure)):
+        run(cloud_upload.send_with_retry(None, _Chunk(0, 1, [])))
+    assert half_open_breaker.state == "half_open"
+    # 下一個請求仍可試探，而不是永遠 circuit breaker open
+    assert half_open_breaker.allow()
+    assert not half_open_breaker.allow()
+
+
+def test_concurrent_request_is_rejected_while_probing(run, half_open_breaker, monkeypatch):
+    async def fake_post_chunk(client, body, batch_id, wire_format):
+        with pytest.raises(CircuitOpenError):
+            await cloud_upload.send_with_retry(None, _Chunk(1, 2, []))
+
+    monkeypatch.setattr(cloud_upload, "post_chunk", fake_post_chunk)
+    run(cloud_upload.send_with_retry(None, _Chunk(0, 1, [])))
+    assert half_open_breaker.state == "closed"
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from app.routers import websocket as ws
+from app.routers.websocket import BroadcastCoalescer
+
+
+class RecordingBus:
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, message):
+        self.published.append(message)
+
+
+@pytest.fixture
+def bus(monkeypatch):
+    bus = RecordingBus()
+    monkeypatch.setattr(ws, "event_bus", bus)
+    return bus
+
+
+def _progress(status, stage="testButton", serial="WLE1", step=0):
+    return {"type": "sensor_event", "data": {"serial": serial, "stage": stage, "status": status, "step": step}}
+
+
+def _summary(bus):
+    return [(m["data"].get("serial"), m["data"].get("stage"), m["data"].get("status"), m["data"].get("step"))
+            for m in bus.published]
+
+
+def _run_coalescer(run, window_ms, script):
+    async def scenario():
+        coalescer = BroadcastCoalescer(window_ms, max_queue=100)
+        try:
+            await script(coalescer)
+            await asyncio.sleep(0.01)
+        finally:
+            await coalescer.stop()
+        return coalescer
+    return run(scenario())
+
+
+def test_intermediate_updates_are_limited_to_one_per_window(run, bus):
+    async def script(coalescer):
+        for step in range(5):
+            coalescer.submit(_progress("testing", step=step))
+        # 視窗結束時送出的那則也開始新的視窗，之後的第一則要再隔一個視窗才立即送出
+        await asyncio.sleep(0.12)
+        coalescer.submit(_progress("testing", step=5))
+
+    coalescer = _run_coalescer(run, 50, script)
+    # 第一則立即送出，視窗內其餘只保留最新一則於視窗結束時送出
+    assert _summary(bus) == [("WLE1", "testButton", "testing", 0), ("WLE1", "testButton", "testing", 4),
+                             ("WLE1", "testButton", "testing", 5)]
+    assert coalescer.coalesced == 3
+
+
+def test_terminal_status_is_immediate_and_drops_pending_intermediate(run, bus):
+    async def script(coalescer):
+        coalescer.submit(_progress("testing", step=0))
+        coalescer.submit(_progress("testing", step=1))
+        coalescer.submit(_progress("pass", step=2))
+        await asyncio.sleep(0.08)
+
+    coalescer = _run_coalescer(run, 50, script)
+    assert _summary(bus) == [("WLE1", "testButton", "testing", 0), ("WLE1", "testButton", "pass", 2)]
+    assert coalescer.superseded == 1
+
+
+def test_keys_are_independent_and_other_messages_pass_through_in_order(run, bus):
+    async def script(coalescer):
+        coalescer.submit(_progress("testing", stage="testSPI"))
+        coalescer.submit({"type": "test_result", "data": {"serial_number": "SN1"}})
+        coalescer.submit(_progress("testing", stage="testBuzzer"))
+        coalescer.submit(_progress("testing", serial="WLE2", stage="testSPI"))
+
+    _run_coalescer(run, 50, script)
+    assert [m["type"] for m in bus.published] == ["sensor_event", "test_result", "sensor_event", "sensor_event"]
+    assert len(bus.published) == 4
+
+
+def test_zero_window_disables_coalescing(run, bus):
+    async def script(coalescer):
+        for step in range(3):
+            coalescer.submit(_progress("testing", step=step))
+
+    coalescer = _run_coalescer(run, 0, script)
+    assert [step for *_, step in _summary(bus)] == [0, 1, 2]
+    assert coalescer.coalesced == 0
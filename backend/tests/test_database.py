@@ -0,0 +1,20 @@
+from sqlalchemy import text
+
+from app.database import AsyncSessionLocal, async_database_url
+
+
+def test_async_database_url_swaps_sync_drivers():
+    assert async_database_url("mysql+pymysql://u:p@db:3306/app") == "mysql+aiomysql://u:p@db:3306/app"
+    assert async_database_url("mysql://u:p@db/app") == "mysql+aiomysql://u:p@db/app"
+    assert async_database_url("sqlite:///./test.db") == "sqlite+aiosqlite:///./test.db"
+    # 已是 async driver 或未知 driver 時保持原樣
+    assert async_database_url("mysql+aiomysql://db/app") == "mysql+aiomysql://db/app"
+    assert async_database_url("postgresql+asyncpg://db/app") == "postgresql+asyncpg://db/app"
+
+
+def test_async_session_runs_queries(run, database):
+    async def query():
+        async with AsyncSessionLocal() as db:
+            return (await db.execute(text("SELECT 1"))).scalar()
+
+    assert run(query()) == 1
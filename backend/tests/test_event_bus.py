@@ -0,0 +1,77 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from app.event_bus import LocalEventBus, RedisEventBus, create_event_bus, encode_message
+
+
+def test_encode_message_outputs_iso_datetimes():
+    frame = encode_message({"type": "x", "data": {"at": datetime(2025, 1, 1, 8, 0, 1), "名稱": "產品"}})
+    assert json.loads(frame) == {"type": "x", "data": {"at": "2025-01-01T08:00:01", "名稱": "產品"}}
+
+
+def test_create_event_bus_selects_backend_from_url():
+    assert type(create_event_bus("", "ch")) is LocalEventBus
+    assert isinstance(create_event_bus("redis://localhost:6379/0", "ch"), RedisEventBus)
+    with pytest.raises(ValueError):
+        create_event_bus("amqp://localhost", "ch")
+
+
+def _recording_bus(bus):
+    received = []
+
+    async def failing(message):
+        raise RuntimeError("handler bug")
+
+    async def recording(message):
+        received.append(message)
+
+    bus.subscribe(failing)
+    bus.subscribe(recording)
+    return received
+
+
+def test_local_bus_isolates_failing_handlers(run):
+    bus = LocalEventBus()
+    received = _recording_bus(bus)
+    run(bus.publish({"type": "a"}))
+    assert received == [{"type": "a"}]
+    assert (bus.published, bus.delivered, bus.handler_errors) == (1, 1, 1)
+
+
+class FakeRedis:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.published = []
+
+    async def publish(self, channel, data):
+        if self.fail:
+            raise ConnectionError("redis down")
+        self.published.append((channel, json.loads(data)))
+
+
+def test_redis_publish_tags_origin_and_leaves_delivery_to_the_subscription(run):
+    bus = RedisEventBus("redis://localhost", "events")
+    received = _recording_bus(bus)
+    bus._redis = FakeRedis()
+    run(bus.publish({"type": "a"}))
+    assert bus._redis.published == [("events", {"type": "a", "origin": bus.origin})]
+    # 本 process 的客戶端經由自己的訂閱收到，不在發佈時重複傳遞
+    assert received == []
+
+
+def test_redis_publish_failure_falls_back_to_local_delivery(run):
+    bus = RedisEventBus("redis://localhost", "events")
+    received = _recording_bus(bus)
+    bus._redis = FakeRedis(fail=True)
+    run(bus.publish({"type": "a"}))
+    assert received == [{"type": "a"}]
+    assert bus.publish_errors == 1
+
+
+def test_redis_bus_before_start_delivers_locally(run):
+    bus = RedisEventBus("redis://localhost", "events")
+    received = _recording_bus(bus)
+    run(bus.publish({"type": "a"}))
+    assert received == [{"type": "a"}]
@@ -0,0 +1,75 @@
+import csv
+import io
+import json
+
+import httpx
+import pytest
+
+from app import exporting
+from app.main import app
+from app.routers import sensor_events
+from app.sensor_sessions import sensor_sessions
+
+
+@pytest.fixture
+def small_batches(database, monkeypatch):
+    # 每批 2 列，讓同一個 run 的測項跨越批次邊界
+    monkeypatch.setattr(exporting, "EXPORT_BATCH_SIZE", 2)
+    sensor_sessions._sessions.clear()
+    sensor_events.active_sensor_run_ids.clear()
+    yield
+    sensor_sessions._sessions.clear()
+    sensor_events.active_sensor_run_ids.clear()
+
+
+async def _request(method, path, payload=None, params=None):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.request(method, path, json=payload, params=params)
+    assert response.status_code < 300, response.text
+    return response
+
+
+async def _seed_records():
+    records = [{"device_id": device, "product_name": "產品", "serial_number": f"SN{i}", "test_station": "ST1",
+                "test_result": "PASS", "test_time": f"2025-01-01T08:0{i}:00", "test_data": '{"v": 1}'}
+               for i, device in enumerate(["DEV1", "DEV2", "DEV1", "DEV1", "DEV1"])]
+    await _request("POST", "/api/test-records/bulk", {"records": records})
+
+
+def test_record_export_csv_and_ndjson(run, small_batches):
+    run(_seed_records())
+    response = run(_request("GET", "/api/test-records/export", params={"format": "csv", "device_id": "DEV1"}))
+    assert response.headers["content-type"].startswith("text/csv")
+    assert "attachment" in response.headers["content-disposition"]
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["serial_number"] for row in rows] == ["SN0", "SN2", "SN3", "SN4"]
+    assert rows[0]["product_name"] == "產品" and rows[0]["test_time"] == "2025-01-01T08:00:00"
+
+    response = run(_request("GET", "/api/test-records/export", params={"format": "ndjson"}))
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["serial_number"] for line in lines] == ["SN0", "SN1", "SN2", "SN3", "SN4"]
+    assert lines[0]["test_data"] == '{"v": 1}'
+
+
+async def _seed_sensor_runs():
+    await _request("POST", "/api/sensor/serial-found", {"serial_wle": "WLE1"})
+    for stage in ("getSensorIC", "testButton", "testSPI"):
+        await _request("POST", "/api/sensor/events", {"serial": "WLE1", "stage": stage, "status": "pass",
+                                                      "detail": {}})
+    await _request("POST", "/api/sensor/serial-found", {"serial_wle": "WLE2"})
+
+
+def test_sensor_run_ndjson_groups_items_across_batches(run, small_batches):
+    run(_seed_sensor_runs())
+    response = run(_request("GET", "/api/sensor/test-runs/export", params={"format": "ndjson"}))
+    runs = [json.loads(line) for line in response.text.splitlines()]
+    assert [(r["serial_wle"], [item["stage"] for item in r["items"]]) for r in runs] == [
+        ("WLE1", ["getSensorIC", "testButton", "testSPI"]), ("WLE2", [])]
+
+
+def test_sensor_run_csv_has_one_row_per_item(run, small_batches):
+    run(_seed_sensor_runs())
+    response = run(_request("GET", "/api/sensor/test-runs/export", params={"format": "csv", "serial_wle": "WLE1"}))
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["item_stage"] for row in rows] == ["getSensorIC", "testButton", "testSPI"]
+    assert {row["serial_wle"] for row in rows} == {"WLE1"}
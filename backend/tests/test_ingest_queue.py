@@ -0,0 +1,203 @@
+import asyncio
+import json
+import os
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import DataError, OperationalError
+
+from app import ingest_queue as ingest
+from app.database import AsyncSessionLocal
+from app.ingest_queue import WriteBehindQueue, journal_path_for
+from app.models import TestRecord
+
+
+def _record(i):
+    return {"device_id": "DEV1", "product_name": "P", "serial_number": f"SN{i:04d}",
+            "test_station": "ST1", "test_result": "PASS", "test_time": "2025-01-01T08:00:00"}
+
+
+@pytest.fixture
+def journal_dir(database, tmp_path):
+    return str(tmp_path / "ingest_journal.ndjson")
+
+
+def _queue(base_path):
+    return WriteBehindQueue(base_path, max_size=100, batch_size=50, flush_interval_ms=10)
+
+
+async def _count_records():
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(select(func.count()).select_from(TestRecord))).scalar()
+
+
+async def _crash(queue):
+    """模擬 process 異常結束：停止 flusher 但不寫完佇列，釋放 journal 的鎖"""
+    queue._task.cancel()
+    try:
+        await queue._task
+    except BaseException:
+        pass
+    queue._journal.close()
+
+
+def test_journal_path_is_per_process():
+    assert journal_path_for("./data/ingest_journal.ndjson", 42) == "./data/ingest_journal.42.ndjson"
+
+
+def test_clean_stop_drains_queue_and_removes_journal(run, journal_dir):
+    queue = _queue(journal_dir)
+    run(queue.start())
+    for i in range(5):
+        queue.submit(_record(i))
+    run(queue.stop())
+    assert run(_count_records()) == 5
+    assert not os.path.exists(queue.path)
+
+
+def test_journal_of_dead_worker_is_replayed_once(run, journal_dir, monkeypatch):
+    monkeypatch.setattr(ingest.os, "getpid", lambda: 1001)
+    crashed = _queue(journal_dir)
+    run(crashed.start())
+    crashed._task.cancel()  # flusher 尚未寫入前就當機
+    for i in range(3):
+        crashed.submit(_record(i))
+    run(_crash(crashed))
+    assert os.path.exists(journal_path_for(journal_dir, 1001))
+
+    monkeypatch.setattr(ingest.os, "getpid", lambda: 1002)
+    survivor = _queue(journal_dir)
+    run(survivor.start())
+    assert not os.path.exists(journal_path_for(journal_dir, 1001))
+    with open(survivor.path, encoding="utf-8") as f:
+        assert [json.loads(line)["serial_number"] for line in f] == ["SN0000", "SN0001", "SN0002"]
+    run(survivor.stop())
+    assert run(_count_records()) == 3
+
+
+def test_journal_locked_by_live_worker_is_left_alone(run, journal_dir, monkeypatch):
+    live_path = journal_path_for(journal_dir, 2001)
+    os.makedirs(os.path.dirname(live_path), exist_ok=True)
+    live = open(live_path, "a+", encoding="utf-8")
+    assert ingest._try_lock(live)
+    live.write(json.dumps(_record(7)) + "\n")
+    live.flush()
+
+    monkeypatch.setattr(ingest.os, "getpid", lambda: 2002)
+    queue = _queue(journal_dir)
+    run(queue.start())
+    run(queue.stop())
+    live.close()
+    assert os.path.exists(live_path)
+    assert run(_count_records()) == 0
+
+
+def test_legacy_shared_journal_and_truncated_line_are_handled(run, journal_dir, monkeypatch):
+    with open(journal_dir, "w", encoding="utf-8") as f:
+        f.write(json.dumps(_record(1)) + "\n" + json.dumps(_record(2)) + "\n" + '{"device_id": "DE')
+
+    monkeypatch.setattr(ingest.os, "getpid", lambda: 3001)
+    queue = _queue(journal_dir)
+    run(queue.start())
+    assert not os.path.exists(journal_dir)
+    run(queue.stop())
+    assert run(_count_records()) == 2
+
+
+async def _wait_until_written(queue, timeout=5):
+    """等 flusher 寫完 journal 中所有記錄（journal 截斷）"""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while queue._journal_records:
+        assert asyncio.get_running_loop().time() < deadline, "flusher did not catch up"
+        await asyncio.sleep(0.01)
+
+
+@pytest.fixture
+def failing_upsert(monkeypatch):
+    """serial_number 為 BAD 的記錄讓 bulk_upsert 拋出 DataError；transient 內的錯誤各拋一次"""
+    real_bulk_upsert = ingest.TestRecordService.bulk_upsert
+    transient = []
+
+    async def bulk_upsert(db, rows):
+        if transient:
+            raise transient.pop()
+        if any(row["serial_number"] == "BAD" for row in rows):
+            raise DataError("INSERT", {}, Exception("Data too long for column 'serial_number'"))
+        return await real_bulk_upsert(db, rows)
+
+    monkeypatch.setattr(ingest.TestRecordService, "bulk_upsert", staticmethod(bulk_upsert))
+    return transient
+
+
+def test_bad_record_is_dead_lettered_without_blocking_the_queue(run, journal_dir, failing_upsert):
+    queue = _queue(journal_dir)
+    run(queue.start())
+    queue.submit(_record(1))
+    queue.submit(dict(_record(2), serial_number="BAD"))
+    queue.submit(_record(3))
+    run(_wait_until_written(queue))
+    assert queue.running and queue.dead_lettered == 1
+    assert run(_count_records()) == 2
+    with open(queue.dead_letter_path, encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f]
+    assert [entry["record"]["serial_number"] for entry in entries] == ["BAD"]
+    assert "Data too long" in entries[0]["error"]
+    run(queue.stop())
+
+
+def test_transient_errors_are_retried(run, journal_dir, failing_upsert):
+    failing_upsert.append(OperationalError("INSERT", {}, Exception("Lost connection to MySQL server")))
+    queue = _queue(journal_dir)
+    run(queue.start())
+    queue.submit(_record(1))
+    run(_wait_until_written(queue))
+    assert queue.failed_flushes == 1 and queue.dead_lettered == 0
+    assert run(_count_records()) == 1
+    run(queue.stop())
+
+
+def _journal_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_checkpoint_skips_committed_records_on_replay(run, journal_dir, monkeypatch):
+    monkeypatch.setattr(ingest.os, "getpid", lambda: 4001)
+    crashed = _queue(journal_dir)
+    run(crashed.start())
+    crashed._task.cancel()
+    records = [_record(i) for i in range(5)]
+    for record in records:
+        crashed.submit(record)
+    run(crashed._write_batch(records[:2]))
+    assert _journal_lines(crashed.path)[-1] == {ingest.CHECKPOINT_KEY: 2}
+    run(_crash(crashed))
+
+    monkeypatch.setattr(ingest.os, "getpid", lambda: 4002)
+    survivor = _queue(journal_dir)
+    run(survivor.start())
+    assert [line["serial_number"] for line in _journal_lines(survivor.path)] == ["SN0002", "SN0003", "SN0004"]
+    run(survivor.stop())
+    assert run(_count_records()) == 5
+
+
+def test_journal_is_compacted_under_sustained_load(run, journal_dir):
+    queue = WriteBehindQueue(journal_dir, max_size=3, batch_size=2, flush_interval_ms=10)
+    run(queue.start())
+    queue._task.cancel()  # 以手動取出批次代替 flusher
+
+    def take(count):
+        return [queue._queue.get_nowait() for _ in range(count)]
+
+    for i in range(3):
+        queue.submit(_record(i))
+    run(queue._write_batch(take(2)))
+    queue.submit(_record(3))
+    queue.submit(_record(4))
+    run(queue._write_batch(take(1)))
+    # 已寫入的記錄達佇列上限：journal 只留下尚未寫入的記錄
+    assert [line["serial_number"] for line in _journal_lines(queue.path)] == ["SN0003", "SN0004"]
+    queue.submit(_record(5))
+    assert len(_journal_lines(queue.path)) == 3
+    run(queue.stop())
+    assert run(_count_records()) == 6
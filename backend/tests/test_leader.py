@@ -0,0 +1,52 @@
+import asyncio
+
+from sqlalchemy import update
+
+from app.database import AsyncSessionLocal, db_now
+from app.leader import LeaderElection
+from app.models import SchedulerLease
+
+
+def _workers():
+    return LeaderElection("test", 30, 5), LeaderElection("test", 30, 5)
+
+
+def test_only_one_worker_holds_the_lease(run, database):
+    first, second = _workers()
+    assert run(first.try_acquire()) is True
+    assert run(second.try_acquire()) is False
+    # 續約不受影響
+    assert run(first.try_acquire()) is True
+    assert first.is_leader and not second.is_leader
+
+
+def test_released_lease_is_taken_over_immediately(run, database):
+    first, second = _workers()
+    run(first.try_acquire())
+    run(first.release())
+    assert not first.is_leader
+    assert run(second.try_acquire()) is True
+    assert run(first.try_acquire()) is False
+
+
+def test_expired_lease_is_taken_over(run, database):
+    first, second = _workers()
+    run(first.try_acquire())
+
+    async def expire():
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(SchedulerLease).values(expires_at=db_now(db, -1)))
+            await db.commit()
+    run(expire())
+
+    assert run(second.try_acquire()) is True
+    assert run(first.try_acquire()) is False
+    assert not first.is_leader
+
+
+def test_leadership_lapses_locally_when_renewal_stops(run, database):
+    worker = LeaderElection("test", 0.05, 5)
+    assert run(worker.try_acquire()) is True
+    assert worker.is_leader
+    run(asyncio.sleep(0.06))
+    assert not worker.is_leader
@@ -0,0 +1,88 @@
+import json
+
+from sqlalchemy import inspect, select, text
+from sqlalchemy.dialects import mysql
+from sqlalchemy.schema import CreateTable
+
+from app.database import AsyncSessionLocal, engine, init_db
+from app.measurements import parse_measurements
+from app.models import TestMeasurement
+from app.services import MeasurementService, TestRecordService
+
+
+def test_non_finite_numbers_are_not_indexed():
+    rows = parse_measurements('{"voltage": NaN, "current": Infinity, "drift": -Infinity, '
+                              '"huge": 1e400, "big": ' + "9" * 400 + ', "ok": 4.9}')
+    assert [(row["key"], row["num_value"]) for row in rows] == [("ok", 4.9)]
+
+
+def test_duplicate_keys_keep_the_last_value():
+    rows = parse_measurements('{"wifi.rssi": -40, "wifi": {"rssi": -55}, "a": 1, "a": 2}')
+    assert sorted((row["key"], row["num_value"]) for row in rows) == [("a", 2.0), ("wifi.rssi", -55.0)]
+
+
+def test_keys_differing_only_in_case_are_kept_apart():
+    rows = parse_measurements('{"Voltage": 5.0, "voltage": 4.9, "a ": 1, "a": 2}')
+    # 結尾空白在 utf8mb4_bin 下不區分，視為同一個 key
+    assert sorted((row["key"], row["num_value"]) for row in rows) == [
+        ("Voltage", 5.0), ("a", 2.0), ("voltage", 4.9)]
+
+
+def test_mysql_key_column_compares_binary():
+    ddl = str(CreateTable(TestMeasurement.__table__).compile(dialect=mysql.dialect()))
+    assert "`key` VARCHAR(100) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL" in ddl
+
+
+def _row(serial, test_data):
+    return {"device_id": "DEV1", "product_name": "P", "serial_number": serial, "test_station": "ST1",
+            "test_result": "PASS", "test_time": "2025-01-01T08:00:00", "test_data": json.dumps(test_data)}
+
+
+async def _measurements():
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(select(TestMeasurement).order_by(TestMeasurement.key))).scalars().all()
+    return [(row.record_id, row.key, row.num_value) for row in rows]
+
+
+def test_upsert_replaces_measurements_and_skips_nan(run, database):
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            await TestRecordService.bulk_upsert(db, [_row("SN1", {"voltage": 5.0, "current": 0.5})])
+        async with AsyncSessionLocal() as db:
+            await TestRecordService.bulk_upsert(db, [
+                _row("SN1", {"voltage": 4.9, "current": float("nan")}),
+                _row("SN2", {"voltage": float("inf")}),
+                _row("SN3", {"voltage": 5.1}),
+            ])
+        async with AsyncSessionLocal() as db:
+            return await MeasurementService.aggregate(db, "voltage")
+
+    stats = run(scenario())
+    assert stats[0]["count"] == 2 and stats[0]["min"] == 4.9 and stats[0]["max"] == 5.1
+    assert [(key, value) for _, key, value in run(_measurements())] == [("voltage", 4.9), ("voltage", 5.1)]
+
+
+def test_init_db_removes_duplicates_before_creating_unique_index(run, database):
+    async def create():
+        async with AsyncSessionLocal() as db:
+            await TestRecordService.bulk_upsert(db, [_row("SN1", {"voltage": 5.0})])
+    run(create())
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX uq_test_measurements_record_key"))
+        record_id = conn.execute(text("SELECT id FROM test_records")).scalar()
+        conn.execute(text("INSERT INTO test_measurements (record_id, key, num_value) VALUES (:id, 'voltage', 4.8)"),
+                     {"id": record_id})
+
+    init_db()
+    indexes = {index["name"]: index for index in inspect(engine).get_indexes("test_measurements")}
+    assert indexes["uq_test_measurements_record_key"]["unique"]
+    assert run(_measurements()) == [(record_id, "voltage", 4.8)]
+
+
+def test_keys_differing_only_in_case_are_stored(run, database):
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            return await TestRecordService.bulk_upsert(db, [_row("SN1", {"Voltage": 5.0, "voltage": 4.9})])
+
+    assert run(scenario())["inserted"] == 1
+    assert sorted(key for _, key, _ in run(_measurements())) == ["Voltage", "voltage"]
@@ -0,0 +1,80 @@
+from datetime import datetime
+
+import httpx
+import pytest
+from sqlalchemy import insert
+
+from app.database import AsyncSessionLocal
+from app.main import app
+from app.models import SensorTestRun, TestRecord
+from app.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip_and_invalid_cursor():
+    cursor = encode_cursor(datetime(2025, 1, 1, 8, 30, 15, 120000), 42)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (datetime(2025, 1, 1, 8, 30, 15, 120000), 42)
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+
+async def _seed_records():
+    # 每三筆共用同一個 test_time，驗證同時間戳記的資料不會在換頁時重複或遺漏
+    rows = [{"device_id": "DEV1" if i % 2 else "DEV2", "product_name": "P", "serial_number": f"SN{i:02d}",
+             "test_station": "ST1", "test_result": "PASS", "test_time": datetime(2025, 1, 1, 8, i // 3)}
+            for i in range(10)]
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(TestRecord), rows)
+        await db.commit()
+
+
+async def _pages(path, limit, **params):
+    pages = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        cursor = None
+        while True:
+            query = dict(params, limit=limit, **({"cursor": cursor} if cursor else {}))
+            response = await client.get(path, params=query)
+            assert response.status_code == 200, response.text
+            pages.append(response.json())
+            cursor = response.headers.get(NEXT_CURSOR_HEADER)
+            if cursor is None:
+                return pages
+
+
+def test_record_pages_follow_time_then_id_without_gaps(run, database):
+    run(_seed_records())
+    pages = run(_pages("/api/test-records/", 4))
+    assert [len(page) for page in pages] == [4, 4, 2]
+    rows = [row for page in pages for row in page]
+    assert [row["serial_number"] for row in rows] == [f"SN{i:02d}" for i in range(9, -1, -1)]
+
+
+def test_record_pages_apply_filters_and_end_on_full_last_page(run, database):
+    run(_seed_records())
+    pages = run(_pages("/api/test-records/", 5, device_id="DEV1"))
+    # 最後一頁剛好滿頁時多回一頁空結果
+    assert [len(page) for page in pages] == [5, 0]
+    assert [row["serial_number"] for row in pages[0]] == ["SN09", "SN07", "SN05", "SN03", "SN01"]
+
+
+def test_invalid_cursor_is_a_client_error(run, database):
+    async def get(path):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.get(path, params={"cursor": "bogus"})
+    assert run(get("/api/test-records/")).status_code == 400
+    assert run(get("/api/sensor/test-runs")).status_code == 400
+
+
+def test_sensor_run_pages(run, database):
+    async def seed():
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(SensorTestRun), [
+                {"serial_wle": f"WLE{i}", "run_mode": "session", "test_result": "PASS",
+                 "started_at": datetime(2025, 1, 1, 8, i // 2), "completed_at": datetime(2025, 1, 1, 9)}
+                for i in range(5)
+            ])
+            await db.commit()
+    run(seed())
+    pages = run(_pages("/api/sensor/test-runs", 2))
+    assert [[row["serial_wle"] for row in page] for page in pages] == [["WLE4", "WLE3"], ["WLE2", "WLE1"], ["WLE0"]]
@@ -0,0 +1,134 @@
+from datetime import datetime
+
+import httpx
+import pytest
+from sqlalchemy import func, inspect, select, text
+
+from app.database import AsyncSessionLocal, engine, init_db
+from app.event_bus import event_bus
+from app.main import app
+from app.models import SensorTestItem
+from app.routers import sensor_events
+from app.sensor_sessions import ActiveSensorSession, SensorSessionCache, sensor_sessions
+
+
+def _session(serial, run_id=1):
+    return ActiveSensorSession(run_id, serial, datetime(2025, 1, 1), "PENDING")
+
+
+def test_lru_evicts_least_recently_used():
+    cache = SensorSessionCache(max_size=2)
+    cache.put(_session("A", 1))
+    cache.put(_session("B", 2))
+    assert cache.get("A").id == 1
+    cache.put(_session("C", 3))
+    assert cache.get("B") is None
+    assert [cache.get(serial).id for serial in ("A", "C")] == [1, 3]
+    cache.evict_run(3)
+    assert cache.get("C") is None
+    assert cache.evictions == 2
+
+
+@pytest.fixture
+def sensor_state(database):
+    sensor_sessions._sessions.clear()
+    sensor_events.active_sensor_run_ids.clear()
+    yield sensor_sessions
+    sensor_sessions._sessions.clear()
+    sensor_events.active_sensor_run_ids.clear()
+
+
+async def _request(method, path, payload=None):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.request(method, path, json=payload)
+    assert response.status_code < 300, response.text
+    return response.json() if response.content else None
+
+
+async def _event(stage, status, serial="WLE1"):
+    return await _request("POST", "/api/sensor/events", {"serial": serial, "stage": stage, "status": status,
+                                                          "detail": {}})
+
+
+async def _item_count(run_id):
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(
+            select(func.count()).select_from(SensorTestItem).where(SensorTestItem.run_id == run_id)
+        )).scalar()
+
+
+async def _item_statuses(run_id):
+    async with AsyncSessionLocal() as db:
+        rows = await db.execute(
+            select(SensorTestItem.stage, SensorTestItem.status).where(SensorTestItem.run_id == run_id)
+        )
+        return dict(rows.all())
+
+
+def test_events_are_served_from_the_cache(run, sensor_state):
+    run_id = run(_request("POST", "/api/sensor/serial-found", {"serial_wle": "WLE1"}))["run_id"]
+    misses = sensor_state.misses
+    run(_event("getSensorIC", "pass"))
+    run(_event("testButton", "fail"))
+    run(_event("testButton", "pass"))
+    assert sensor_state.misses == misses
+    session = sensor_state.get("WLE1")
+    assert session.id == run_id
+    # 重測同一測項更新既有的 item
+    assert run(_item_count(run_id)) == 2
+    assert run(_item_statuses(run_id)) == {"getSensorIC": "pass", "testButton": "pass"}
+
+
+def test_cache_miss_reloads_the_session_from_the_database(run, sensor_state):
+    run_id = run(_request("POST", "/api/sensor/serial-found", {"serial_wle": "WLE1"}))["run_id"]
+    run(_event("testButton", "fail"))
+    sensor_state.evict("WLE1")
+    run(_event("testButton", "pass"))
+    session = sensor_state.get("WLE1")
+    assert session.id == run_id and session.verdict.result == "PASS"
+    assert run(_item_count(run_id)) == 1
+
+
+def test_updates_from_other_processes_evict_the_session(run, sensor_state):
+    run(_request("POST", "/api/sensor/serial-found", {"serial_wle": "WLE1"}))
+    run(_event("getSensorIC", "pass"))
+    message = {"type": "sensor_event", "data": {"serial": "WLE1", "stage": "testSPI", "status": "fail"}}
+
+    run(sensor_events._sync_sensor_session(dict(message, origin=event_bus.origin)))
+    assert sensor_state.get("WLE1") is not None
+    run(sensor_events._sync_sensor_session(dict(message, origin="other-host:1")))
+    assert sensor_state.get("WLE1") is None
+
+
+def test_new_serial_found_and_delete_evict_the_session(run, sensor_state):
+    first = run(_request("POST", "/api/sensor/serial-found", {"serial_wle": "WLE1"}))["run_id"]
+    run(_event("getSensorIC", "pass"))
+    second = run(_request("POST", "/api/sensor/serial-found", {"serial_wle": "WLE1"}))["run_id"]
+    assert second != first and sensor_state.get("WLE1").id == second
+
+    run(_request("DELETE", f"/api/sensor/test-runs/{second}"))
+    assert sensor_state.get("WLE1") is None
+
+
+def test_item_written_by_another_worker_is_updated_in_place(run, sensor_state):
+    run_id = run(_request("POST", "/api/sensor/serial-found", {"serial_wle": "WLE1"}))["run_id"]
+    run(_event("testButton", "fail"))
+    # 模擬另一個 worker 的快取：同一 run 的 session 從未見過這個測項
+    sensor_state.put(ActiveSensorSession(run_id, "WLE1", sensor_state.get("WLE1").started_at, "FAIL"))
+    run(_event("testButton", "pass"))
+    assert run(_item_count(run_id)) == 1
+    assert run(_item_statuses(run_id)) == {"testButton": "pass"}
+
+
+def test_init_db_removes_duplicate_items_before_creating_unique_index(run, sensor_state):
+    run_id = run(_request("POST", "/api/sensor/serial-found", {"serial_wle": "WLE1"}))["run_id"]
+    run(_event("testButton", "fail"))
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX uq_sensor_test_items_run_stage"))
+        conn.execute(text("INSERT INTO sensor_test_items (run_id, stage, sequence, status, tested_at) "
+                          "VALUES (:id, 'testButton', 1, 'pass', :now)"), {"id": run_id, "now": datetime.now()})
+
+    init_db()
+    indexes = {index["name"]: index for index in inspect(engine).get_indexes("sensor_test_items")}
+    assert indexes["uq_sensor_test_items_run_stage"]["unique"]
+    assert run(_item_statuses(run_id)) == {"testButton": "pass"}
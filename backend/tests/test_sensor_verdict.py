@@ -0,0 +1,135 @@
+import httpx
+import pytest
+from sqlalchemy import select, update
+
+from app.database import AsyncSessionLocal
+from app.main import app
+from app.models import SensorRunHourlyStat, SensorTestRun
+from app.routers import sensor_events
+from app.sensor_sessions import sensor_sessions
+from app.sensor_verdict import STAGE_BITS, SensorVerdict, stages_mask
+
+
+def test_first_pass_without_failures_is_pass():
+    verdict = SensorVerdict()
+    assert verdict.result == "PENDING"
+    verdict.apply("getSensorIC", "pass")
+    assert verdict.result == "PASS"
+
+
+def test_any_failure_is_fail_until_retested():
+    verdict = SensorVerdict()
+    verdict.apply("getSensorIC", "pass")
+    verdict.apply("testButton", "fail")
+    assert verdict.result == "FAIL"
+    verdict.apply("testButton", "pass")
+    assert verdict.result == "PASS"
+    assert verdict.passed == stages_mask(["getSensorIC", "testButton"])
+    assert verdict.failed == 0
+
+
+def test_final_result_uses_expected_stages():
+    verdict = SensorVerdict()
+    verdict.apply("testButton", "pass")
+    assert verdict.final_result(["testButton"]) == "PASS"
+    # 未通過 getSensorIC 又缺少 expected_stages 時維持 PENDING
+    assert verdict.final_result(["testButton", "testSPI"]) == "PENDING"
+    assert verdict.final_result(None) == "PENDING"
+    # 不認得的測項不可能通過
+    assert verdict.final_result(["testButton", "bogus"]) == "PENDING"
+
+
+def test_final_result_falls_back_to_sensor_ic():
+    verdict = SensorVerdict()
+    verdict.apply("getSensorIC", "pass")
+    assert verdict.final_result(["getSensorIC", "testSPI"]) == "PASS"
+    verdict.apply("testSPI", "fail")
+    assert verdict.final_result(None) == "FAIL"
+
+
+@pytest.fixture
+def sensor_state(database):
+    sensor_sessions._sessions.clear()
+    sensor_events.active_sensor_run_ids.clear()
+    yield
+    sensor_sessions._sessions.clear()
+    sensor_events.active_sensor_run_ids.clear()
+
+
+async def _post(path, payload):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post(path, json=payload)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def _event(stage, status):
+    return await _post("/api/sensor/events", {"serial": "WLE1", "stage": stage, "status": status, "detail": {}})
+
+
+async def _load_run(run_id):
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(select(SensorTestRun).where(SensorTestRun.id == run_id))).scalars().one()
+
+
+async def _rollup_counts():
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(select(SensorRunHourlyStat))).scalars().all()
+    return {row.test_result: row.run_count for row in rows if row.run_count}
+
+
+def test_events_update_masks_and_rollups(run, sensor_state):
+    run_id = run(_post("/api/sensor/serial-found", {"serial_wle": "WLE1"}))["run_id"]
+    run(_event("getSensorIC", "pass"))
+    run(_event("testButton", "fail"))
+    db_run = run(_load_run(run_id))
+    assert db_run.test_result == "FAIL"
+    assert db_run.passed_mask == STAGE_BITS["getSensorIC"]
+    assert db_run.failed_mask == STAGE_BITS["testButton"]
+
+    run(_event("testButton", "pass"))
+    run(_post("/api/sensor/events", {"serial": "WLE1", "stage": "testComplete", "status": "pass",
+                                     "detail": {"expected_stages": ["getSensorIC", "testButton"]}}))
+    db_run = run(_load_run(run_id))
+    assert db_run.test_result == "PASS"
+    assert db_run.failed_mask == 0
+    assert run(_rollup_counts()) == {"PASS": 1}
+
+
+def test_stale_cache_does_not_erase_concurrent_failure(run, sensor_state):
+    """另一個請求（或 process）寫入的 fail bit 不可被快取中舊的 bitmask 覆蓋"""
+    run_id = run(_post("/api/sensor/serial-found", {"serial_wle": "WLE1"}))["run_id"]
+    run(_event("getSensorIC", "pass"))
+    assert sensor_sessions.get("WLE1").verdict.failed == 0
+
+    async def concurrent_failure():
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(SensorTestRun).where(SensorTestRun.id == run_id)
+                             .values(failed_mask=STAGE_BITS["testSPI"], test_result="FAIL"))
+            await db.commit()
+    run(concurrent_failure())
+
+    result = run(_event("testButton", "pass"))
+    assert result["run_id"] == run_id
+    db_run = run(_load_run(run_id))
+    assert db_run.failed_mask == STAGE_BITS["testSPI"]
+    assert db_run.passed_mask == stages_mask(["getSensorIC", "testButton"])
+    assert db_run.test_result == "FAIL"
+    assert sensor_sessions.get("WLE1").verdict.failed == STAGE_BITS["testSPI"]
+
+
+def test_init_db_backfills_masks_for_legacy_sessions(run, sensor_state):
+    from sqlalchemy import text
+    from app.database import engine, init_db
+
+    run_id = run(_post("/api/sensor/serial-found", {"serial_wle": "WLE1"}))["run_id"]
+    run(_event("getSensorIC", "pass"))
+    run(_event("testSPI", "fail"))
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE sensor_test_runs SET passed_mask = 0, failed_mask = 0, "
+                          "test_result = 'PENDING'"))
+    init_db()
+    db_run = run(_load_run(run_id))
+    assert db_run.passed_mask == STAGE_BITS["getSensorIC"]
+    assert db_run.failed_mask == STAGE_BITS["testSPI"]
+    assert db_run.test_result == "FAIL"
@@ -0,0 +1,96 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.cache import TEST_RECORD_STATS, TTLCache
+from app.main import app
+
+
+def test_concurrent_misses_share_one_load(run):
+    cache = TTLCache(60)
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def scenario():
+        results = await asyncio.gather(*(cache.get_or_load(("ns", "a"), loader) for _ in range(5)))
+        return results, await cache.get_or_load(("ns", "a"), loader)
+
+    results, cached = run(scenario())
+    assert results == [1] * 5 and cached == 1
+    assert (cache.misses, cache.coalesced, cache.hits) == (1, 4, 1)
+
+
+def test_load_started_before_invalidation_is_not_cached(run):
+    cache = TTLCache(60)
+    values = iter(["stale", "fresh"])
+
+    async def loader():
+        value = next(values)
+        if value == "stale":
+            # 查詢進行中發生寫入
+            cache.invalidate("ns")
+        return value
+
+    async def scenario():
+        return await cache.get_or_load(("ns",), loader), await cache.get_or_load(("ns",), loader)
+
+    assert run(scenario()) == ("stale", "fresh")
+
+
+def test_loader_error_reaches_waiters_and_is_not_cached(run):
+    cache = TTLCache(60)
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("db down")
+
+    async def ok():
+        return "ok"
+
+    async def scenario():
+        results = await asyncio.gather(cache.get_or_load(("ns",), failing), cache.get_or_load(("ns",), failing),
+                                       return_exceptions=True)
+        return results, await cache.get_or_load(("ns",), ok)
+
+    results, value = run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert value == "ok"
+
+
+def test_invalidate_notifies_listeners():
+    cache = TTLCache(60)
+    seen = []
+    cache.add_listener(seen.append)
+    cache.invalidate(TEST_RECORD_STATS)
+    assert seen == [TEST_RECORD_STATS]
+
+
+@pytest.fixture
+def client_get():
+    async def get(path):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get(path)
+        assert response.status_code == 200, response.text
+        return response.json()
+    return get
+
+
+def test_stats_endpoint_reflects_writes_immediately(run, database, client_get):
+    async def post(serial):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/api/test-records/", json={
+                "device_id": "DEV1", "product_name": "P", "serial_number": serial, "test_station": "ST1",
+                "test_result": "PASS", "test_time": "2025-01-01T08:00:00",
+            })
+        assert response.status_code == 201, response.text
+
+    before = run(client_get("/api/test-records/stats"))
+    run(post("SN1"))
+    after = run(client_get("/api/test-records/stats"))
+    assert after != before
+    assert after["total"] == before["total"] + 1
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from app import stats_push as push
+from app.cache import SENSOR_RUN_STATS, TEST_RECORD_STATS
+from app.database import AsyncSessionLocal
+from app.schemas import TestRecordCreate
+from app.services import TestRecordService
+
+
+class RecordingManager:
+    def __init__(self):
+        self.messages = []
+
+    async def broadcast(self, message):
+        self.messages.append(message)
+
+
+@pytest.fixture
+def pusher(run, database, monkeypatch):
+    """使用註冊在 stats_cache 上的 stats_push，寫入路徑的失效通知即會觸發推播"""
+    stats_pusher = push.stats_push
+    run(stats_pusher.stop())
+    manager = RecordingManager()
+    monkeypatch.setattr(push, "manager", manager)
+    monkeypatch.setattr(stats_pusher, "delay", 0.01)
+    monkeypatch.setattr(stats_pusher, "_dirty", set())
+    monkeypatch.setattr(stats_pusher, "_last", {})
+    monkeypatch.setattr(stats_pusher, "pushed", 0)
+    monkeypatch.setattr(stats_pusher, "unchanged", 0)
+    yield stats_pusher, manager
+    run(stats_pusher.stop())
+
+
+async def _create(serial, result="PASS"):
+    async with AsyncSessionLocal() as db:
+        await TestRecordService.create_test_record(db, TestRecordCreate(
+            device_id="DEV1", product_name="P", serial_number=serial, test_station="ST1",
+            test_result=result, test_time="2025-01-01T08:00:00",
+        ))
+
+
+def _deltas(manager):
+    return [(m["data"]["scope"], m["data"]["changed"]) for m in manager.messages]
+
+
+def test_first_push_is_a_full_snapshot_then_only_changed_fields(run, pusher):
+    stats_pusher, manager = pusher
+
+    async def scenario():
+        await _create("SN1")
+        await stats_pusher.stop()
+        await _create("SN2", "FAIL")
+        await stats_pusher.stop()
+
+    run(scenario())
+    (scope, first), (_, second) = _deltas(manager)
+    assert scope == "test_records"
+    assert first["total"] == 1 and first["passed"] == 1 and "today_total" in first
+    assert second == {"total": 2, "failed": 1, "pass_rate": 50.0}
+
+
+def test_changes_within_the_delay_are_pushed_once_per_scope(run, pusher):
+    stats_pusher, manager = pusher
+
+    async def scenario():
+        await _create("SN1")
+        for _ in range(3):
+            stats_pusher.mark_changed(TEST_RECORD_STATS)
+        stats_pusher.mark_changed(SENSOR_RUN_STATS)
+        stats_pusher.mark_changed("unrelated")
+        await stats_pusher.stop()
+        # 沒有實際變動時不廣播
+        stats_pusher.mark_changed(TEST_RECORD_STATS)
+        await stats_pusher.stop()
+
+    run(scenario())
+    assert sorted(scope for scope, _ in _deltas(manager)) == ["sensor_runs", "test_records"]
+    assert stats_pusher.pushed == 2 and stats_pusher.unchanged == 1
+
+
+def test_stop_sends_the_pending_push(run, pusher):
+    stats_pusher, manager = pusher
+
+    async def scenario():
+        await _create("SN1")
+        await stats_pusher.stop()
+
+    run(scenario())
+    assert len(manager.messages) == 1
+
+
+def test_day_boundary_pushes_the_reset_today_total(run, pusher, monkeypatch):
+    stats_pusher, manager = pusher
+    clock = [push.datetime(2025, 1, 1, 23, 59, 59, 950000)]
+
+    class FakeDatetime(push.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return clock[0]
+
+    monkeypatch.setattr(push, "datetime", FakeDatetime)
+
+    async def scenario():
+        await _create("SN1")
+        await stats_pusher.stop()
+        # 模擬前一天的推播：today_total 尚未歸零
+        stats_pusher._last["test_records"]["today_total"] = 5
+        await stats_pusher.start()
+        await asyncio.sleep(0)
+        clock[0] = push.datetime(2025, 1, 2, 0, 0, 0, 10000)
+        for _ in range(100):
+            if len(manager.messages) == 3:
+                break
+            await asyncio.sleep(0.01)
+        await stats_pusher.stop()
+
+    run(scenario())
+    # sensor_runs 尚未推播過，跨日時送出完整快照
+    assert sorted(scope for scope, _ in _deltas(manager)[1:]) == ["sensor_runs", "test_records"]
+    assert ("test_records", {"today_total": 0}) in _deltas(manager)
@@ -0,0 +1,100 @@
+from datetime import datetime
+
+from sqlalchemy import select, text, update
+
+from app.database import AsyncSessionLocal, engine, init_db
+from app.models import TestRecord, TestRecordOutbox
+from app.schemas import TestRecordCreate
+from app.services import CloudUploadService, TestRecordService
+
+
+async def _create(serial, result="PASS"):
+    async with AsyncSessionLocal() as db:
+        return (await TestRecordService.create_test_record(db, TestRecordCreate(
+            device_id="DEV1", product_name="P", serial_number=serial, test_station="ST1",
+            test_result=result, test_time=datetime(2025, 1, 1, 8),
+        ))).id
+
+
+async def _pending(after_id=0):
+    async with AsyncSessionLocal() as db:
+        return [(row.outbox_id, row.serial_number)
+                for row in await CloudUploadService.get_pending_chunk(db, after_id, 100)]
+
+
+async def _uploaded():
+    async with AsyncSessionLocal() as db:
+        rows = await db.execute(select(TestRecord.serial_number).where(TestRecord.uploaded_to_cloud.is_(True)))
+        return sorted(rows.scalars().all())
+
+
+async def _acknowledge(previous_id, last_id):
+    async with AsyncSessionLocal() as db:
+        await CloudUploadService.acknowledge(db, previous_id, last_id)
+        await db.commit()
+        return await CloudUploadService.get_cursor(db)
+
+
+def test_writes_are_queued_in_order_and_updates_requeue(run, database):
+    run(_create("SN1"))
+    run(_create("SN2"))
+    run(_create("SN1", "FAIL"))
+    assert run(_pending()) == [(1, "SN1"), (2, "SN2"), (3, "SN1")]
+
+
+def test_acknowledge_advances_cursor_and_keeps_requeued_records_pending(run, database):
+    run(_create("SN1"))
+    run(_create("SN2"))
+    run(_create("SN1", "FAIL"))
+    # 只確認前兩筆：SN1 之後又更新過，仍維持未上傳
+    assert run(_acknowledge(0, 2)) == 2
+    assert run(_uploaded()) == ["SN2"]
+    assert run(_pending(2)) == [(3, "SN1")]
+    assert run(_acknowledge(2, 3)) == 3
+    assert run(_uploaded()) == ["SN1", "SN2"]
+    assert run(_pending(3)) == []
+
+
+def test_deleted_record_still_occupies_its_outbox_id(run, database):
+    record_id = run(_create("SN1"))
+    run(_create("SN2"))
+
+    async def delete():
+        async with AsyncSessionLocal() as db:
+            await TestRecordService.delete_test_record(db, record_id)
+    run(delete())
+    assert run(_pending()) == [(1, None), (2, "SN2")]
+
+
+def test_upgrade_seeds_outbox_from_unuploaded_records(run, database):
+    run(_create("SN1"))
+    run(_create("SN2"))
+
+    async def mark_first_uploaded():
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(TestRecord).where(TestRecord.serial_number == "SN1")
+                             .values(uploaded_to_cloud=True))
+            await db.commit()
+    run(mark_first_uploaded())
+    # 模擬升級前的資料庫：沒有 outbox 與游標
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM test_record_outbox"))
+        conn.execute(text("DELETE FROM cloud_upload_cursors"))
+    init_db()
+    assert [serial for _, serial in run(_pending())] == ["SN2"]
+
+
+def test_restart_with_empty_outbox_resets_cursor(run, database):
+    run(_create("SN1"))
+    assert run(_acknowledge(0, 1)) == 1
+
+    async def outbox_size():
+        async with AsyncSessionLocal() as db:
+            return len((await db.execute(select(TestRecordOutbox))).all())
+    assert run(outbox_size()) == 0
+    init_db()
+
+    async def cursor():
+        async with AsyncSessionLocal() as db:
+            return await CloudUploadService.get_cursor(db)
+    assert run(cursor()) == 0
@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+from app.upload_signal import UploadSignal
+
+
+def test_returns_as_soon_as_the_batch_is_full(run):
+    signal = UploadSignal()
+
+    async def scenario():
+        waiter = asyncio.create_task(signal.wait_for_batch(3, 10))
+        signal.notify(2)
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        signal.notify(1)
+        return await asyncio.wait_for(waiter, 1)
+
+    assert run(scenario()) == 3
+    assert signal.pending == 0 and signal.first_pending_at is None
+
+
+def test_partial_batch_is_flushed_after_flush_seconds(run):
+    signal = UploadSignal()
+
+    async def scenario():
+        signal.notify(1)
+        started = time.monotonic()
+        count = await asyncio.wait_for(signal.wait_for_batch(100, 0.05), 1)
+        return count, time.monotonic() - started
+
+    count, elapsed = run(scenario())
+    assert count == 1 and 0.03 <= elapsed < 0.5
+
+
+def test_retry_after_wakes_without_new_changes(run):
+    signal = UploadSignal()
+
+    async def scenario():
+        waiter = asyncio.create_task(signal.wait_for_batch(100, 10))
+        await asyncio.sleep(0.01)
+        signal.retry_after(0.03)
+        # 較晚的重試時間不會延後已排定的重試
+        signal.retry_after(5)
+        return await asyncio.wait_for(waiter, 1)
+
+    assert run(scenario()) == 0
+    assert signal._retry_at is None
+
+
+def test_non_positive_counts_are_ignored():
+    signal = UploadSignal()
+    signal.notify(0)
+    signal.notify(-2)
+    assert signal.pending == 0 and signal.first_pending_at is None
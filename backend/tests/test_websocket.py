@@ -0,0 +1,280 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import WebSocketDisconnect
+
+from app.routers import websocket as ws
+
+
+class FakeWebSocket:
+    """記錄送出的 frame；incoming 放入客戶端訊息，放入 None 表示斷線"""
+
+    def __init__(self, query=None):
+        self.query_params = query or {}
+        self.client = None
+        self.sent = []
+        self.incoming = asyncio.Queue()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, frame):
+        self.sent.append(json.loads(frame))
+
+    async def receive_text(self):
+        message = await self.incoming.get()
+        if message is None:
+            raise WebSocketDisconnect()
+        return json.dumps(message)
+
+    async def close(self, code=1000):
+        pass
+
+
+@pytest.fixture
+def manager(run, monkeypatch):
+    manager = ws.ConnectionManager()
+    monkeypatch.setattr(ws, "manager", manager)
+    yield manager
+    run(manager.shutdown(drain_timeout=0))
+
+
+async def _settle(manager):
+    for _ in range(100):
+        if manager._idle():
+            break
+        await asyncio.sleep(0.005)
+    await asyncio.sleep(0.01)
+
+
+def _event(index):
+    return {"type": "test_result", "data": {"serial_number": f"SN{index}"}}
+
+
+def _seqs(frames):
+    return [frame["seq"] for frame in frames if "seq" in frame]
+
+
+def test_resume_on_connect_replays_before_live_messages(run, manager):
+    async def scenario():
+        for i in range(1, 4):
+            await manager.deliver(_event(i))
+        await _settle(manager)
+        socket = FakeWebSocket({"last_seq": "1", "epoch": manager.epoch})
+        endpoint = asyncio.create_task(ws.websocket_endpoint(socket))
+        await asyncio.sleep(0)
+        await manager.deliver(_event(4))
+        await _settle(manager)
+        await socket.incoming.put(None)
+        await endpoint
+        return socket.sent
+
+    frames = run(scenario())
+    assert [frame["type"] for frame in frames] == ["hello", "test_result", "test_result", "resumed", "test_result"]
+    assert _seqs(frames) == [2, 3, 4]
+    assert frames[3]["data"] == {"from_seq": 1, "to_seq": 3, "replayed": 2}
+
+
+def test_resume_after_connect_requests_resync_instead_of_replaying(run, manager):
+    async def scenario():
+        for i in range(1, 3):
+            await manager.deliver(_event(i))
+        await _settle(manager)
+        socket = FakeWebSocket()
+        endpoint = asyncio.create_task(ws.websocket_endpoint(socket))
+        await asyncio.sleep(0)
+        await manager.deliver(_event(3))
+        await _settle(manager)
+        await socket.incoming.put({"action": "resume", "last_seq": 0, "epoch": manager.epoch})
+        await _settle(manager)
+        await socket.incoming.put(None)
+        await endpoint
+        return socket.sent
+
+    frames = run(scenario())
+    assert [frame["type"] for frame in frames] == ["hello", "test_result", "resync_required"]
+    # 不會補送 seq 1、2 到已送出的 seq 3 之後
+    assert _seqs(frames) == [3]
+    assert frames[2]["data"]["seq"] == 2
+    assert manager.resumed == 0 and manager.resyncs == 1
+
+
+def test_resume_with_other_epoch_requires_resync(run, manager):
+    async def scenario():
+        await manager.deliver(_event(1))
+        await _settle(manager)
+        socket = FakeWebSocket({"last_seq": "0", "epoch": "other"})
+        endpoint = asyncio.create_task(ws.websocket_endpoint(socket))
+        await _settle(manager)
+        await socket.incoming.put(None)
+        await endpoint
+        return socket.sent
+
+    frames = run(scenario())
+    assert [frame["type"] for frame in frames] == ["hello", "resync_required"]
+    assert frames[1]["data"]["reason"] == "epoch changed"
+
+
+class StalledWebSocket(FakeWebSocket):
+    """send_text 一直等到 release 才返回，模擬慢速客戶端"""
+
+    def __init__(self):
+        super().__init__()
+        self.released = asyncio.Event()
+
+    async def send_text(self, frame):
+        await self.released.wait()
+        await super().send_text(frame)
+
+
+async def _client(manager, socket, policy, max_queue=3, send_timeout=5.0):
+    # ClientConnection 建立時即啟動 writer task，需在 event loop 內建立
+    client = ws.ClientConnection(socket, manager, max_queue, policy, send_timeout)
+    manager.active_connections[socket] = client
+    manager._unfiltered.add(client)
+    return client
+
+
+def _progress(step, stage="testButton"):
+    return {"type": "sensor_event", "data": {"serial": "WLE1", "stage": stage, "status": "testing", "step": step}}
+
+
+def _drain_stalled(run, manager, client, messages):
+    async def scenario():
+        await asyncio.sleep(0)  # writer 取出第一則後卡在 send_text
+        for message in messages:
+            client.enqueue(message, ws.coalesce_key(message))
+        client.websocket.released.set()
+        await _settle(manager)
+        return client.websocket.sent
+    return run(scenario())
+
+
+def test_drop_oldest_keeps_the_newest_frames(run, manager):
+    client = run(_client(manager, StalledWebSocket(), "drop_oldest"))
+    client.enqueue(_event(0))
+    sent = _drain_stalled(run, manager, client, [_event(i) for i in range(1, 6)])
+    assert [frame["data"]["serial_number"] for frame in sent] == ["SN0", "SN3", "SN4", "SN5"]
+    assert client.dropped == 2
+
+
+def test_coalesce_replaces_queued_frame_for_the_same_stage(run, manager):
+    client = run(_client(manager, StalledWebSocket(), "coalesce"))
+    client.enqueue(_event(0))
+    sent = _drain_stalled(run, manager, client, [_progress(1), _progress(2, "testSPI"), _progress(3)])
+    # 取代的 frame 移到尾端，送出順序與產生順序一致
+    assert [(frame["data"].get("stage"), frame["data"].get("step")) for frame in sent[1:]] == [
+        ("testSPI", 2), ("testButton", 3)]
+    assert client.coalesced == 1 and client.dropped == 0
+
+
+def test_coalesce_never_sends_seq_backwards(run, manager):
+    async def scenario():
+        client = await _client(manager, StalledWebSocket(), "coalesce", max_queue=10)
+        for step in range(12):
+            await manager.deliver(_progress(step, ("testButton", "testSPI", "getSensorIC")[step % 3]))
+        await _settle(manager)
+        client.websocket.released.set()
+        await _settle(manager)
+        return client
+
+    client = run(scenario())
+    seqs = _seqs(client.websocket.sent)
+    assert seqs == sorted(seqs) and seqs[-3:] == [10, 11, 12]
+    assert client.coalesced > 0
+
+
+def test_disconnect_policy_closes_a_client_whose_queue_is_full(run, manager):
+    client = run(_client(manager, StalledWebSocket(), "disconnect"))
+    client.enqueue(_event(0))
+    _drain_stalled(run, manager, client, [_event(i) for i in range(1, 6)])
+    assert client.closed
+    assert client.websocket not in manager.active_connections
+    assert manager.disconnected_slow == 1
+
+
+def test_send_timeout_disconnects_without_blocking_other_clients(run, manager):
+    stalled = run(_client(manager, StalledWebSocket(), "drop_oldest", send_timeout=0.02))
+    healthy = run(_client(manager, FakeWebSocket(), "drop_oldest"))
+
+    async def scenario():
+        for i in range(3):
+            await manager.deliver(_event(i))
+        await asyncio.sleep(0.05)
+
+    run(scenario())
+    assert stalled.closed
+    assert [frame["seq"] for frame in healthy.websocket.sent] == [1, 2, 3]
+
+
+def test_subscriptions_route_matching_messages_only(run, manager):
+    async def scenario():
+        by_type = await _client(manager, FakeWebSocket(), "drop_oldest")
+        by_serial = await _client(manager, FakeWebSocket(), "drop_oldest")
+        everything = await _client(manager, FakeWebSocket(), "drop_oldest")
+        manager.subscribe(by_type, {"types": ["pcba_event"]})
+        manager.subscribe(by_serial, {"serials": ["WLE1"], "stations": ["ST9"]})
+
+        await manager.deliver({"type": "pcba_event", "data": {"serial": "PCB1"}})
+        await manager.deliver({"type": "sensor_event", "data": {"serial": "WLE1"}})
+        await manager.deliver({"type": "test_result", "data": {"serial_number": "SN1", "test_station": "ST9"}})
+        await manager.deliver({"type": "test_result", "data": {"serial_number": "SN2", "test_station": "ST1"}})
+        await _settle(manager)
+
+        manager.unsubscribe(by_serial, {"serials": ["WLE1"]})
+        await manager.deliver({"type": "sensor_event", "data": {"serial": "WLE1"}})
+        await _settle(manager)
+        manager.unsubscribe(by_type)
+        await manager.deliver({"type": "system_status", "data": {}})
+        await _settle(manager)
+        return [[frame["seq"] for frame in client.websocket.sent] for client in (by_type, by_serial, everything)]
+
+    by_type, by_serial, everything = run(scenario())
+    assert by_type == [1, 6]
+    assert by_serial == [2, 3]
+    assert everything == [1, 2, 3, 4, 5, 6]
+    # 取消訂閱後索引不留下空集合
+    assert not manager._index["types"] and not manager._index["serials"]
+    assert set(manager._index["stations"]) == {"ST9"}
+
+
+def test_subscription_from_query_string_applies_before_resume(run, manager):
+    async def scenario():
+        await manager.deliver({"type": "pcba_event", "data": {"serial": "PCB1"}})
+        await manager.deliver({"type": "sensor_event", "data": {"serial": "WLE1"}})
+        await _settle(manager)
+        socket = FakeWebSocket({"types": "sensor_event", "last_seq": "0", "epoch": manager.epoch})
+        endpoint = asyncio.create_task(ws.websocket_endpoint(socket))
+        await _settle(manager)
+        await socket.incoming.put(None)
+        await endpoint
+        return socket.sent
+
+    frames = run(scenario())
+    assert [(frame["type"], frame.get("seq")) for frame in frames] == [
+        ("hello", None), ("sensor_event", 2), ("resumed", None)]
+
+
+def test_broadcast_is_encoded_once_for_all_clients(run, manager, monkeypatch):
+    encoded = []
+
+    def counting_encode(message):
+        encoded.append(message.get("type"))
+        return real_encode(message)
+    real_encode = ws.encode_message
+    monkeypatch.setattr(ws, "encode_message", counting_encode)
+
+    async def scenario():
+        clients = [await _client(manager, FakeWebSocket(), "drop_oldest") for _ in range(3)]
+        await manager.deliver(_event(1))
+        # 無法序列化的訊息直接丟棄，不佔用 seq
+        await manager.deliver({"type": "bad", "data": {"value": object()}})
+        await manager.deliver(_event(2))
+        await _settle(manager)
+        return [client.websocket.sent for client in clients]
+
+    sent = run(scenario())
+    assert encoded == ["test_result", "bad", "test_result"]
+    assert sent[0] == sent[1] == sent[2]
+    assert [(frame["seq"], frame["data"]["serial_number"]) for frame in sent[0]] == [(1, "SN1"), (2, "SN2")]
@@ -0,0 +1,56 @@
+import gzip
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from app.wire_formats import UPLOAD_COLUMNS, get_wire_format
+
+
+def _rows():
+    return [
+        SimpleNamespace(id=i, device_id="DEV1", product_name="產品", serial_number=f"SN{i}", test_station="ST1",
+                        test_result="PASS", test_time=datetime(2025, 1, 1, 8, i), test_data='{"v": 5.0}',
+                        voltage=5.0, current=0.5, temperature=None)
+        for i in (1, 2)
+    ]
+
+
+def test_json_is_gzipped_records_envelope():
+    wire = get_wire_format("json")
+    assert wire.headers == {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+    payload = json.loads(gzip.decompress(wire.encode(_rows())))
+    assert [record["serial_number"] for record in payload["records"]] == ["SN1", "SN2"]
+    assert payload["records"][0]["test_time"] == "2025-01-01T08:01:00"
+    assert payload["records"][0]["product_name"] == "產品"
+
+
+def test_ndjson_has_one_record_per_line():
+    body = gzip.decompress(get_wire_format("ndjson+gzip").encode(_rows())).decode("utf-8")
+    lines = body.splitlines()
+    assert body.endswith("\n") and len(lines) == 2
+    assert set(json.loads(lines[1])) == set(UPLOAD_COLUMNS)
+
+
+def test_ndjson_zstd_round_trip():
+    zstandard = pytest.importorskip("zstandard")
+    wire = get_wire_format("ndjson+zstd")
+    assert wire.headers["Content-Encoding"] == "zstd"
+    body = zstandard.ZstdDecompressor().decompressobj().decompress(wire.encode(_rows()))
+    assert [json.loads(line)["id"] for line in body.decode("utf-8").splitlines()] == [1, 2]
+
+
+def test_msgpack_is_columnar_with_timestamps():
+    msgpack = pytest.importorskip("msgpack")
+    payload = msgpack.unpackb(get_wire_format("msgpack").encode(_rows()), timestamp=3)
+    assert payload["columns"] == UPLOAD_COLUMNS
+    row = dict(zip(payload["columns"], payload["rows"][0]))
+    assert row["serial_number"] == "SN1" and row["temperature"] is None
+    # naive test_time 視為本機時間
+    assert row["test_time"] == datetime(2025, 1, 1, 8, 1).astimezone()
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError, match="Unknown CLOUD_UPLOAD_FORMAT"):
+        get_wire_format("xml")
@@ -10,6 +10,9 @@ import PcbaIQC from './components/PcbaIQC';
 const { Header, Content, Sider } = Layout;
 const { Title } = Typography;
 
+// 只接收 PCBA 相關的 WebSocket 訊息
+const PCBA_SUBSCRIPTION = { types: ['pcba_event', 'uid_search'] };
+
 function App() {
   const [currentMenu, setCurrentMenu] = useState('dashboard');
   const [language, setLanguage] = useState('zh-TW');
@@ -25,7 +28,7 @@ function App() {
     // 如果沒有 PCBA 處理器，訊息會被忽略（這是預期的）
   }, [pcbaOnMessage]);
   
-  const { isConnected } = useWebSocket(globalOnMessage);
+  const { isConnected } = useWebSocket(globalOnMessage, PCBA_SUBSCRIPTION);
 
   const languageMenuItems = [
     { key: 'zh-TW', label: '繁體中文' },
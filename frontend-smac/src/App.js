@@ -1,4 +1,4 @@
-import React, { useState, useCallback } from 'react';
+import React, { useState, useCallback, useReducer } from 'react';
 import { Layout, Menu, Typography, Badge, Space, Dropdown } from 'antd';
 import {
   DashboardOutlined,
@@ -20,21 +20,47 @@ import './App.css';
 const { Header, Content, Sider } = Layout;
 const { Title } = Typography;
 
+// 只接收會影響記錄列表與 Dashboard 統計的 WebSocket 訊息
+const RECORD_SUBSCRIPTION = {
+  types: ['test_result', 'sensor_test_saved', 'sensor_test_updated', 'stats_delta'],
+};
+
+// 依 scope 累積 stats_delta：每個 delta 只帶變動的欄位，同一個 tick 內收到多則時
+// 不能只保留最後一則。每個欄位記錄最後變動時的序號，Dashboard 只套用尚未套用過的欄位
+const statsDeltaReducer = (state, delta) => {
+  const scope = state[delta.scope] || { seq: 0, fields: {} };
+  const seq = scope.seq + 1;
+  const fields = { ...scope.fields };
+  Object.entries(delta.changed || {}).forEach(([field, value]) => {
+    fields[field] = { value, seq };
+  });
+  return { ...state, [delta.scope]: { seq, fields } };
+};
+
 function App() {
   const [currentMenu, setCurrentMenu] = useState('dashboard');
   const [newRecordTrigger, setNewRecordTrigger] = useState(0);
+  const [statsDeltas, applyStatsDelta] = useReducer(statsDeltaReducer, {});
+  const [resyncTrigger, setResyncTrigger] = useState(0);
   const [language, setLanguage] = useState('zh-TW');
 
   const handleWebSocketMessage = useCallback((message) => {
     console.log('Received WebSocket message:', message);
+    if (message.type === 'stats_delta') {
+      applyStatsDelta(message.data);
+      return;
+    }
+    if (message.type === 'resync_required') {
+      setResyncTrigger((prev) => prev + 1);
+    }
     if (message.type === 'test_result' || message.type === 'sensor_test_saved' ||
-        message.type === 'sensor_test_updated') {
-      // 觸發列表重新載入
+        message.type === 'sensor_test_updated' || message.type === 'resync_required') {
+      // 觸發列表重新載入（斷線太久無法補送時也重新載入）
       setNewRecordTrigger((prev) => prev + 1);
     }
   }, []);
 
-  const { isConnected } = useWebSocket(handleWebSocketMessage);
+  const { isConnected } = useWebSocket(handleWebSocketMessage, RECORD_SUBSCRIPTION);
 
   const t = translations[language];
 
@@ -70,7 +96,7 @@ function App() {
   const renderContent = () => {
     switch (currentMenu) {
       case 'dashboard':
-        return <Dashboard language={language} />;
+        return <Dashboard language={language} statsDelta={statsDeltas.sensor_runs} resyncTrigger={resyncTrigger} />;
       case 'gateway-iqc':
         return <GatewayIQC language={language} />;
       case 'sensor-iqc':
@@ -82,7 +108,7 @@ function App() {
       case 'records':
         return <TestRecordList onNewRecord={newRecordTrigger} language={language} />;
       default:
-        return <Dashboard language={language} />;
+        return <Dashboard language={language} statsDelta={statsDeltas.sensor_runs} resyncTrigger={resyncTrigger} />;
     }
   };
 
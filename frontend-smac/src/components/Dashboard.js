@@ -1,10 +1,20 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { Card, Statistic, Row, Col, Badge } from 'antd';
 import { CheckCircleOutlined, CloseCircleOutlined, ClockCircleOutlined, HourglassOutlined } from '@ant-design/icons';
 import { testRecordsAPI } from '../services/api';
 import { translations } from '../i18n/locales';
 
-const Dashboard = ({ language = 'zh-TW' }) => {
+// stats_delta 欄位對應到畫面上的 state
+const DELTA_FIELDS = {
+  total: 'total',
+  passed: 'passed',
+  failed: 'failed',
+  pending: 'pending',
+  today_total: 'todayTotal',
+  pass_rate: 'passRate',
+};
+
+const Dashboard = ({ language = 'zh-TW', statsDelta = null, resyncTrigger = 0 }) => {
   const t = translations[language];
   
   const [stats, setStats] = useState({
@@ -15,8 +25,16 @@ const Dashboard = ({ language = 'zh-TW' }) => {
     todayTotal: 0,
     passRate: 0,
   });
+  // 已套用的 delta 序號；進入畫面前收到的 delta 已反映在 API 回傳的數值中，不再套用
+  const appliedSeqRef = useRef(statsDelta ? statsDelta.seq : 0);
+  const latestDeltaRef = useRef(statsDelta);
+  latestDeltaRef.current = statsDelta;
 
+  // 進入畫面時載入一次，之後由 WebSocket stats_delta 推送變動，不再定時輪詢；
+  // 斷線太久無法補送（resync_required）時 App 會遞增 resyncTrigger，重新載入完整數值
   useEffect(() => {
+    // 重新載入的數值已包含目前為止的 delta
+    appliedSeqRef.current = latestDeltaRef.current ? latestDeltaRef.current.seq : 0;
     const fetchStats = async () => {
       try {
         const response = await testRecordsAPI.getSensorTestRunStats();
@@ -35,10 +53,21 @@ const Dashboard = ({ language = 'zh-TW' }) => {
     };
 
     fetchStats();
-    const interval = setInterval(fetchStats, 30000); // 每30秒更新
+  }, [resyncTrigger]);
 
-    return () => clearInterval(interval);
-  }, []);
+  // statsDelta 為 App 依 scope 累積的 sensor_runs 欄位，{ seq, fields: { field: { value, seq } } }
+  useEffect(() => {
+    if (!statsDelta || statsDelta.seq <= appliedSeqRef.current) return;
+    const appliedSeq = appliedSeqRef.current;
+    appliedSeqRef.current = statsDelta.seq;
+    setStats((prev) => {
+      const next = { ...prev };
+      Object.entries(statsDelta.fields).forEach(([field, change]) => {
+        if (DELTA_FIELDS[field] && change.seq > appliedSeq) next[DELTA_FIELDS[field]] = change.value;
+      });
+      return next;
+    });
+  }, [statsDelta]);
 
   return (
     <Row gutter={16}>
@@ -32,7 +32,6 @@ const SensorIQC = ({ language = 'zh-TW' }) => {
   const [runningStage, setRunningStage] = useState(null);
   const [readingSerial, setReadingSerial] = useState(false);
   const readTimeoutRef = useRef(null);
-  const serialPollRef = useRef(null);
   const stageTimeoutRef = useRef(null);
   const stageTimeoutStageRef = useRef(null);
   const serialWleRef = useRef('');
@@ -141,6 +140,10 @@ const SensorIQC = ({ language = 'zh-TW' }) => {
 
     ws.onopen = () => {
       console.log('SensorIQC WebSocket connected');
+      ws.send(JSON.stringify({
+        action: 'subscribe',
+        types: ['sensor_serial_found', 'sensor_test_saved', 'sensor_event'],
+      }));
     };
 
     ws.onmessage = (event) => {
@@ -148,7 +151,6 @@ const SensorIQC = ({ language = 'zh-TW' }) => {
 
       // watcher 讀到兩組序號後自動填入
       if (payload.type === 'sensor_serial_found') {
-        clearInterval(serialPollRef.current);
         clearTimeout(readTimeoutRef.current);
         setSerialWle(payload.data.serial_wle);
         setSerialWba(payload.data.serial_wba || '');
@@ -298,7 +300,6 @@ const SensorIQC = ({ language = 'zh-TW' }) => {
     // 組件卸載時關閉 WebSocket
     return () => {
       ws.close();
-      clearInterval(serialPollRef.current);
       clearTimeout(readTimeoutRef.current);
       clearTimeout(stageTimeoutRef.current);
     };
@@ -314,7 +315,6 @@ const SensorIQC = ({ language = 'zh-TW' }) => {
     setSerialWle('');
     setSerialWba('');
     setReadingSerial(true);
-    clearInterval(serialPollRef.current);
     // duration 0 讓提示一直顯示，直到相同 key 的訊息把它換掉
     message.loading({
       content: t.sensorIQC.readingSerial,
@@ -323,8 +323,25 @@ const SensorIQC = ({ language = 'zh-TW' }) => {
     });
 
     clearTimeout(readTimeoutRef.current);
-    readTimeoutRef.current = setTimeout(() => {
-      clearInterval(serialPollRef.current);
+    readTimeoutRef.current = setTimeout(async () => {
+      // 逾時前查一次最新序號，以防 WebSocket 推送在斷線期間遺失
+      try {
+        const response = await testRecordsAPI.getLatestSensorSerial();
+        const { serial_wle: latestWle, serial_wba: latestWba } = response.data;
+        if (latestWle) {
+          setSerialWle(latestWle);
+          setSerialWba(latestWba || '');
+          setReadingSerial(false);
+          message.success({
+            content: `WLE: ${latestWle}`,
+            key: READ_SERIAL_MSG_KEY,
+            duration: 3,
+          });
+          return;
+        }
+      } catch (error) {
+        console.error('Failed to fetch latest serial:', error);
+      }
       setReadingSerial(false);
       message.warning({
         content: t.sensorIQC.readSerialTimeout,
@@ -333,35 +350,15 @@ const SensorIQC = ({ language = 'zh-TW' }) => {
       });
     }, READ_SERIAL_TIMEOUT_MS);
 
+    // 結果由 WebSocket sensor_serial_found 推送（見上方 onmessage），不再輪詢 /serial-found/latest
     try {
       await testRecordsAPI.readSensorSerial();
     } catch (error) {
       // The trigger request can fail transiently even though the watcher later
-      // succeeds in reading the actual serial. Keep polling for the real result
+      // succeeds in reading the actual serial. Keep waiting for the pushed result
       // and avoid showing a false "read serial failed" toast immediately.
       console.error('Failed to trigger serial read:', error);
     }
-
-    serialPollRef.current = setInterval(async () => {
-      try {
-        const response = await testRecordsAPI.getLatestSensorSerial();
-        const { serial_wle: latestWle, serial_wba: latestWba } = response.data;
-        if (latestWle) {
-          clearInterval(serialPollRef.current);
-          clearTimeout(readTimeoutRef.current);
-          setSerialWle(latestWle);
-          setSerialWba(latestWba || '');
-          setReadingSerial(false);
-          message.success({
-            content: `WLE: ${latestWle}`,
-            key: READ_SERIAL_MSG_KEY,
-            duration: 3,
-          });
-        }
-      } catch (pollError) {
-        console.error('Failed to poll latest serial:', pollError);
-      }
-    }, 500);
   };
 
   const runSingleStage = async (stageKey) => {
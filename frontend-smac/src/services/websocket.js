@@ -2,15 +2,35 @@ import { useEffect, useRef, useState, useCallback } from 'react';
 
 const WS_URL = process.env.REACT_APP_WS_URL || 'ws://localhost:8000/ws';
 
-export const useWebSocket = (onMessage) => {
+// 訂閱與續傳資訊放在 query string，伺服器在連線當下套用：
+// 補送的訊息依序送達，不會與即時訊息交錯
+const buildUrl = (subscription, resume) => {
+  const params = new URLSearchParams();
+  Object.entries(subscription || {}).forEach(([field, values]) => {
+    if (values && values.length) params.set(field, values.join(','));
+  });
+  if (resume.epoch && resume.lastSeq !== null) {
+    params.set('last_seq', resume.lastSeq);
+    params.set('epoch', resume.epoch);
+  }
+  const query = params.toString();
+  return query ? `${WS_URL}${WS_URL.includes('?') ? '&' : '?'}${query}` : WS_URL;
+};
+
+// subscription: { types, serials, stations }，伺服器只推送相符的訊息；未指定時接收所有訊息。
+// 重新連線時帶上最後收到的 seq，伺服器補送斷線期間的訊息；
+// 無法補送時會收到 resync_required，由 onMessage 決定是否重新載入完整資料
+export const useWebSocket = (onMessage, subscription) => {
   const [isConnected, setIsConnected] = useState(false);
   const [lastMessage, setLastMessage] = useState(null);
   const ws = useRef(null);
   const reconnectTimeout = useRef(null);
+  const subscriptionRef = useRef(subscription);
+  const resumeRef = useRef({ epoch: null, lastSeq: null });
 
   const connect = useCallback(() => {
     try {
-      ws.current = new WebSocket(WS_URL);
+      ws.current = new WebSocket(buildUrl(subscriptionRef.current, resumeRef.current));
 
       ws.current.onopen = () => {
         setIsConnected(true);
@@ -27,6 +47,15 @@ export const useWebSocket = (onMessage) => {
           console.warn('[WS] failed to parse message', e);
           return;
         }
+        if (message?.type === 'hello') {
+          resumeRef.current.epoch = message.data.epoch;
+          if (resumeRef.current.lastSeq === null) resumeRef.current.lastSeq = message.data.seq;
+          return;
+        }
+        if (message?.type === 'resync_required') {
+          resumeRef.current = { epoch: message.data.epoch, lastSeq: message.data.seq };
+        }
+        if (typeof message?.seq === 'number') resumeRef.current.lastSeq = message.seq;
         setLastMessage(message);
         if (message?.type === 'pcba_event') {
           // eslint-disable-next-line no-console
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+多測試站壓力測試
+以 asyncio 模擬 N 個虛擬測試站同時上傳測試資料，量測後端吞吐量與延遲
+
+使用方式:
+  python load_test.py --stations 200 --rate 0.5 --duration 60 --output results.json
+  python tester.py load --stations 200 ...   (同上)
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from tester import API_URL, TEST_STATION, ProductionTester
+
+
+class VirtualStation:
+    """虛擬測試站：依預先排定的 Poisson 到達時間上傳"""
+
+    def __init__(self, index: int, args: argparse.Namespace, stats: "LoadStats"):
+        self.tester = ProductionTester(f"{args.device_prefix}_{index:03d}", f"{TEST_STATION}_{index % 10}")
+        self.tester.serial_counter = 1000 + index * 1_000_000
+        self.args = args
+        self.stats = stats
+        self.sent_serials: List[str] = []
+
+    def next_payload(self) -> Dict[str, Any]:
+        data = self.tester.generate_test_data()
+        if self.sent_serials and random.random() < self.args.duplicate_ratio:
+            # 重送已上傳過的序號，觸發後端 upsert 的更新路徑
+            data["serial_number"] = random.choice(self.sent_serials)
+            self.stats.duplicates += 1
+        else:
+            self.sent_serials.append(data["serial_number"])
+        if self.args.fail_ratio is not None:
+            data["test_result"] = "FAIL" if random.random() < self.args.fail_ratio else "PASS"
+        return data
+
+    def schedule(self, duration: float) -> List[float]:
+        """預先產生整段測試的送出時間（相對起始的秒數，Poisson 到達）
+
+        送出時間與回應快慢無關（open-loop）：後端變慢時請求照樣依排程送出並堆積，
+        而不是等上一筆回應後才送下一筆，否則實際到達率會低於 --rate，延遲被低估。
+        """
+        offsets = []
+        # 錯開各站起始時間，避免所有站在第 0 秒同時送出
+        offset = random.uniform(0, 1 / self.args.rate)
+        while offset < duration:
+            offsets.append(offset)
+            offset += random.expovariate(self.args.rate)
+        return offsets
+
+    async def send(self, client: httpx.AsyncClient, scheduled_at: float):
+        # 延遲自排定的送出時間起算，包含在連線池或 event loop 中等待的時間
+        payload = self.next_payload()
+        try:
+            response = await client.post(self.args.url, json=payload)
+            self.stats.record(time.perf_counter() - scheduled_at, str(response.status_code),
+                              response.status_code in (201, 202))
+        except httpx.HTTPError as e:
+            self.stats.record(time.perf_counter() - scheduled_at, type(e).__name__, False)
+
+    async def run(self, client: httpx.AsyncClient, started: float):
+        tasks = []
+        for offset in self.schedule(self.args.duration):
+            delay = started + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.send(client, started + offset)))
+        await asyncio.gather(*tasks)
+
+
+class LoadStats:
+    """收集每個請求的延遲與結果"""
+
+    def __init__(self):
+        self.latencies_ms: List[float] = []
+        self.outcomes: Counter = Counter()
+        self.errors = 0
+        self.duplicates = 0
+
+    def record(self, seconds: float, outcome: str, ok: bool):
+        self.latencies_ms.append(seconds * 1000)
+        self.outcomes[outcome] += 1
+        if not ok:
+            self.errors += 1
+
+    @staticmethod
+    def percentile(values: List[float], pct: float) -> Optional[float]:
+        if not values:
+            return None
+        # nearest-rank：第 ceil(p/100 × n) 小的值
+        rank = max(0, min(len(values) - 1, math.ceil(pct / 100 * len(values)) - 1))
+        return round(values[rank], 2)
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        latencies = sorted(self.latencies_ms)
+        total = len(latencies)
+        return {
+            "requests": total,
+            "errors": self.errors,
+            "error_rate": round(self.errors / total, 4) if total else 0,
+            "duplicates_sent": self.duplicates,
+            "elapsed_seconds": round(elapsed, 2),
+            "throughput_rps": round(total / elapsed, 2) if elapsed else 0,
+            "latency_ms": {
+                "min": round(latencies[0], 2) if latencies else None,
+                "mean": round(sum(latencies) / total, 2) if total else None,
+                "p50": self.percentile(latencies, 50),
+                "p95": self.percentile(latencies, 95),
+                "p99": self.percentile(latencies, 99),
+                "max": round(latencies[-1], 2) if latencies else None,
+            },
+            "outcomes": dict(self.outcomes),
+        }
+
+
+async def run_load_test(args: argparse.Namespace) -> Dict[str, Any]:
+    stats = LoadStats()
+    stations = [VirtualStation(i, args, stats) for i in range(args.stations)]
+    limits = httpx.Limits(max_connections=args.stations, max_keepalive_connections=args.stations)
+
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(station.run(client, started) for station in stations))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "label": args.label,
+        "started_at": datetime.now().isoformat(),
+        "config": {
+            "url": args.url,
+            "stations": args.stations,
+            "rate_per_station": args.rate,
+            "duration_seconds": args.duration,
+            "fail_ratio": args.fail_ratio,
+            "duplicate_ratio": args.duplicate_ratio,
+            "timeout_seconds": args.timeout,
+        },
+        "client": {"python": platform.python_version(), "host": platform.node()},
+        "results": stats.summary(elapsed),
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="模擬多個測試站同時上傳的壓力測試")
+    parser.add_argument("--url", default=API_URL, help="上傳 API URL")
+    parser.add_argument("--stations", type=int, default=50, help="虛擬測試站數量")
+    parser.add_argument("--rate", type=float, default=1.0, help="每站平均每秒上傳次數（Poisson）")
+    parser.add_argument("--duration", type=float, default=30.0, help="測試秒數")
+    parser.add_argument("--fail-ratio", type=float, default=None,
+                        help="FAIL 比例（0~1）；未指定時依模擬量測值判定")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0,
+                        help="重送已上傳序號的比例（0~1）")
+    parser.add_argument("--timeout", type=float, default=10.0, help="單一請求逾時秒數")
+    parser.add_argument("--device-prefix", default="LOAD", help="虛擬設備 ID 前綴")
+    parser.add_argument("--label", default="", help="結果標記，例如後端版本")
+    parser.add_argument("--output", default=None, help="結果 JSON 輸出路徑")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    print(f"🚦 壓力測試: {args.stations} 站 × {args.rate}/s，持續 {args.duration}s → {args.url}")
+    report = asyncio.run(run_load_test(args))
+
+    results = report["results"]
+    latency = results["latency_ms"]
+    print("-" * 60)
+    print(f"請求數: {results['requests']}  錯誤: {results['errors']} ({results['error_rate']:.2%})")
+    print(f"吞吐量: {results['throughput_rps']} req/s")
+    print(f"延遲 (ms): p50={latency['p50']}  p95={latency['p95']}  p99={latency['p99']}  max={latency['max']}")
+    print(f"回應: {results['outcomes']}")
+
+    output = args.output or f"load_test_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"📄 結果已儲存: {output}")
+
+
+if __name__ == "__main__":
+    main()
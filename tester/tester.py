@@ -9,7 +9,7 @@ import time
 import random
 import json
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List
 import os
 from dotenv import load_dotenv
 
@@ -19,6 +19,8 @@ load_dotenv()
 API_URL = os.getenv('API_URL', 'http://localhost:8000/api/test-records/')
 DEVICE_ID = os.getenv('DEVICE_ID', 'TESTER_001')
 TEST_STATION = os.getenv('TEST_STATION', 'STATION_A')
+BULK_API_URL = os.getenv('BULK_API_URL', API_URL.rstrip('/') + '/bulk')
+BULK_BATCH_SIZE = int(os.getenv('BULK_BATCH_SIZE', '500'))
 
 
 class ProductionTester:
@@ -28,6 +30,8 @@ class ProductionTester:
         self.device_id = device_id
         self.test_station = test_station
         self.serial_counter = 1000
+        # 連線中斷期間未成功上傳的資料，恢復後以 bulk API 一次補傳
+        self.backlog: List[Dict[str, Any]] = []
         
     def generate_test_data(self) -> Dict[str, Any]:
         """生成模擬測試資料"""
@@ -78,18 +82,47 @@ class ProductionTester:
         try:
             response = requests.post(API_URL, json=test_data, timeout=5)
             
-            if response.status_code == 201:
+            if response.status_code in (201, 202):
                 print(f"✅ 上傳成功: {test_data['serial_number']} - {test_data['test_result']}")
                 return True
             else:
                 print(f"❌ 上傳失敗: HTTP {response.status_code}")
                 print(f"   錯誤訊息: {response.text}")
+                if response.status_code >= 500:
+                    self.backlog.append(test_data)
                 return False
                 
         except requests.exceptions.RequestException as e:
             print(f"❌ 連線錯誤: {e}")
+            self.backlog.append(test_data)
+            print(f"   已暫存，待補傳筆數: {len(self.backlog)}")
             return False
     
+    def flush_backlog(self) -> bool:
+        """以 bulk API 補傳暫存的測試結果，全部送出後回傳 True"""
+        while self.backlog:
+            batch = self.backlog[:BULK_BATCH_SIZE]
+            try:
+                response = requests.post(BULK_API_URL, json={"records": batch}, timeout=30)
+            except requests.exceptions.RequestException as e:
+                print(f"❌ 補傳連線錯誤: {e}")
+                return False
+
+            if response.status_code != 200:
+                print(f"❌ 補傳失敗: HTTP {response.status_code}")
+                print(f"   錯誤訊息: {response.text}")
+                return False
+
+            summary = response.json()
+            print(f"📦 補傳完成: 新增 {summary['inserted']} / 更新 {summary['updated']} / "
+                  f"拒絕 {summary['rejected']}")
+            for result in summary["results"]:
+                if result["status"] == "rejected":
+                    print(f"   ⚠️  {result.get('serial_number')}: {result.get('error')}")
+            # rejected 為資料本身錯誤，重送也不會成功，因此整批移出 backlog
+            del self.backlog[:len(batch)]
+        return True
+    
     def run_continuous_test(self, interval: float = 5.0):
         """連續執行測試（模擬產線運作）"""
         print(f"🔧 測試程式啟動")
@@ -101,6 +134,10 @@ class ProductionTester:
         
         try:
             while True:
+                # 先補傳斷線期間累積的資料
+                if self.backlog:
+                    self.flush_backlog()
+
                 # 生成測試資料
                 test_data = self.generate_test_data()
                 
@@ -140,6 +177,9 @@ def run_batch_test(count: int = 10, interval: float = 1.0):
         if i < count - 1:
             time.sleep(interval)
     
+    if tester.backlog:
+        tester.flush_backlog()
+    
     print(f"\n✅ 批次測試完成，共上傳 {count} 筆資料")
 
 
@@ -158,6 +198,11 @@ if __name__ == "__main__":
             count = int(sys.argv[2]) if len(sys.argv) > 2 else 10
             run_batch_test(count)
             
+        elif mode == "load":
+            # 多測試站壓力測試
+            from load_test import main as run_load_test
+            run_load_test(sys.argv[2:])
+            
         elif mode == "continuous":
             # 連續測試
             interval = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
@@ -169,6 +214,7 @@ if __name__ == "__main__":
             print("  python tester.py single          - 執行單次測試")
             print("  python tester.py batch [數量]    - 執行批次測試")
             print("  python tester.py continuous [間隔] - 連續測試模式")
+            print("  python tester.py load [選項]      - 多測試站壓力測試（詳見 --help）")
     else:
         # 預設執行連續測試
         tester = ProductionTester(DEVICE_ID, TEST_STATION)